@@ -0,0 +1,79 @@
+"""
+Benchmark loading a commit log into SQLite with different numbers of
+ingest workers, and report rows per second for each.
+
+    python benchmark_ingest.py                      # a generated log
+    python benchmark_ingest.py output/o-r_git_log.jsonl
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import logging
+import argparse
+import tempfile
+from contextlib import closing
+from can_you_git_to_that.export_git import _open_log_for_append, _write_log_record
+from can_you_git_to_that.import_to_db import _insert_data, _migrate_schema
+
+
+def generate_log(log_filename, commits, files_per_commit):
+    random.seed(0)
+    paths = [f"src/module_{i // 20}/file_{i}.py" for i in range(2000)]
+    with _open_log_for_append(log_filename) as (output_file, index_file):
+        for i in range(commits):
+            record = {
+                "sha": f"{i:040x}",
+                "timestamp": 1500000000 + i * 60,
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(1500000000 + i * 60)),
+                "author": f"author {i % 50}",
+                "email": f"author{i % 50}@example.com",
+                "message": f"commit {i}\n\nwith a body",
+                "files": [[random.randint(0, 200), random.randint(0, 200), path]
+                          for path in random.sample(paths, files_per_commit)],
+            }
+            _write_log_record(output_file, index_file, record, i + 1)
+
+
+def run_once(log_filename, workers, directory):
+    db_path = os.path.join(directory, f"bench_{workers}.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    with closing(sqlite3.connect(db_path)) as conn:
+        # the tables come from the schema migrations, which aren't timed
+        _migrate_schema(conn)
+        start = time.perf_counter()
+        _insert_data({"ingest_workers": workers}, conn, log_filename)
+        elapsed = time.perf_counter() - start
+        rows = conn.execute("SELECT COUNT(*) FROM commits").fetchone()[0]
+    return rows, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", nargs="?", help="commit log to load, a generated one if left out")
+    parser.add_argument("--commits", type=int, default=200000, help="commits in the generated log")
+    parser.add_argument("--files", type=int, default=5, help="files per commit in the generated log")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        log_filename = args.log
+        if log_filename is None:
+            log_filename = os.path.join(directory, "bench_git_log.jsonl")
+            generate_log(log_filename, args.commits, args.files)
+        size_mb = os.path.getsize(log_filename) / (1024 * 1024)
+        print(f"{log_filename}: {size_mb:.1f} MB, {os.cpu_count()} CPUs")
+
+        workers = 1
+        print(f"{'workers':>8} {'rows':>10} {'seconds':>9} {'rows/s':>10}")
+        while workers <= args.max_workers:
+            rows, elapsed = run_once(log_filename, workers, directory)
+            print(f"{workers:>8} {rows:>10} {elapsed:>9.2f} {rows / elapsed:>10.0f}")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
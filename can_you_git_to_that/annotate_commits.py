@@ -1,110 +1,335 @@
-import sqlite3
 import logging
-import time
 import os
 import hashlib
+import base64
+import json
 from datetime import datetime
-from github import Github
-from .llm import summarize_diff, shorter_summarize_diff, classify_description, summarize_pr
-
-def generate_descriptions(access_token, repo_owner, repo_name, max_length, ai_model):
-    conn = sqlite3.connect(f'output/{repo_owner}-{repo_name}.db')
+from .github_fetch import get_fetcher
+from .local_git import LocalDiffProvider
+from .llm import summarize_diff, shorter_summarize_diff, classify_description, classify_descriptions, summarize_pr, combine_pr_summaries, map_ordered, get_template_tokens
+from .llm_config import num_tokens_from_string
+from .diff_reducer import get_token_budget
+from .db import get_repo_connection
+from .result_writer import ResultWriter, get_diffs_log_path
+from .diff_fingerprint import normalize_diff, fingerprint_text
+from .diff_clusters import PatchClusterer
+from .tag_model import update_tag_model
+
+# patch fingerprints saved per transaction while describing
+FINGERPRINT_BATCH_SIZE = 200
+
+def generate_descriptions(access_token, repo_owner, repo_name, max_length, ai_model, diff_source="github", repo_local_full_path=None):
+    diff_provider = None
+    if diff_source == "local":
+        diff_provider = LocalDiffProvider(repo_local_full_path)
+    elif diff_source != "github":
+        raise ValueError(f"Unknown diff_source: {diff_source}")
+
+    conn = get_repo_connection(repo_owner, repo_name)
     cursor = conn.cursor()
 
-    rows = _get_commits(cursor)
+    rows = _get_undescribed_commits(cursor)
 
-    logging.info("loaded for %s commits", len(rows))
+    logging.info("loaded %s files without descriptions", len(rows))
 
+    # group the work by commit, so each commit's diffs are fetched once
+    pending = {}
     for row in rows:
-        id = row[0]
         sha = row[1]
         filename = row[2]
-        description = row[3]
         if _is_code_file(filename):
-            if description is None or description.strip() == "":
-                logging.info("Generating commit diff description for %s %s %s", id, sha, filename)
-                summary = _annotate_code_file(repo_owner, repo_name, sha, filename, access_token, ai_model, max_length=max_length)
-                logging.info("Summary:\n%s", summary)
-                success = _write_diff_summary_to_db(repo_owner, repo_name, sha, filename, summary)
-                if not success:
-                    logging.error("Error writing summary to DB")
-                else:
-                    logging.debug("Summary successfully written")
-
-def _write_diff_summary_to_db(repo_owner, repo_name, commit_hash, filename, summary):
-    conn = sqlite3.connect(f'output/{repo_owner}-{repo_name}.db')
+            pending.setdefault(sha, []).append(row)
+    logging.info("%s files to describe across %s commits", sum(len(v) for v in pending.values()), len(pending))
+
+    try:
+        _describe_pending(access_token, repo_owner, repo_name, pending, max_length, ai_model, diff_provider)
+    finally:
+        if diff_provider is not None:
+            diff_provider.close()
+
+def _describe_pending(access_token, repo_owner, repo_name, pending, max_length, ai_model, diff_provider=None):
+    # Diffs are fetched (ahead, by the prefetcher) and fingerprinted while the
+    # LLM works on the ones before them. A file whose patch already has a
+    # description, from an earlier run or this one, gets it; one whose patch
+    # matches or nearly matches a patch still being described waits for that
+    # summary. Only a patch unlike any seen so far goes to the LLM, so
+    # cherry-picks, backports, mirrored commits, renames and codemods are
+    # summarized once.
+    conn = get_repo_connection(repo_owner, repo_name)
     cursor = conn.cursor()
+    ai_service = ai_model.split("|")[0]
+    clusterer = PatchClusterer()
+    # {fingerprint: [rows]} in the order the patches are first seen; files
+    # with neither a diff nor content can't be matched and get a group each
+    groups = {}
+    # {fingerprint: description} from earlier runs
+    reused = {}
+    # {fingerprint: index of its cluster}, and {cluster index: summary} once
+    # the LLM has answered
+    cluster_of = {}
+    summaries = {}
+    unsaved_fingerprints = []
+    counts = {"files": 0, "reused": 0}
+
+    with ResultWriter(repo_owner, repo_name) as writer:
+
+        def to_describe():
+            # runs on this thread, between the summaries coming back, so it
+            # shares the state above with the loop below
+            for sha in _prefetch_commits(access_token, repo_owner, repo_name, list(pending), diff_provider):
+                for row in pending[sha]:
+                    counts["files"] += 1
+                    fetched = _get_file_diff_and_content(access_token, repo_owner, repo_name, sha, row[2], diff_provider) or (None, None)
+                    text = normalize_diff(*fetched)
+                    if text is None:
+                        fingerprint = f"row:{row[0]}"
+                    else:
+                        fingerprint = fingerprint_text(text)
+                        unsaved_fingerprints.append((row[0], fingerprint))
+
+                    if fingerprint in groups:
+                        groups[fingerprint].append(row)
+                    else:
+                        groups[fingerprint] = [row]
+                        description = _get_fingerprint_description(cursor, fingerprint) if text is not None else None
+                        if description is not None:
+                            reused[fingerprint] = description
+                        else:
+                            index, started = clusterer.add(fingerprint, text)
+                            cluster_of[fingerprint] = index
+                            if started:
+                                yield index, row, fetched
+                                continue
+
+                    if fingerprint in reused:
+                        counts["reused"] += 1
+                        writer.write_summary(row[1], row[2], reused[fingerprint])
+                    elif cluster_of[fingerprint] in summaries:
+                        writer.write_summary(row[1], row[2], summaries[cluster_of[fingerprint]])
+                    # otherwise it's written with its cluster's summary
+
+                if len(unsaved_fingerprints) >= FINGERPRINT_BATCH_SIZE:
+                    _save_fingerprints(conn, unsaved_fingerprints)
+
+        # the LLM calls run on a pool sized to the service's limits, one per
+        # cluster, while the summaries are handed, in order, to the writer
+        # thread for every file in the cluster so far
+        def annotate(item):
+            index, row, fetched = item
+            id, sha, filename = row[:3]
+            logging.info("Generating commit diff description for %s %s %s", id, sha, filename)
+            summary = _annotate_code_file(repo_owner, repo_name, sha, filename, access_token, ai_model,
+                                          max_length=max_length, diff_provider=diff_provider, fetched=fetched)
+            return index, summary
 
-    # Check if the row exists
+        try:
+            for index, summary in map_ordered(ai_service, annotate, to_describe()):
+                logging.info("Summary:\n%s", summary)
+                summaries[index] = summary
+                for fingerprint, _ in clusterer.clusters[index]:
+                    for row in groups[fingerprint]:
+                        writer.write_summary(row[1], row[2], summary)
+        finally:
+            _save_fingerprints(conn, unsaved_fingerprints)
+
+    clusters = clusterer.clusters
+    clustered = sum(len(cluster) for cluster in clusters)
+    logging.info("Duplicate diffs: %d files described, %d distinct patches, %d files match earlier descriptions, "
+                 "%d LLM calls saved", counts["files"], len(groups), counts["reused"], counts["files"] - (len(groups) - len(reused)))
+    report_path = _write_cluster_report(repo_owner, repo_name, clusters, groups)
+    logging.info("Near-duplicate diffs: %d distinct patches in %d clusters, %d more LLM calls saved, report in %s",
+                 clustered, len(clusters), clustered - len(clusters), report_path)
+
+def _write_cluster_report(repo_owner, repo_name, clusters, groups):
+    # one block per cluster of more than one patch, biggest savings first
+    report_path = f"output/{repo_owner}-{repo_name}_diff_clusters.txt"
+    patches = sum(len(cluster) for cluster in clusters)
+    merged = sorted((cluster for cluster in clusters if len(cluster) > 1), key=len, reverse=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        f.write(f"{patches} distinct patches in {len(clusters)} clusters, "
+                f"{patches - len(clusters)} LLM calls saved\n")
+        for number, cluster in enumerate(merged, 1):
+            f.write(f"\ncluster {number}: {len(cluster)} patches, {len(cluster) - 1} LLM calls saved\n")
+            for fingerprint, similarity in cluster:
+                for row in groups[fingerprint]:
+                    f.write(f"  {similarity:.2f}\t{row[1]}\t{row[2]}\n")
+    return report_path
+
+def _save_fingerprints(conn, rows):
+    # (commit_files id, fingerprint) pairs, cleared once they're written
+    if not rows:
+        return
+    conn.executemany('''
+        INSERT OR REPLACE INTO patch_fingerprints (commit_file_id, fingerprint) VALUES (?, ?)
+    ''', rows)
+    conn.commit()
+    rows.clear()
+
+def _get_fingerprint_description(cursor, fingerprint):
+    # a description already written for the same patch in an earlier run
     cursor.execute('''
-        SELECT COUNT(*) FROM commits WHERE commit_hash = ? AND filename = ?
-    ''', (commit_hash, filename))
-    row_count = cursor.fetchone()[0]
-
-    if row_count > 0:
-        # Update the existing row
-        cursor.execute('''
-            UPDATE commits
-            SET description = ?
-            WHERE commit_hash = ? AND filename = ?
-        ''', (summary, commit_hash, filename))
-        conn.commit()
-
+        SELECT f.description
+        FROM patch_fingerprints pf
+        JOIN commit_files f ON f.id = pf.commit_file_id
+        WHERE pf.fingerprint = ? AND f.description IS NOT NULL AND f.description != ''
+        LIMIT 1
+    ''', (fingerprint,))
+    row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+def _prefetch_commits(access_token, repo_owner, repo_name, commit_shas, diff_provider=None):
+    # yields each sha once its diffs are in the cache, with the fetcher's
+    # worker pool fetching the next few commits in the background, or with
+    # a single git process producing them from the local clone
+    if diff_provider is not None:
+        return _prefetch_local_commits(diff_provider, commit_shas)
+
+    fetcher = get_fetcher(access_token)
+
+    def prefetch(commit_sha):
         try:
-            # Save the summary to a log file, so we can rely on that to 
-            # rebuild if we need to
-            f = open(f"output/{repo_owner}-{repo_name}_diffs_log.txt", "a")        
-            now = time.time()  # Ensure 'now' is defined and is a valid timestamp
-            timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
-            f.write(f"{timestamp}\t{filename}\t{commit_hash}\t{summary}\n")
-            f.close
+            _get_commit_files(access_token, repo_owner, repo_name, commit_sha)
         except Exception as e:
-            logging.error("Error trying to write summary to log for %s, %s", filename, commit_hash)
+            logging.error("Error: %s prefetching diffs for %s", e, commit_sha)
+        return commit_sha
+
+    return fetcher.map_ordered(prefetch, commit_shas)
+
+def _prefetch_local_commits(diff_provider, commit_shas):
+    todo = [sha for sha in commit_shas if _read_commit_manifest(sha, "local") is None]
+    done = set(commit_shas) - set(todo)
+    local_files = diff_provider.iter_commit_files(todo)
+    answer = None
+    for sha in commit_shas:
+        if sha not in done:
+            # diff-tree answers once per commit, in the order it was asked,
+            # but skips shas the clone doesn't have; an answer for a later sha
+            # means this one was skipped, and is kept for its own turn
+            if answer is None:
+                answer = next(local_files, None)
+            if answer is not None and answer[0] == sha:
+                _cache_local_commit_files(*answer)
+                answer = None
+            else:
+                logging.error("Commit %s not found in the local clone", sha)
+            done.add(sha)
+        yield sha
+
+def _cache_local_commit_files(commit_sha, files):
+    blobs = {}
+    for filename, (file_diff, blob_spec) in files.items():
+        if file_diff is not None:
+            _write_diff_to_disk(commit_sha, filename, file_diff, None)
+        else:
+            blobs[filename] = blob_spec
+    _write_commit_manifest(commit_sha, "local", blobs)
+    return blobs
 
-        return True
-    
-    else:
-        logging.error("Error trying to save summary for %s, %s not found in DB?", filename, commit_hash)
+def _write_commit_manifest(commit_sha, source, blobs):
+    # blob specs are object ids or "<commit>:<path>" for a local clone, and
+    # blob shas for GitHub, so the manifest says which source wrote it
+    os.makedirs("output/cache", exist_ok=True)
+    with open(f"output/cache/{commit_sha}.json", "w", encoding="utf-8") as f:
+        json.dump({"source": source, "blobs": blobs}, f)
+
+def _read_commit_manifest(commit_sha, source):
+    # the commit's blobs, or None if it hasn't been fetched from this source
+    manifest_path = f"output/cache/{commit_sha}.json"
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("source") != source:
+        return None
+    return manifest["blobs"]
+
+def _get_commit_files(access_token, repo_owner, repo_name, commit_sha, diff_provider=None):
+    """
+    Fetch a commit once and cache the patch of every file in it. Files with
+    no patch (binary or too large) are listed in a per-commit manifest with
+    their blob sha, so their content can be fetched if they're annotated.
+    """
+    blobs = _read_commit_manifest(commit_sha, "github" if diff_provider is None else "local")
+    if blobs is not None:
+        return blobs
+
+    if diff_provider is not None:
+        for local_sha, files in diff_provider.iter_commit_files([commit_sha]):
+            return _cache_local_commit_files(local_sha, files)
+        return {}
+
+    fetcher = get_fetcher(access_token)
+    full_repo_name = f"{repo_owner}/{repo_name}"
+    logging.info("Fetching diffs from Github for %s", commit_sha)
+    commit = fetcher.get_commit(full_repo_name, commit_sha)
+
+    blobs = {}
+    for file in commit.get("files", []):
+        file_diff = file.get("patch")
+        if file_diff is not None:
+            _write_diff_to_disk(commit_sha, file["filename"], file_diff, None)
+        else:
+            blobs[file["filename"]] = file["sha"]
 
-    conn.close()
-    return False
+    _write_commit_manifest(commit_sha, "github", blobs)
+    return blobs
 
-def _get_file_diff_and_content(access_token, repo_owner, repo_name, commit_sha, file_name):
+def _get_file_diff_and_content(access_token, repo_owner, repo_name, commit_sha, file_name, diff_provider=None):
     try:
-        unique_hash = _get_diff_hash(commit_sha, file_name)
-        # Check if the diff has already been fetched and saved to disk
-        if os.path.exists(f"output/cache/{unique_hash}.txt"):
-            f = open(f"output/cache/{unique_hash}.txt", "r", encoding="utf-8")
-            diff = f.read()
-            f.close()
+        cached = _read_diff_from_disk(commit_sha, file_name)
+        if cached is not None:
             logging.info("Diff found in local cache for %s %s", file_name, commit_sha)
-            return diff, None
-        
-        g = Github(access_token)
-        repo = g.get_repo(f"{repo_owner}/{repo_name}")
-        logging.info("Fetching diff from Github for %s %s", file_name, commit_sha)
-        commit = repo.get_commit(commit_sha)
-
-        # Initialize variables to store the file changes and content
-        file_diff = None
-        file_content = None
-
-        # Iterate through the files in the commit
-        for file in commit.files:
-            if file.filename == file_name:
-                file_diff = file.patch
-                # Fetch the file content - but only if there's no diff
-                if file_diff is None:
-                    blob = repo.get_git_blob(file.sha)    
-                    file_content = blob.content
-                break
-        
-        _write_diff_to_disk(commit_sha, file_name, file_diff, file_content)
-        return file_diff, file_content
+            return cached, None
+        cached = _read_content_from_disk(commit_sha, file_name)
+        if cached is not None:
+            logging.info("Content found in local cache for %s %s", file_name, commit_sha)
+            return None, cached
+
+        # fetching the commit fills the cache for all of its files
+        blobs = _get_commit_files(access_token, repo_owner, repo_name, commit_sha, diff_provider)
+        cached = _read_diff_from_disk(commit_sha, file_name)
+        if cached is not None:
+            return cached, None
+
+        # Fetch the file content - but only if there's no diff
+        if file_name not in blobs:
+            logging.error("%s not found in commit %s", file_name, commit_sha)
+            return None, None
+        if diff_provider is not None:
+            file_content = diff_provider.read_blob(blobs[file_name])
+        else:
+            fetcher = get_fetcher(access_token)
+            blob = fetcher.get_json(f"/repos/{repo_owner}/{repo_name}/git/blobs/{blobs[file_name]}", immutable=True)
+            file_content = _decode_blob(blob)
+
+        _write_diff_to_disk(commit_sha, file_name, None, file_content)
+        return None, file_content
         
     except Exception as e:
         logging.error("Error: %s for getting diff for %s %s", e, file_name, commit_sha)
 
+def _read_diff_from_disk(commit_sha, file_name):
+    unique_hash = _get_diff_hash(commit_sha, file_name)
+    # Check if the diff has already been fetched and saved to disk
+    if not os.path.exists(f"output/cache/{unique_hash}.txt"):
+        return None
+    with open(f"output/cache/{unique_hash}.txt", "r", encoding="utf-8") as f:
+        return f.read()
+
+def _read_content_from_disk(commit_sha, file_name):
+    # the content of a file with no patch, kept apart from the diffs so it's
+    # never read back as one
+    unique_hash = _get_diff_hash(commit_sha, file_name)
+    if not os.path.exists(f"output/cache/{unique_hash}.content.txt"):
+        return None
+    with open(f"output/cache/{unique_hash}.content.txt", "r", encoding="utf-8") as f:
+        return f.read()
+
+def _decode_blob(blob):
+    if blob.get("encoding") == "base64":
+        return base64.b64decode(blob["content"]).decode("utf-8", errors="replace")
+    return blob["content"]
+
 def _get_diff_hash(commit_sha, file_name):
     combined_string = f"{commit_sha}-{file_name}"    
     # Generate a SHA-256 hash of the combined string
@@ -115,25 +340,30 @@ def _write_diff_to_disk(commit_sha, file_name, file_diff, file_content):
     unique_hash = _get_diff_hash(commit_sha, file_name)
     # make sure directory exists
     os.makedirs("output/cache", exist_ok=True)
-    f = open(f"output/cache/{unique_hash}.txt", "w")
     if file_diff is not None:
-        f.write(file_diff)
+        with open(f"output/cache/{unique_hash}.txt", "w", encoding="utf-8") as f:
+            f.write(file_diff)
     else:
-        f.write(file_content)
-    f.close()
+        with open(f"output/cache/{unique_hash}.content.txt", "w", encoding="utf-8") as f:
+            f.write(file_content)
 
     
     # Additional code to write the diff and content to disk can go here
 
-def _annotate_code_file(repo_parent, repo_name, commit_sha, filename, access_token, ai_model, max_length=800):
+def _annotate_code_file(repo_parent, repo_name, commit_sha, filename, access_token, ai_model, max_length=800, diff_provider=None, fetched=None):
     logging.info("Annotating commit changes for %s", filename)
-    diff, file_sample = _get_file_diff_and_content(access_token, repo_parent, repo_name, commit_sha, filename)
+    # fetched is the (diff, content) pair, when the caller already has it
+    if fetched is None:
+        fetched = _get_file_diff_and_content(access_token, repo_parent, repo_name, commit_sha, filename, diff_provider)
+    diff, file_sample = fetched
     
     ai_info = ai_model.split("|")
     ai_service = ai_info[0]
     ai_model = ai_info[1]
 
-    summary = summarize_diff(filename, diff, file_sample, ai_service, ai_model)
+    # a garbage summary isn't cached, so the next run asks again
+    summary = summarize_diff(filename, diff, file_sample, ai_service, ai_model,
+                             validate=lambda answer: not answer.strip().startswith("@@@"))
     logging.info("summary generation\t%s\t%s:\n****\n%s\n***\n", filename, commit_sha, summary)
 
     if summary.strip().startswith("@@@"):
@@ -201,53 +431,102 @@ def _is_code_file(path):
     return True
 
 def generate_pr_descriptions(repo_owner, repo_name, max_length, ai_info):
-    conn = sqlite3.connect(f'output/{repo_owner}-{repo_name}.db')
+    conn = get_repo_connection(repo_owner, repo_name)
     cursor = conn.cursor()
-    
-    query = """
-        SELECT 
-            DISTINCT pr.merge_commit_sha,
-            pr.number as pr_number
-        FROM 
-            pull_requests pr
-        WHERE 
-            pr.description IS NULL
-        ORDER BY 
-            pr.id ASC;
-    """
-    prs = {}
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    for row in rows:
-        commit_hash = row[0]
-        pr_id = row[1]
-        data = []
-        commit_query = """
-            SELECT 
-                filename, description
-            FROM
-                commits
-            WHERE
-                commit_hash = ?                
-        """
-        cursor.execute(commit_query, (commit_hash,))
-        commit_rows = cursor.fetchall()
-        for commit_row in commit_rows:
-            if commit_row[1] is not None:
-                data.append(commit_row[1])
-        prs[pr_id] = data    
-    conn.close()
+
+    prs = _get_pr_file_descriptions(cursor)
+    logging.info("loaded %s PRs without summaries, %s file descriptions", len(prs), sum(len(v) for v in prs.values()))
+    # nothing to summarize yet; these get picked up once their files are described
+    undescribed = [pr_id for pr_id, descriptions in prs.items() if not descriptions]
+    for pr_id in undescribed:
+        del prs[pr_id]
+    if undescribed:
+        logging.info("Skipping %s PRs with no file descriptions yet", len(undescribed))
+
     ai_service = ai_info.split("|")[0]
     ai_model = ai_info.split("|")[1]
-    for pr_id in prs:
-        description_text = "\n--\n".join(prs[pr_id])
-        summary = summarize_pr(description_text, ai_service, ai_model)
+    # what's left of a prompt once the instructions are in
+    budget = get_token_budget(ai_model, get_template_tokens(["summarize_pr", "combine_pr_summaries"],
+                                                            {"prs": "", "summaries": []}))
+
+    # PRs run on the LLM worker pool, and a PR too big for one prompt is
+    # summarized in chunks, one after another on its worker, that are then
+    # combined; the other workers keep the pool busy meanwhile
+    def summarize(pr):
+        pr_id, descriptions = pr
+        return pr_id, _summarize_pr_chunks(pr_id, descriptions, budget, ai_service, ai_model)
+
+    for pr_id, summary in map_ordered(ai_service, summarize, prs.items()):
         logging.info("Summary for PR %s: %s", pr_id, summary)
         _write_pr_summary_to_db(repo_owner, repo_name, pr_id, summary)
 
+def _get_pr_file_descriptions(cursor):
+    # {pr number: [file descriptions]} for every PR without a summary, from
+    # its merge commit and, when the GraphQL backend recorded them, the
+    # commits on its branch; a description repeated across those commits
+    # (the merge and the branch commit it brings in) is only used once
+    query = """
+        WITH pr_commits AS (
+            SELECT pr.id AS pr_order, pr.number, pr.merge_commit_sha AS commit_hash
+            FROM pull_requests pr
+            WHERE pr.description IS NULL
+            UNION
+            SELECT pr.id, pr.number, prc.commit_hash
+            FROM pull_requests pr
+            JOIN pull_request_commits prc ON prc.pr_number = pr.number
+            WHERE pr.description IS NULL
+        )
+        SELECT pc.number, f.description
+        FROM pr_commits pc
+        LEFT JOIN git_commits g ON g.commit_hash = pc.commit_hash
+        LEFT JOIN commit_files f ON f.commit_id = g.id
+            AND f.description IS NOT NULL AND trim(f.description) != ''
+        ORDER BY pc.pr_order, g.timestamp, f.id
+    """
+    prs = {}
+    seen = set()
+    cursor.execute(query)
+    for pr_id, description in cursor:
+        data = prs.setdefault(pr_id, [])
+        if description is not None and (pr_id, description) not in seen:
+            seen.add((pr_id, description))
+            data.append(description)
+    return prs
+
+def _summarize_pr_chunks(pr_id, descriptions, budget, ai_service, ai_model):
+    chunks = _chunk_by_tokens(descriptions, budget)
+    if len(chunks) == 1:
+        return summarize_pr("\n--\n".join(chunks[0]), ai_service, ai_model)
+
+    logging.info("Summarizing PR %s in %s chunks", pr_id, len(chunks))
+    summaries = [summarize_pr("\n--\n".join(chunk), ai_service, ai_model) for chunk in chunks]
+    # combined in as many rounds as it takes for the summaries to fit a prompt
+    while True:
+        groups = _chunk_by_tokens(summaries, budget)
+        if len(groups) == 1:
+            return combine_pr_summaries(groups[0], ai_service, ai_model)
+        if len(groups) == len(summaries):
+            # each summary fills a prompt on its own, no point going round again
+            return combine_pr_summaries(summaries, ai_service, ai_model)
+        summaries = [combine_pr_summaries(group, ai_service, ai_model) for group in groups]
+
+def _chunk_by_tokens(texts, budget):
+    # consecutive texts, as many per chunk as fit the token budget; a text
+    # bigger than the budget gets a chunk of its own
+    chunks = [[]]
+    used = 0
+    for text in texts:
+        cost = num_tokens_from_string(text)
+        if chunks[-1] and used + cost > budget:
+            chunks.append([])
+            used = 0
+        chunks[-1].append(text)
+        used += cost
+    return chunks
+
 def _write_pr_summary_to_db(repo_owner, repo_name, pr_id, summary):
     try:
-        conn = sqlite3.connect(f'output/{repo_owner}-{repo_name}.db')
+        conn = get_repo_connection(repo_owner, repo_name)
         cursor = conn.cursor()
         cursor.execute('''
                 UPDATE pull_requests
@@ -255,7 +534,6 @@ def _write_pr_summary_to_db(repo_owner, repo_name, pr_id, summary):
                 WHERE number = ?
         ''', (summary, pr_id))
         conn.commit()   
-        conn.close()
     except Exception as e:
         logging.error("Error writing PR summary to DB: %s", e)
         raise e
@@ -263,48 +541,102 @@ def _write_pr_summary_to_db(repo_owner, repo_name, pr_id, summary):
 
 
 
-def generate_tag_annotations(repo_owner, repo_name, ai_string):
-    conn = sqlite3.connect(f'output/{repo_owner}-{repo_name}.db')
+def generate_tag_annotations(repo_owner, repo_name, ai_string, batch_size=10):
+    conn = get_repo_connection(repo_owner, repo_name)
     cursor = conn.cursor()
 
-    rows = _get_commits(cursor)
-
     ai_service = ai_string.split("|")[0]
     ai_model = ai_string.split("|")[1]
 
     orig_tags = _get_tags(cursor)
-    logging.info("loaded for %s commits, using %s tags", len(rows), len(orig_tags))
+    rows = [row for row in _get_untagged_commits(cursor) if _is_code_file(row[1])]
+    logging.info("loaded %s described files without tags, using %s tags, %s per request", len(rows), len(orig_tags), batch_size)
+
+    # the local model, trained on the LLM's earlier answers, tags what it's
+    # sure of; only the rest costs an LLM request
+    model = update_tag_model(conn, repo_owner, repo_name, orig_tags)
+    predicted = []
+    if model is not None and rows:
+        probabilities = model.predict([row[2] for row in rows])
+        # a few confident ones go to the LLM as well, for the next update to
+        # check the model against
+        audit = model.audit_sample(model.confident(probabilities))
+        confident = model.confident(probabilities) & ~audit
+        predicted = [(row, model.tag_values(row_probabilities))
+                     for row, row_probabilities, is_confident in zip(rows, probabilities, confident) if is_confident]
+        rows = [row for row, is_confident in zip(rows, confident) if not is_confident]
+        logging.info("Tag model tagged %s descriptions, %s left for the LLM, %s of them to check the model",
+                     len(predicted), len(rows), int(audit.sum()))
+
+    # each request classifies a batch of descriptions, so the tag list in
+    # the system prompt is paid for once per batch
+    batch_size = max(1, batch_size)
+    batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+
+    def classify(batch):
+        return batch, _classify_batch(orig_tags, batch, ai_service, ai_model)
 
     counter = 0
-    for row in rows:
-        row_id = row[0]
-        filename = row[2]
-        description = row[3]
-        if description is not None and description.strip() != "":
-            if _is_code_file(filename):
-                if not _tags_already_exist(repo_owner, repo_name, row_id):
-                    tags = classify_description(orig_tags, description, ai_service, ai_model)
-                    success = _write_tags_to_db(repo_owner, repo_name, row_id, orig_tags, tags)
-                    if success:
-                        counter += 1
-    logging.info("generated %s tags on commits", counter)
-    conn.close()    
-
-def _tags_already_exist(repo_owner, repo_name, commit_id):
-    conn = sqlite3.connect(f'output/{repo_owner}-{repo_name}.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT COUNT(*) FROM commit_tags WHERE commit_id = ?
-    ''', (commit_id,))
-    row_count = cursor.fetchone()[0]
-    conn.close()
-    if row_count > 0:
-        return True
-    return False
-
-def _write_tags_to_db(repo_owner, repo_name, commit_id, orig_tags, tag_string):
-    conn = sqlite3.connect(f'output/{repo_owner}-{repo_name}.db')
-    cursor = conn.cursor()
+    with ResultWriter(repo_owner, repo_name) as writer:
+        for row, tag_values in predicted:
+            writer.write_tags(row[0], tag_values, source="model")
+        for batch, results in map_ordered(ai_service, classify, batches):
+            for row, tag_values in zip(batch, results):
+                if tag_values:
+                    writer.write_tags(row[0], tag_values)
+                    counter += 1
+    logging.info("generated %s tags on commits in %s batches, %s more from the tag model", counter, len(batches), len(predicted))
+
+def _classify_batch(orig_tags, batch, ai_service, ai_model):
+    # [{tag: share}] in batch order; descriptions the batch response skips
+    # or garbles are classified one at a time
+    results = [None] * len(batch)
+    if len(batch) > 1:
+        # only a response that covers the whole batch is cached
+        response = classify_descriptions(orig_tags, [row[2] for row in batch], ai_service, ai_model,
+                                         validate=lambda answer: all(_parse_batch_tag_values(orig_tags, answer, len(batch))))
+        results = _parse_batch_tag_values(orig_tags, response, len(batch))
+        missing = sum(1 for tag_values in results if not tag_values)
+        if missing:
+            logging.info("Batch classification missing %s of %s descriptions, classifying them one at a time", missing, len(batch))
+    for index, row in enumerate(batch):
+        if not results[index]:
+            tags = classify_description(orig_tags, row[2], ai_service, ai_model,
+                                        validate=lambda answer: bool(_parse_tag_values(orig_tags, answer)))
+            results[index] = _parse_tag_values(orig_tags, tags)
+    return results
+
+def _parse_batch_tag_values(orig_tags, response, count):
+    # {"1": {tag: weight}, ...} from the model, as a list of {tag: share of
+    # the total}, with None for anything missing or unreadable
+    results = [None] * count
+    # models like to wrap the object in a code fence or some prose
+    start = response.find("{")
+    end = response.rfind("}")
+    if start < 0 or end < start:
+        logging.error("Error with batch tagging, no JSON object in the response")
+        return results
+    try:
+        data = json.loads(response[start:end + 1])
+    except ValueError as e:
+        logging.error("Error with batch tagging: %s", e)
+        return results
+    if not isinstance(data, dict):
+        return results
+    for key, weights in data.items():
+        try:
+            index = int(key) - 1
+            tag_values = {name.strip(): float(value) for name, value in weights.items()
+                          if name.strip() in orig_tags and float(value) > 0}
+        except (AttributeError, TypeError, ValueError) as e:
+            logging.error("Error with batch tagging %s: %s", key, e)
+            continue
+        if 0 <= index < count and tag_values:
+            results[index] = _normalize_values_to_one(tag_values)
+    return results
+
+def _parse_tag_values(orig_tags, tag_string):
+    # "tag, value, tag, value, ..." from the model, as {tag: share of the total}
     tag_string = tag_string.strip()
     tags = tag_string.split(",")
     counter = 0
@@ -318,28 +650,7 @@ def _write_tags_to_db(repo_owner, repo_name, commit_id, orig_tags, tag_string):
         except Exception as e:
             logging.error("Error with tagging: %s", e)
         counter += 2
-    tag_values = _normalize_values_to_one(tag_values)
-    status = False
-    for t in tag_values:
-        t = t.strip()
-        v = tag_values[t]
-        try:
-            cursor.execute('''
-                SELECT id FROM tags WHERE name = ?
-            ''', (t,))
-            tag_id = cursor.fetchone()[0]
-            cursor.execute('''
-                    INSERT INTO commit_tags (commit_id, tag_id, value)
-                    VALUES (?, ?, ?)
-                ''', (commit_id, tag_id, v))
-            conn.commit()
-            logging.debug("Saved to DB %s for tag %s for commit id %s", v, t, commit_id)
-            status = True
-        except Exception as e:
-            logging.error("Error saving to DB %s for tag %s for commit id %s", e, t, commit_id)
-    
-    conn.close()
-    return status
+    return _normalize_values_to_one(tag_values)
 
 def _normalize_values_to_one(tag_dict):
     # add up all the values
@@ -351,10 +662,29 @@ def _normalize_values_to_one(tag_dict):
 
 
 
-def _get_commits(cursor):
+def _get_undescribed_commits(cursor):
+    query = """
+    SELECT f.id, g.commit_hash, p.path, f.description
+    FROM commit_files f
+    JOIN git_commits g ON g.id = f.commit_id
+    JOIN paths p ON p.id = f.path_id
+    WHERE f.description IS NULL OR trim(f.description) = ''
+    ORDER BY f.id
+    """
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    return rows
+
+
+def _get_untagged_commits(cursor):
+    # described files with no commit_tags rows, in one anti-join
     query = """
-    SELECT c.id, c.commit_hash, c.filename, c.description
-    FROM commits c
+    SELECT f.id, p.path, f.description
+    FROM commit_files f
+    JOIN paths p ON p.id = f.path_id
+    WHERE f.description IS NOT NULL AND trim(f.description) != ''
+      AND NOT EXISTS (SELECT 1 FROM commit_tags ct WHERE ct.commit_id = f.id)
+    ORDER BY f.id
     """
     cursor.execute(query)
     rows = cursor.fetchall()
@@ -392,7 +722,7 @@ def backfill_descriptions_from_log(repo_parent, repo_name, do_backfill):
         logging.info("skip backfill commit from log - config setting is %s", do_backfill)
         return
 
-    f = open(f"output/{repo_parent}-{repo_name}_diffs_log.txt", "r", encoding="utf-8")
+    f = open(get_diffs_log_path(repo_parent, repo_name), "r", encoding="utf-8")
     data = f.read()
     f.close()
 
@@ -437,7 +767,7 @@ def backfill_descriptions_from_log(repo_parent, repo_name, do_backfill):
     final_records = list(unique_records.values())
 
     # Print the final sorted and unique records
-    conn = sqlite3.connect(f'output/{repo_parent}-{repo_name}.db')
+    conn = get_repo_connection(repo_parent, repo_name)
     cursor = conn.cursor()
 
     for record in final_records:
@@ -453,9 +783,8 @@ def backfill_descriptions_from_log(repo_parent, repo_name, do_backfill):
                 cursor.execute('''
                     UPDATE commits
                     SET description = ?
-                    WHERE commit_hash = ? AND file = ?
+                    WHERE commit_hash = ? AND filename = ?
                 ''', (record[3], record[2], record[1]))
-                conn.commit()
         except Exception as e:
             logging.error("Error updating commit %s: %s", record[2], e)
-    conn.close()
\ No newline at end of file
+    conn.commit()
\ No newline at end of file
@@ -3,7 +3,7 @@ import json
 import logging
 import hashlib
 from tree_sitter import Language, Parser
-from .llm import describe_code, rate_code
+from .llm import describe_code, rate_code, LLM_SETTINGS
 import json
 from tinydb import TinyDB, Query
 from tinydb.storages import MemoryStorage
@@ -332,28 +332,32 @@ def _extract_definitions_and_calls(node, source_code, filename, ai_model):
     return definitions
 
 def _llm_code(which, func_name, func_code, filename, ai_model):
-    hashedcode = ""
+    # repeats (the same function code in another file, commit or repo) are
+    # answered by the LLM response cache, which keys these on the code alone.
+    # Answers from before it, a file per function named for the md5 of its
+    # code ("score\t" and the code for scores), are still used, and still
+    # written when that cache is off
     if which == "description":
-        hashedcode = hashlib.md5(func_code.encode()).hexdigest()
+        hashed_code = hashlib.md5(func_code.encode()).hexdigest()
     elif which == "score":
-        score_code = "score\t" + func_code
-        hashedcode = hashlib.md5(score_code.encode()).hexdigest()
-    # check if we've already generated a description for this:
-    desc_filename = f"./output/cache/{hashedcode}.txt"
+        hashed_code = hashlib.md5(("score\t" + func_code).encode()).hexdigest()
+    else:
+        raise ValueError(f"Unknown code annotation: {which}")
+    desc_filename = f"./output/cache/{hashed_code}.txt"
     if os.path.exists(desc_filename):
         with open(desc_filename, "r", encoding="utf-8") as f:
             return f.read()
-    # if not, generate a description
+
     ai = ai_model.split("|")[0]
     model = ai_model.split("|")[1]
     if which == "description":
         content = describe_code(func_name, func_code, filename, ai, model)
-    elif which == "score":
+    else:
         content = rate_code(func_name, func_code, filename, ai, model)
-    f = open(desc_filename, "w", encoding="utf-8")
-    f.write(content)
-    f.close()
-    return content 
+    if content is not None and not LLM_SETTINGS["cache_enabled"]:
+        with open(desc_filename, "w", encoding="utf-8") as f:
+            f.write(content)
+    return content
 
 
 
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import logging
+import threading
+
+# settings for every pooled connection
+DB_SETTINGS = {
+    # negative cache_size is in KiB rather than pages
+    "cache_size_kb": 64 * 1024,
+    "mmap_size": 256 * 1024 * 1024,
+    "cached_statements": 256,
+    "busy_timeout": 30,
+}
+
+_local = threading.local()
+
+
+def get_db_path(repo_owner, repo_name):
+    return f"output/{repo_owner}-{repo_name}.db"
+
+
+def get_connection(db_path):
+    """
+    Get this thread's connection to a database, opening it on first use.
+
+    Connections are pooled per thread and per database, and stay open for
+    the life of the thread, so callers commit (or roll back) their work but
+    never close the connection.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+
+    Returns:
+        sqlite3.Connection: The connection, with WAL journaling and the
+        DB_SETTINGS pragmas applied.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    key = os.path.abspath(db_path)
+    conn = connections.get(key)
+    if conn is None:
+        conn = _open_connection(db_path)
+        connections[key] = conn
+    return conn
+
+
+def get_repo_connection(repo_owner, repo_name):
+    """
+    Get this thread's connection to a repo's database in the output folder.
+    """
+    return get_connection(get_db_path(repo_owner, repo_name))
+
+
+def close_connections(db_path=None):
+    """
+    Close this thread's pooled connections, or just the one to db_path,
+    e.g. before the database file is deleted.
+    """
+    connections = getattr(_local, "connections", {})
+    keys = list(connections) if db_path is None else [os.path.abspath(db_path)]
+    for key in keys:
+        conn = connections.pop(key, None)
+        if conn is not None:
+            conn.close()
+
+
+def _open_connection(db_path):
+    conn = sqlite3.connect(db_path,
+                           timeout=DB_SETTINGS["busy_timeout"],
+                           cached_statements=DB_SETTINGS["cached_statements"])
+    # WAL lets the web server read while the pipeline writes, and with it
+    # synchronous=NORMAL is still safe against corruption on a crash
+    journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    if journal_mode.lower() != "wal":
+        logging.debug("Could not switch %s to WAL, using %s", db_path, journal_mode)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{int(DB_SETTINGS['cache_size_kb'])}")
+    conn.execute(f"PRAGMA mmap_size={int(DB_SETTINGS['mmap_size'])}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
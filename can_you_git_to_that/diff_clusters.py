@@ -0,0 +1,178 @@
+import re
+import zlib
+import logging
+import numpy as np
+
+# settings for near-duplicate diff clustering, see init_diff_clusters
+CLUSTER_SETTINGS = {
+    # estimated Jaccard similarity of two patches' shingles at which they share
+    # a summary; 1 (or more) turns clustering off, leaving only exact matches
+    "threshold": 0.9,
+    # MinHash signature length
+    "num_perm": 128,
+    # tokens per shingle
+    "shingle_size": 3,
+    # patches with fewer shingles than this are too short to judge (a one line
+    # fix looks like every other one line fix) and always get their own summary
+    "min_shingles": 20,
+}
+
+# a prime under 2^32, so a * x + b stays inside uint64 for 32-bit shingle hashes
+_PRIME = (1 << 31) - 1
+# shingles hashed per block, bounds memory for huge (generated) patches
+_BLOCK = 4096
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def init_diff_clusters(threshold=None):
+    """
+    Configure near-duplicate clustering. Call before annotating.
+
+    Args:
+        threshold (float, optional): Similarity (0-1] at which patches share a summary, 1 to turn it off.
+    """
+    if threshold is not None:
+        threshold = float(threshold)
+        if threshold <= 0:
+            raise ValueError(f"Near duplicate threshold must be above 0: {threshold}")
+        CLUSTER_SETTINGS["threshold"] = threshold
+    logging.info("Diff cluster settings: %s", CLUSTER_SETTINGS)
+
+
+def changed_text(text):
+    """
+    The part of a normalized patch that says what changed: its added and
+    removed lines. Context lines differ from file to file under the same
+    codemod, so they're left out. File content is returned whole.
+    """
+    if not text.startswith("patch\n"):
+        return text
+    return "\n".join(line for line in text.splitlines() if line[:1] in "+-")
+
+
+def shingle(text, size):
+    """
+    Hash every run of `size` tokens in a (normalized) patch.
+
+    Returns:
+        numpy.ndarray: The distinct 32-bit shingle hashes, as uint64.
+    """
+    tokens = _TOKEN.findall(text)
+    if len(tokens) < size:
+        runs = [" ".join(tokens)] if tokens else []
+    else:
+        runs = (" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1))
+    hashes = {zlib.crc32(run.encode("utf-8")) for run in runs}
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+class MinHasher:
+    """
+    MinHash signatures from num_perm universal hash functions, (a * x + b) mod p.
+    The fraction of positions where two signatures agree estimates the
+    Jaccard similarity of the shingle sets they came from.
+    """
+
+    def __init__(self, num_perm, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingles):
+        signature = np.full(len(self.a), _PRIME, dtype=np.uint64)
+        for start in range(0, len(shingles), _BLOCK):
+            block = shingles[start:start + _BLOCK]
+            hashed = (np.outer(block, self.a) + self.b) % _PRIME
+            np.minimum(signature, hashed.min(axis=0), out=signature)
+        return signature
+
+
+def lsh_bands(num_perm, threshold):
+    """
+    Pick how to split signatures into bands for LSH: the band count whose
+    similarity at which a pair is likely to share a bucket, (1/b)^(1/r), is
+    the highest at or below the threshold. Candidates found that way are
+    checked against the threshold, so erring low only costs comparisons.
+
+    Returns:
+        tuple: The number of bands and the rows in each.
+    """
+    best = None
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands:
+            continue
+        rows = num_perm // bands
+        if (1 / bands) ** (1 / rows) <= threshold:
+            return bands, rows
+        best = (bands, rows)
+    return best
+
+
+class PatchClusterer:
+    """
+    Groups near-duplicate patches with MinHash LSH as they come in.
+
+    Each patch joins the cluster whose representative (its first patch) is
+    most similar, if any is similar enough, or starts a new one. So every
+    member is within the threshold of its representative, not just of some
+    other member, and a cluster's representative is known as soon as it's
+    added, before any later patches are seen.
+    """
+
+    def __init__(self):
+        self.threshold = CLUSTER_SETTINGS["threshold"]
+        # clusters, each a list of (key, estimated similarity to the
+        # representative), representative first
+        self.clusters = []
+        if self.threshold >= 1:
+            return
+        self.bands, self.rows = lsh_bands(CLUSTER_SETTINGS["num_perm"], self.threshold)
+        self.hasher = MinHasher(CLUSTER_SETTINGS["num_perm"])
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = []
+
+    def add(self, key, text):
+        """
+        Add a patch.
+
+        Args:
+            key: What the patch is known by in the clusters.
+            text (str): The normalized patch, or None for text that can't be compared.
+
+        Returns:
+            tuple: The index of the cluster the patch joined or started, and whether it started it.
+        """
+        if self.threshold >= 1:
+            return self._start_cluster(key, None, None)
+
+        shingles = shingle(changed_text(text), CLUSTER_SETTINGS["shingle_size"]) if text is not None else None
+        if shingles is None or len(shingles) < CLUSTER_SETTINGS["min_shingles"]:
+            return self._start_cluster(key, None, None)
+
+        signature = self.hasher.signature(shingles)
+        band_keys = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+        candidates = set()
+        for band, band_key in enumerate(band_keys):
+            candidates.update(self.buckets[band].get(band_key, ()))
+
+        best, best_similarity = None, self.threshold
+        for index in sorted(candidates):
+            similarity = float(np.mean(self.signatures[index] == signature))
+            if similarity > best_similarity or (best is None and similarity == best_similarity):
+                best, best_similarity = index, similarity
+        if best is not None:
+            self.clusters[best].append((key, best_similarity))
+            return best, False
+        return self._start_cluster(key, signature, band_keys)
+
+    def _start_cluster(self, key, signature, band_keys):
+        # only representatives go in the index
+        index = len(self.clusters)
+        self.clusters.append([(key, 1.0)])
+        if self.threshold < 1:
+            self.signatures.append(signature)
+        if band_keys is not None:
+            for band, band_key in enumerate(band_keys):
+                self.buckets[band].setdefault(band_key, []).append(index)
+        return index, True
+
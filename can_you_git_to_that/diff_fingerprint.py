@@ -0,0 +1,60 @@
+import re
+import hashlib
+
+_HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_patch(diff):
+    """
+    Reduce a hunk-only patch to the change it makes, so the same change
+    lands on the same text wherever it was applied: hunk headers lose their
+    line numbers and section text, runs of whitespace collapse to a single
+    space, and blank lines and "no newline at end of file" markers go.
+    """
+    lines = []
+    for line in diff.splitlines():
+        if _HUNK_HEADER.match(line):
+            lines.append("@@")
+            continue
+        if line.startswith("\\"):
+            continue
+        text = _WHITESPACE.sub(" ", line[1:]).strip()
+        if text:
+            lines.append(line[:1] + text)
+    return "\n".join(lines)
+
+
+def normalize_content(content):
+    """
+    Collapse whitespace in a file's content and drop its blank lines.
+    """
+    lines = []
+    for line in content.splitlines():
+        text = _WHITESPACE.sub(" ", line).strip()
+        if text:
+            lines.append(text)
+    return "\n".join(lines)
+
+
+def normalize_diff(diff, file_sample):
+    """
+    Normalize what an annotation is made from: the patch, or the file
+    content when there is no patch.
+
+    Returns:
+        str: The normalized text, or None when there's nothing to go on.
+    """
+    if diff is not None:
+        return "patch\n" + normalize_patch(diff)
+    if file_sample is not None:
+        return "content\n" + normalize_content(file_sample)
+    return None
+
+
+def fingerprint_text(text):
+    """
+    Returns:
+        str: A sha256 hex digest of normalized text from normalize_diff.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
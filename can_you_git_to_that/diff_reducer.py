@@ -0,0 +1,246 @@
+import re
+import logging
+from .llm_config import num_tokens_from_string
+
+# settings for fitting diffs to a prompt, see init_diff_reducer
+REDUCER_SETTINGS = {
+    # tokens per prompt, by model; the diff (or file content) gets what the
+    # instructions leave, see get_token_budget
+    "token_budgets": {},
+    # for any model not listed
+    "default_token_budget": 4000,
+    # most parts an oversized change is summarized in before the parts are
+    # combined; past that only the most informative hunks are kept
+    "max_parts": 8,
+    # consecutive lines of the same shape kept before the rest are collapsed
+    "max_similar_lines": 3,
+    # lines per block when splitting file content, which has no hunks
+    "content_block_lines": 40,
+}
+
+_HUNK_HEADER = re.compile(r"^@@ ", re.MULTILINE)
+_WORD = re.compile(r"\w+")
+
+
+def init_diff_reducer(token_budgets=None):
+    """
+    Configure the per-model token budgets. Call before annotating.
+
+    Args:
+        token_budgets (str, optional): Comma separated model:tokens pairs, with "default" for any other model.
+    """
+    if token_budgets:
+        for pair in token_budgets.split(","):
+            model, _, tokens = pair.strip().rpartition(":")
+            if not model or not tokens.strip().isdigit():
+                raise ValueError(f"Invalid token budget: {pair.strip()}")
+            if model == "default":
+                REDUCER_SETTINGS["default_token_budget"] = int(tokens)
+            else:
+                REDUCER_SETTINGS["token_budgets"][model] = int(tokens)
+    logging.info("Diff reducer settings: %s", REDUCER_SETTINGS)
+
+
+def get_token_budget(ai_model, overhead=0):
+    """
+    How many tokens of data fit in a prompt to a model.
+
+    Args:
+        ai_model (str): The AI model.
+        overhead (int, optional): Tokens the rest of the prompt (system prompt and template) takes.
+    """
+    budget = REDUCER_SETTINGS["token_budgets"].get(ai_model, REDUCER_SETTINGS["default_token_budget"])
+    # a long prompt on a small budget still leaves the data a quarter of it,
+    # rather than shredding it into parts of a few tokens
+    return max(budget - overhead, budget // 4)
+
+
+def reduce_diff(text, budget):
+    """
+    Fit a diff, or file content, to a token budget.
+
+    Whatever doesn't fit is cut down in steps, stopping as soon as it fits:
+    hunks that repeat an earlier hunk's change, and long runs of same-shaped
+    lines, are collapsed to a note; then, if at least half of it would be
+    left, only the most informative hunks are kept. Anything bigger is split
+    into parts that each fit, to be summarized separately and combined, with
+    the most informative hunks kept if it needs more than max_parts.
+
+    Returns:
+        list: The text as a single part, or the parts of an oversized change, in order.
+    """
+    if text is None or num_tokens_from_string(text) <= budget:
+        return [text]
+
+    header, hunks = split_hunks(text)
+    available = max(budget - num_tokens_from_string(header), 1)
+    hunks = [_collapse_similar_lines(hunk) for hunk in _collapse_repeated_hunks(hunks)]
+    # a new file's patch is a single hunk, so big hunks are split into blocks that fit
+    hunks = [block for hunk in hunks for block in _split_oversized(hunk, available)]
+    costs = [num_tokens_from_string(hunk) for hunk in hunks]
+    if sum(costs) <= available:
+        return [header + "".join(hunks)]
+
+    # from here on hunks may be left out, so leave room for the note saying so
+    available = max(available - num_tokens_from_string(_omitted_note(len(hunks))), 1)
+    if sum(costs) <= available * 2:
+        kept = _select_hunks(hunks, costs, available)
+        return [header + "".join(hunks[index] for index in kept) + _omitted_note(len(hunks) - len(kept))]
+
+    kept = _select_hunks(hunks, costs, available * REDUCER_SETTINGS["max_parts"])
+    parts = _pack_parts([hunks[index] for index in kept], [costs[index] for index in kept], available)
+    parts = [header + part for part in parts]
+    parts[-1] += _omitted_note(len(hunks) - len(kept))
+    return parts
+
+
+def split_hunks(text):
+    """
+    Split a patch into the lines before its first hunk and its hunks, or
+    file content into blocks of lines.
+
+    Returns:
+        tuple: The header and the list of hunks, each ending in a newline.
+    """
+    if not text.endswith("\n"):
+        text += "\n"
+    starts = [match.start() for match in _HUNK_HEADER.finditer(text)]
+    if not starts:
+        lines = text.splitlines(keepends=True)
+        size = REDUCER_SETTINGS["content_block_lines"]
+        return "", ["".join(lines[i:i + size]) for i in range(0, len(lines), size)]
+    hunks = [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+    return text[:starts[0]], hunks
+
+
+def _changes(hunk):
+    # the added and removed lines, whitespace collapsed
+    return tuple(" ".join(line.split()) for line in hunk.splitlines() if line[:1] in "+-")
+
+
+def _collapse_repeated_hunks(hunks):
+    # the same change made in many places (a rename, a sweep) is kept once,
+    # with a note of how often it repeats
+    first = {}
+    repeats = {}
+    for index, hunk in enumerate(hunks):
+        changes = _changes(hunk)
+        if not changes:
+            first.setdefault(("context", index), index)
+            continue
+        if changes in first:
+            repeats[first[changes]] = repeats.get(first[changes], 0) + 1
+        else:
+            first[changes] = index
+    collapsed = []
+    for index in sorted(first.values()):
+        hunk = hunks[index]
+        if index in repeats:
+            hunk += f"... the same change is made in {repeats[index]} more hunks\n"
+        collapsed.append(hunk)
+    return collapsed
+
+
+def _shape(line):
+    return line[:1] + _WORD.sub("w", line[1:]).replace(" ", "")
+
+
+def _collapse_similar_lines(hunk):
+    # long runs of lines that differ only in names and values (tables,
+    # generated code, data) keep their first few lines
+    keep = REDUCER_SETTINGS["max_similar_lines"]
+    lines = hunk.splitlines(keepends=True)
+    collapsed = []
+    run_shape = None
+    run_length = 0
+
+    def end_run():
+        if run_length > keep:
+            collapsed.append(f"... {run_length - keep} more similar lines\n")
+
+    for line in lines:
+        shape = _shape(line)
+        if shape == run_shape and not line.startswith("@@"):
+            run_length += 1
+            if run_length <= keep:
+                collapsed.append(line)
+            continue
+        end_run()
+        run_shape = shape
+        run_length = 1
+        collapsed.append(line)
+    end_run()
+    return "".join(collapsed)
+
+
+def _information(hunk, cost):
+    # distinct words in the changed lines per token; boilerplate and
+    # repetitive hunks score low
+    words = set()
+    for change in _changes(hunk):
+        words.update(_WORD.findall(change))
+    return len(words) / max(cost, 1)
+
+
+def _select_hunks(hunks, costs, available):
+    """
+    Keep the most informative hunks that fit, in their original order.
+
+    Returns:
+        list: The indexes of the hunks kept.
+    """
+    ranked = sorted(range(len(hunks)), key=lambda index: _information(hunks[index], costs[index]), reverse=True)
+    kept = set()
+    used = 0
+    for index in ranked:
+        if used + costs[index] <= available:
+            kept.add(index)
+            used += costs[index]
+    return sorted(kept)
+
+
+def _pack_parts(hunks, costs, available):
+    # consecutive hunks, as many per part as fit
+    parts = []
+    current = ""
+    used = 0
+    for hunk, cost in zip(hunks, costs):
+        if current and used + cost > available:
+            parts.append(current)
+            current = ""
+            used = 0
+        current += hunk
+        used += cost
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _split_oversized(hunk, available):
+    # blocks of consecutive lines that each fit; a single line too long for
+    # the budget (minified code, data) is cut short
+    if num_tokens_from_string(hunk) <= available:
+        return [hunk]
+    blocks = []
+    current = []
+    used = 0
+    for line in hunk.splitlines(keepends=True):
+        cost = num_tokens_from_string(line)
+        if cost > available:
+            line = line[:available] + "... the rest of this line is left out\n"
+            cost = num_tokens_from_string(line)
+        if current and used + cost > available:
+            blocks.append("".join(current))
+            current = []
+            used = 0
+        current.append(line)
+        used += cost
+    if current:
+        blocks.append("".join(current))
+    return blocks
+
+
+def _omitted_note(omitted):
+    if not omitted:
+        return ""
+    return f"... {omitted} less informative hunks are left out\n"
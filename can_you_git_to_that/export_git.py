@@ -1,18 +1,144 @@
 import os
+import json
 import logging
-import sqlite3
-from github import Github, GithubException
+import subprocess
+import requests
 import re
-from datetime import datetime
+import csv
+import mmap
+import struct
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 import time
 from tqdm import tqdm
-
+from .github_fetch import get_fetcher
+from .db import get_repo_connection
+
+# separators used in the `git log` pretty format for the local extractor,
+# chosen because they can't show up in names, emails or commit messages
+_LOCAL_RECORD_START = "\x1e"
+_LOCAL_FIELD_SEP = "\x1f"
+_LOCAL_HEADER_END = "\x1d"
+
+# how many commits to write between fsyncs of the log file
+CHECKPOINT_EVERY = 100
+
+# the commit log is JSON lines: a header line naming the format and version,
+# then one commit per line. Version 1 was the old "^^sha--epoch--..." text
+# format, which can still be read.
+COMMIT_LOG_FORMAT = "can_you_git_to_that.commit_log"
+COMMIT_LOG_VERSION = 2
+
+# the .idx file next to the log holds the byte offset of each commit line
+_INDEX_ENTRY = struct.Struct("<Q")
+
+# bounds on how much of the log one worker parses at a time in parallel mode
+MIN_SHARD_BYTES = 1024 * 1024
+MAX_SHARD_BYTES = 64 * 1024 * 1024
+
+# columns of the rows iter_commit_rows yields, in the order of the commits table
+COMMIT_COLUMN_NAMES = ["commit_hash", "timestamp", "date", "author", "email", "filename", "churn_count"]
+
+_TIMEZONE_OFFSET = re.compile(r"[+\-][0-9]{2}:[0-9]{2}$")
+
+# columns of the pull requests file, in the order of the pull_requests table
+PR_COLUMN_NAMES = [
+    "number",
+    "title",
+    "user_login",
+    "state",
+    "created_at",
+    "merged",
+    "merged_at",
+    "merge_commit_sha",
+    "mergeable",
+    "mergeable_state",
+    "comments",
+    "review_comments",
+    "closed_at",
+    "html_url",
+    "updated_at",
+    "description"
+]
+
+PR_COMMIT_COLUMN_NAMES = ["pr_number", "commit_hash"]
+
+# just the pull request fields we store, plus the commits on each PR;
+# nested connections are capped at 100 so a page of PRs stays one request,
+# and the rare PR with more commits or reviews gets follow-up queries
+PR_GRAPHQL_QUERY = """
+query($owner: String!, $name: String!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(first: 100, after: $cursor, orderBy: {field: UPDATED_AT, direction: DESC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        number
+        title
+        author { login }
+        state
+        createdAt
+        merged
+        mergedAt
+        mergeCommit { oid }
+        mergeable
+        mergeStateStatus
+        comments { totalCount }
+        reviews(first: 100) {
+          pageInfo { hasNextPage endCursor }
+          nodes { comments { totalCount } }
+        }
+        closedAt
+        url
+        updatedAt
+        commits(first: 100) {
+          pageInfo { hasNextPage endCursor }
+          nodes { commit { oid } }
+        }
+      }
+    }
+  }
+}
+"""
+
+# follow-up queries for the rest of a PR's commits or reviews, by connection
+PR_CONNECTION_GRAPHQL_QUERIES = {
+    "commits": """
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      commits(first: 100, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        nodes { commit { oid } }
+      }
+    }
+  }
+}
+""",
+    "reviews": """
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      reviews(first: 100, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        nodes { comments { totalCount } }
+      }
+    }
+  }
+}
+""",
+}
 
 
 def get_commit_log(github_access_token, repo_owner, repo_name):
     """
     Get the commit log for a given repository.
 
+    The log is built up incrementally: commits already in the log file are
+    skipped, and the listing stops at the newest commit ingested by the last
+    completed run, so an interrupted export picks up where it left off.
+
     Args:
         github_access_token (str): The access token for the GitHub API.
         repo_owner (str): The owner of the repository.
@@ -22,138 +148,387 @@ def get_commit_log(github_access_token, repo_owner, repo_name):
         str: The file path of the output file.
     """
     try:
-        # Initialize the GitHub object
-        g = Github(github_access_token)
+        fetcher = get_fetcher(github_access_token)
 
-        # Get the repository
+        # Check we can get to the repository
         full_repo_name = f"{repo_owner}/{repo_name}"
         logging.info("Getting repository: %s", full_repo_name)
-        repo = g.get_repo(full_repo_name)
+        fetcher.get_json(f"/repos/{full_repo_name}")
+
+        output_file_path = _get_log_file_path(repo_owner, repo_name)
+        _upgrade_legacy_log(repo_owner, repo_name)
+        export_state = _read_export_state(repo_owner, repo_name)
+        high_water_mark = export_state.get("commit_log_high_water_mark")
+        seen_shas = _load_log_checkpoint(output_file_path)
+        logging.info("Commit log has %d commits, high water mark: %s", len(seen_shas), high_water_mark)
+
+        newest_sha = []
+
+        def new_commit_shas():
+            # list commits newest first, the listing pages are cheap (100 a
+            # request); the per-commit detail calls are what we parallelize
+            for commit in fetcher.paginate(f"/repos/{full_repo_name}/commits"):
+                sha = commit["sha"]
+                if not newest_sha:
+                    newest_sha.append(sha)
+                if sha == high_water_mark:
+                    return
+                if sha not in seen_shas:
+                    yield sha
+
+        def fetch_commit(sha):
+            return fetcher.get_commit(full_repo_name, sha)
 
-        # Fetch all commits
+        counter = 0
+        logging.info("Processing commits")
+        with _open_log_for_append(output_file_path) as (output_file, index_file), \
+                tqdm(desc="Loading Commits") as pbar:
+            for commit in fetcher.map_ordered(fetch_commit, new_commit_shas()):
+                _write_log_record(output_file, index_file, _format_api_commit(commit), counter)
+                counter += 1
+                pbar.update(1)
 
-        # Determine the number of commits
-        total_commits = repo.get_commits().totalCount
-        logging.info("Total number of commits: %d", total_commits)
+        logging.info("Added %d new commits to the log", counter)
+        if newest_sha:
+            export_state["commit_log_high_water_mark"] = newest_sha[0]
+            _write_export_state(repo_owner, repo_name, export_state)
 
-        # Fetch all commits and show loading status
-        commits = repo.get_commits()
+        return output_file_path
+    except requests.HTTPError as he:
+        logging.error("Error getting repository: %s", he)
+        logging.error("Can't reach this repo - you may not have access to it with ")
+        return None
+    except Exception as e:
+        logging.error("Error getting commit log: %s", e)
+        return None
 
-        
-        # Get the directory of the current script
-        script_directory = os.path.dirname(os.path.abspath(__file__))
-        parent_directory = os.path.dirname(script_directory)
+def _format_api_commit(commit):
+    commit_data = commit["commit"]
+    # the author can be missing on commits imported from other systems, so
+    # fall back to the committer's date
+    author = commit_data["author"]
+    author_date = datetime.fromisoformat((author or commit_data["committer"])["date"])
+    return {
+        "sha": commit["sha"],
+        "timestamp": int(author_date.timestamp()),
+        "date": author_date.isoformat(),
+        "author": author["name"] if author else "Unknown",
+        "email": author["email"] if author else "Unknown",
+        "message": commit_data["message"],
+        "files": [[file["additions"], file["deletions"], file["filename"]] for file in commit.get("files", [])],
+    }
+
+
+def get_commit_log_local(repo_local_full_path, repo_owner, repo_name):
+    """
+    Get the commit log for a given repository from a local clone, without
+    going through the GitHub API.
 
-        # Define the output folder relative to the execution location
-        output_folder = os.path.join(parent_directory, 'output')
-        # Ensure the output folder exists
-        os.makedirs(output_folder, exist_ok=True)
+    Streams `git log --numstat` and writes the same commit log format as
+    get_commit_log, so fill_db can consume either one. Like
+    get_commit_log, only commits newer than the last completed run are read.
 
-        # Define the output file path
-        output_file_path = os.path.join(output_folder, f"{repo_owner}-{repo_name}_git_log.txt")
+    Args:
+        repo_local_full_path (str): The path to the local clone of the repository.
+        repo_owner (str): The owner of the repository.
+        repo_name (str): The name of the repository.
+
+    Returns:
+        str: The file path of the output file.
+    """
+    try:
+        output_file_path = _get_log_file_path(repo_owner, repo_name)
+        _upgrade_legacy_log(repo_owner, repo_name)
+        export_state = _read_export_state(repo_owner, repo_name)
+        high_water_mark = export_state.get("commit_log_high_water_mark")
+        seen_shas = _load_log_checkpoint(output_file_path)
+        logging.info("Commit log has %d commits, high water mark: %s", len(seen_shas), high_water_mark)
+
+        head_sha = _git_output(repo_local_full_path, ["rev-parse", "HEAD"]).strip()
+        revision_range = head_sha
+        if high_water_mark and _git_has_commit(repo_local_full_path, high_water_mark):
+            revision_range = f"{high_water_mark}..{head_sha}"
+
+        pretty_format = _LOCAL_FIELD_SEP.join(["%H", "%at", "%an", "%ae", "%B"])
+        command = [
+            "git", "-C", repo_local_full_path,
+            "-c", "core.quotepath=off",
+            "log",
+            "--numstat",
+            "--diff-merges=first-parent",
+            f"--format={_LOCAL_RECORD_START}{pretty_format}{_LOCAL_HEADER_END}",
+            revision_range,
+        ]
+        logging.info("Reading commits from local clone: %s (%s)", repo_local_full_path, revision_range)
 
-        output = ""
         counter = 0
-        logging.info("Processing commits")
-        with tqdm(total=total_commits, desc="Loading Commits") as pbar:
-            for commit in commits:
-                commit_data = commit.commit
-                commit_message = commit_data.message
-                commit_message = commit_message.replace("\n", " ")
-                commit_message = commit_message.replace("--", " ")
-                author = commit_data.author
-                author_name = author.name if author else "Unknown"
-                author_email = author.email if author else "Unknown"
-                line = f"^^{commit.sha}--{commit_data.author.date.timestamp()}--{commit_data.author.date.isoformat()}--{author_name}--{author_email}--{commit_message}\n"
-                output += line
-                for file in commit.files:
-                    output += f"{file.additions}\t{file.deletions}\t{file.filename}\n"
-                output += "\n"
+        with subprocess.Popen(command, stdout=subprocess.PIPE, encoding="utf-8", errors="replace") as proc, \
+                _open_log_for_append(output_file_path) as (output_file, index_file), \
+                tqdm(desc="Loading Commits") as pbar:
+            for header, churn_lines in _read_local_log(proc.stdout):
+                if header.split(_LOCAL_FIELD_SEP, 1)[0] in seen_shas:
+                    continue
+                _write_log_record(output_file, index_file, _format_local_commit(header, churn_lines), counter)
                 counter += 1
                 pbar.update(1)
 
+        if proc.returncode != 0:
+            logging.error("git log exited with status %s for %s", proc.returncode, repo_local_full_path)
+            return None
 
-        # Write the output to the file
-        with open(output_file_path, "w", encoding="utf-8") as output_file:
-            output_file.write(output)
-
+        logging.info("Added %d new commits to the log", counter)
+        export_state["commit_log_high_water_mark"] = head_sha
+        _write_export_state(repo_owner, repo_name, export_state)
         return output_file_path
-    except GithubException as ge:
-        logging.error("Error getting repository: %s", ge)
-        logging.error("Can't reach this repo - you may not have access to it with ")
-        return None
     except Exception as e:
-        logging.error("Error getting commit log: %s", e)
+        logging.error("Error getting local commit log: %s", e)
         return None
 
+def _git_output(repo_local_full_path, args):
+    return subprocess.run(["git", "-C", repo_local_full_path] + args,
+                          check=True, capture_output=True, encoding="utf-8").stdout
+
+def _git_has_commit(repo_local_full_path, sha):
+    result = subprocess.run(["git", "-C", repo_local_full_path, "cat-file", "-e", f"{sha}^{{commit}}"],
+                            capture_output=True)
+    return result.returncode == 0
+
+def _read_local_log(stream):
+    # yields (header, churn_lines) for each commit in the `git log` output;
+    # the header can run over several lines since %B is the full message
+    header = None
+    churn_lines = []
+    in_header = False
+    for line in stream:
+        if line.startswith(_LOCAL_RECORD_START):
+            if header is not None:
+                yield header, churn_lines
+            header = line[len(_LOCAL_RECORD_START):]
+            churn_lines = []
+            in_header = _LOCAL_HEADER_END not in header
+        elif in_header:
+            header += line
+            in_header = _LOCAL_HEADER_END not in line
+        elif line.strip():
+            churn_lines.append(line.rstrip("\n"))
+    if header is not None:
+        yield header, churn_lines
+
+def _format_local_commit(header, churn_lines):
+    header = header.split(_LOCAL_HEADER_END)[0]
+    sha, epoch, author_name, author_email, message = header.split(_LOCAL_FIELD_SEP, 4)
+    # match the API extractor, which reports author dates in UTC
+    author_date = datetime.fromtimestamp(int(epoch), timezone.utc)
+    files = []
+    for churn_line in churn_lines:
+        churn_info = churn_line.split("\t", 2)
+        if len(churn_info) < 3:
+            continue
+        # numstat reports binary files as "-", the API as 0
+        files.append([_parse_churn_value(churn_info[0]), _parse_churn_value(churn_info[1]),
+                      _resolve_rename_path(churn_info[2])])
+    return {
+        "sha": sha,
+        "timestamp": int(epoch),
+        "date": author_date.isoformat(),
+        "author": author_name or "Unknown",
+        "email": author_email or "Unknown",
+        "message": message.strip(),
+        "files": files,
+    }
+
+def _resolve_rename_path(path):
+    # numstat reports renames as "dir/{old => new}/file" or "old => new",
+    # the API only gives us the new name so do the same here
+    if " => " not in path:
+        return path
+    match = re.search(r"\{([^{}]*) => ([^{}]*)\}", path)
+    if match:
+        resolved = path[:match.start()] + match.group(2) + path[match.end():]
+        return resolved.replace("//", "/")
+    return path.split(" => ", 1)[1]
+
+class _open_log_for_append:
+    # the log and its offset index, opened together in binary append mode so
+    # the offsets we record are real byte positions
+    def __init__(self, log_filename):
+        self.log_filename = log_filename
+
+    def __enter__(self):
+        self.output_file = open(self.log_filename, "ab")
+        self.index_file = open(_get_index_path(self.log_filename), "ab")
+        if self.output_file.tell() == 0:
+            header = {"format": COMMIT_LOG_FORMAT, "version": COMMIT_LOG_VERSION}
+            self.output_file.write(json.dumps(header).encode("utf-8") + b"\n")
+        return self.output_file, self.index_file
+
+    def __exit__(self, *exc_info):
+        self.index_file.close()
+        self.output_file.close()
+
+def _write_log_record(output_file, index_file, record, counter):
+    # every record is flushed as soon as it is written, so the log file itself
+    # is the checkpoint for an interrupted run; the index is written after
+    # the log so it never points past the end of it
+    offset = output_file.tell()
+    output_file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+    output_file.flush()
+    index_file.write(_INDEX_ENTRY.pack(offset))
+    index_file.flush()
+    if counter % CHECKPOINT_EVERY == 0:
+        os.fsync(output_file.fileno())
+        os.fsync(index_file.fileno())
+
+def _load_log_checkpoint(log_filename):
+    """
+    Read the SHAs already in an existing log file, dropping a trailing
+    partial record left behind by an interrupted run and rebuilding the
+    offset index to match.
+    """
+    seen_shas = set()
+    if not os.path.exists(log_filename):
+        return seen_shas
+
+    offsets = []
+    complete_offset = 0
+    with open(log_filename, "rb") as f:
+        header = f.readline()
+        if header and _read_log_header(header, log_filename) != COMMIT_LOG_VERSION:
+            raise ValueError(f"{log_filename} is an old format commit log, it can be read but not appended to")
+        complete_offset = f.tell() if header.endswith(b"\n") else 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                sha = json.loads(line)["sha"]
+            except (ValueError, KeyError):
+                break
+            seen_shas.add(sha)
+            offsets.append(complete_offset)
+            complete_offset += len(line)
+
+    if complete_offset < os.path.getsize(log_filename):
+        logging.info("Dropping partial record at the end of %s", log_filename)
+        with open(log_filename, "r+b") as f:
+            f.truncate(complete_offset)
+    with open(_get_index_path(log_filename), "wb") as f:
+        f.write(b"".join(_INDEX_ENTRY.pack(offset) for offset in offsets))
+    return seen_shas
+
+def _read_log_header(line, log_filename):
+    # returns the format version, 1 for the old text format
+    if line.startswith(b"^^") or not line.strip():
+        return 1
+    header = json.loads(line)
+    if header.get("format") != COMMIT_LOG_FORMAT:
+        raise ValueError(f"{log_filename} is not a commit log")
+    if header.get("version", 0) > COMMIT_LOG_VERSION:
+        raise ValueError(f"{log_filename} is commit log version {header['version']}, "
+                         f"this version only reads up to {COMMIT_LOG_VERSION}")
+    return header["version"]
+
+def _upgrade_legacy_log(repo_owner, repo_name):
+    # convert a version 1 text log from an earlier run, so the high water
+    # mark in the export state still lines up with the log
+    legacy_filename = _get_legacy_log_file_path(repo_owner, repo_name)
+    log_filename = _get_log_file_path(repo_owner, repo_name)
+    if not os.path.exists(legacy_filename) or os.path.exists(log_filename):
+        return
+    logging.info("Converting %s to %s", legacy_filename, log_filename)
+    tmp_filename = log_filename + ".tmp"
+    with open(legacy_filename, "r", encoding="utf-8") as legacy_file, \
+            _open_log_for_append(tmp_filename) as (output_file, index_file):
+        for counter, commit in enumerate(_parse_legacy_log(legacy_file)):
+            _write_log_record(output_file, index_file, commit, counter)
+    os.replace(_get_index_path(tmp_filename), _get_index_path(log_filename))
+    os.replace(tmp_filename, log_filename)
+    os.remove(legacy_filename)
+
+def _get_export_state_path(repo_owner, repo_name):
+    return os.path.join(os.path.dirname(_get_log_file_path(repo_owner, repo_name)),
+                        f"{repo_owner}-{repo_name}_export_state.json")
+
+def _read_export_state(repo_owner, repo_name):
+    filename = _get_export_state_path(repo_owner, repo_name)
+    if not os.path.exists(filename):
+        return {}
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error("Error reading export state %s: %s", filename, e)
+        return {}
+
+def _write_export_state(repo_owner, repo_name, export_state):
+    filename = _get_export_state_path(repo_owner, repo_name)
+    # write to a temp file and rename, so a crash can't leave a half-written state
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as f:
+        json.dump(export_state, f, indent=4)
+    os.replace(tmp_filename, filename)
+
+def _get_log_file_path(repo_owner, repo_name):
+    # Get the directory of the current script
+    script_directory = os.path.dirname(os.path.abspath(__file__))
+    parent_directory = os.path.dirname(script_directory)
+
+    # Define the output folder relative to the execution location
+    output_folder = os.path.join(parent_directory, 'output')
+    # Ensure the output folder exists
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Define the output file path
+    return os.path.join(output_folder, f"{repo_owner}-{repo_name}_git_log.jsonl")
+
+def _get_legacy_log_file_path(repo_owner, repo_name):
+    return _get_log_file_path(repo_owner, repo_name)[:-len(".jsonl")] + ".txt"
+
+def _get_index_path(log_filename):
+    return log_filename + ".idx"
+
 
 
 def get_pr_data(access_token, repo_owner, repo_name):
     """
     Get the pull request data for a given repository.
 
+    Pull requests are listed most recently updated first, and the listing
+    stops at the last update already in the database, so only new and changed
+    pull requests are fetched. The first run on a database fetches them all.
+
     Args:
         access_token (str): The access token for the GitHub API.
         repo_owner (str): The owner of the repository.
         repo_name (str): The name of the repository.
     """
-    # Initialize the GitHub object
-    g = Github(access_token)
-
-    # Get the repository
-    repo = g.get_repo(f"{repo_owner}/{repo_name}")
+    fetcher = get_fetcher(access_token)
+    full_repo_name = f"{repo_owner}/{repo_name}"
 
-    existing_pr_numbers = _get_existing_pr_numbers(repo_owner, repo_name)    
+    existing_pr_numbers = _get_existing_pr_numbers(repo_owner, repo_name)
+    last_synced_at = _get_last_pr_sync(repo_owner, repo_name)
+    logging.info("Syncing pull requests updated since %s", last_synced_at)
 
-    pulls = []
-    prs = repo.get_pulls(state='all', sort='created', direction='asc')
+    pull_numbers = []
+    prs = fetcher.paginate(f"/repos/{full_repo_name}/pulls", {"state": "all", "sort": "updated", "direction": "desc"})
     for pr in prs:
-        if pr.number not in existing_pr_numbers:
-            pulls.append(pr)
-    num_pulls = len(pulls)
-
-    # Iterate through pull requests and print details
-    # column names
-    column_names = [
-        "number",
-        "title",
-        "user_login",
-        "state",
-        "created_at",
-        "merged",
-        "merged_at",
-        "merge_commit_sha",
-        "mergeable",
-        "mergeable_state",
-        "comments",
-        "review_comments",
-        "closed_at",
-        "html_url",
-        "description"
-    ]
-    output = "\t".join(column_names)+ "\n"
+        if _is_already_synced(pr["updated_at"], last_synced_at):
+            break
+        pull_numbers.append(pr["number"])
+    num_pulls = len(pull_numbers)
+    num_new = len([n for n in pull_numbers if n not in existing_pr_numbers])
+    logging.info("Found %d new and %d updated pull requests", num_new, num_pulls - num_new)
+
+    # the list endpoint leaves out merged/mergeable/comment counts, so each
+    # PR needs its own request; run those on the worker pool
+    def fetch_pull(number):
+        return fetcher.get_json(f"/repos/{full_repo_name}/pulls/{number}")
+
+    output = "\t".join(PR_COLUMN_NAMES)+ "\n"
     counter = 0
     logging.info("Processing pull requests")
     with tqdm(total=num_pulls, desc="Loading Pull Requests") as pbar:
-        for pr in pulls:
-            line = ""
-            line += f"{pr.number}\t"
-            title = str(pr.title).replace("\t", " ")
-            line += f"{title}\t"
-            line += f"{pr.user.login}\t"
-            line += f"{pr.state}\t"
-            line += f"{pr.created_at}\t"
-            line += f"{pr.merged}\t"
-            line += f"{pr.merged_at}\t"
-            line += f"{pr.merge_commit_sha}\t"
-            line += f"{pr.mergeable}\t"
-            line += f"{pr.mergeable_state}\t"
-            comments = str(pr.comments).replace("\t", " ")
-            line += f"{comments}\t"
-            review_comments = str(pr.review_comments).replace("\t", " ")
-            line += f"{review_comments}\t"
-            line += f"{pr.closed_at}\t"
-            line += f"{pr.html_url}\n"
+        for pr in fetcher.map_ordered(fetch_pull, pull_numbers):
+            line = _format_pr_line(pr)
             if (counter /10 % 100) == 0 and counter > 0:
                 logging.info("Processing pull request: %s", counter)
             counter += 1
@@ -165,22 +540,171 @@ def get_pr_data(access_token, repo_owner, repo_name):
         output_file.write(output)
     return filename
 
+def get_pr_data_graphql(access_token, repo_owner, repo_name):
+    """
+    Get the pull request data for a given repository through the GraphQL API,
+    100 pull requests per request instead of one request per pull request.
+    Like get_pr_data, only pull requests updated since the last sync are read.
+
+    Writes the same pull requests file as get_pr_data, plus a file linking
+    each pull request to all of its commits.
+
+    Args:
+        access_token (str): The access token for the GitHub API.
+        repo_owner (str): The owner of the repository.
+        repo_name (str): The name of the repository.
+
+    Returns:
+        str: The file path of the pull requests file.
+    """
+    fetcher = get_fetcher(access_token)
+    last_synced_at = _get_last_pr_sync(repo_owner, repo_name)
+    logging.info("Syncing pull requests updated since %s", last_synced_at)
+
+    def updated_pull_requests():
+        # newest first, up to the first one already synced
+        variables = {"owner": repo_owner, "name": repo_name, "cursor": None}
+        while True:
+            data = fetcher.graphql(PR_GRAPHQL_QUERY, variables)
+            pull_requests = data["repository"]["pullRequests"]
+            for node in pull_requests["nodes"]:
+                if _is_already_synced(node["updatedAt"], last_synced_at):
+                    return
+                yield node
+            if not pull_requests["pageInfo"]["hasNextPage"]:
+                return
+            variables["cursor"] = pull_requests["pageInfo"]["endCursor"]
+
+    def complete(node):
+        # follow-up queries for PRs with more than a page of commits or
+        # reviews run on the worker pool, not one PR at a time
+        reviews = _get_graphql_pr_connection(fetcher, repo_owner, repo_name, node, "reviews")
+        commits = _get_graphql_pr_connection(fetcher, repo_owner, repo_name, node, "commits")
+        return _graphql_pr_to_rest(node, reviews), [c["commit"]["oid"] for c in commits]
+
+    output = "\t".join(PR_COLUMN_NAMES) + "\n"
+    commits_output = "\t".join(PR_COMMIT_COLUMN_NAMES) + "\n"
+    logging.info("Processing pull requests (GraphQL)")
+    with tqdm(desc="Loading Pull Requests") as pbar:
+        for pr, commit_shas in fetcher.map_ordered(complete, updated_pull_requests()):
+            output += _format_pr_line(pr)
+            for commit_sha in commit_shas:
+                commits_output += f"{pr['number']}\t{commit_sha}\n"
+            pbar.update(1)
+
+    filename = f"./output/{repo_owner}-{repo_name}_pull_requests.txt"
+    with open(filename, "w", encoding="utf-8") as output_file:
+        output_file.write(output)
+    commits_filename = f"./output/{repo_owner}-{repo_name}_pull_request_commits.txt"
+    with open(commits_filename, "w", encoding="utf-8") as output_file:
+        output_file.write(commits_output)
+    return filename
+
+def _get_graphql_pr_connection(fetcher, repo_owner, repo_name, node, connection):
+    # all the nodes of a PR's commits or reviews, from the first page in the
+    # PR query and as many follow-up pages as it takes
+    page = node[connection]
+    nodes = list(page["nodes"])
+    while page["pageInfo"]["hasNextPage"]:
+        data = fetcher.graphql(PR_CONNECTION_GRAPHQL_QUERIES[connection], {
+            "owner": repo_owner,
+            "name": repo_name,
+            "number": node["number"],
+            "cursor": page["pageInfo"]["endCursor"],
+        })
+        page = data["repository"]["pullRequest"][connection]
+        nodes.extend(page["nodes"])
+    return nodes
+
+def _graphql_pr_to_rest(node, reviews):
+    # map a GraphQL pull request, with all of its reviews, onto the REST
+    # field names and values, so both backends write exactly the same rows
+    mergeable = {"MERGEABLE": True, "CONFLICTING": False}.get(node["mergeable"])
+    review_comments = sum(r["comments"]["totalCount"] for r in reviews)
+    return {
+        "number": node["number"],
+        "title": node["title"],
+        "user": {"login": node["author"]["login"] if node["author"] else "ghost"},
+        "state": "open" if node["state"] == "OPEN" else "closed",
+        "created_at": node["createdAt"],
+        "merged": node["merged"],
+        "merged_at": node["mergedAt"],
+        "merge_commit_sha": node["mergeCommit"]["oid"] if node["mergeCommit"] else None,
+        "mergeable": mergeable,
+        "mergeable_state": node["mergeStateStatus"].lower(),
+        "comments": node["comments"]["totalCount"],
+        "review_comments": review_comments,
+        "closed_at": node["closedAt"],
+        "html_url": node["url"],
+        "updated_at": node["updatedAt"],
+    }
+
+def _format_pr_line(pr):
+    line = ""
+    line += f"{pr['number']}\t"
+    title = str(pr['title']).replace("\t", " ")
+    line += f"{title}\t"
+    line += f"{pr['user']['login']}\t"
+    line += f"{pr['state']}\t"
+    line += f"{_format_github_date(pr['created_at'])}\t"
+    line += f"{pr['merged']}\t"
+    line += f"{_format_github_date(pr['merged_at'])}\t"
+    line += f"{pr['merge_commit_sha']}\t"
+    line += f"{pr['mergeable']}\t"
+    line += f"{pr['mergeable_state']}\t"
+    comments = str(pr['comments']).replace("\t", " ")
+    line += f"{comments}\t"
+    review_comments = str(pr['review_comments']).replace("\t", " ")
+    line += f"{review_comments}\t"
+    line += f"{_format_github_date(pr['closed_at'])}\t"
+    line += f"{pr['html_url']}\t"
+    line += f"{_format_github_date(pr['updated_at'])}\n"
+    return line
+
+def _format_github_date(value):
+    # the API sends ISO 8601 ("2024-07-29T17:00:00Z"), keep writing dates the
+    # way they've always been written to the PR file
+    if value is None:
+        return "None"
+    return str(datetime.fromisoformat(value))
+
+def _is_already_synced(updated_at, last_synced_at):
+    if last_synced_at is None:
+        return False
+    return datetime.fromisoformat(updated_at) < last_synced_at
+
+def _get_last_pr_sync(repo_owner, repo_path):
+    # the newest updated_at we've stored is where the next sync stops
+    try:
+        conn = get_repo_connection(repo_owner, repo_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(updated_at) FROM pull_requests")
+        result = cursor.fetchone()
+        if result is None or result[0] is None:
+            return None
+        return datetime.fromisoformat(result[0])
+    except Exception as e:
+        logging.info("No previous pull request sync found: %s", e)
+        return None
+
 def _get_existing_pr_numbers(repo_owner, repo_path):
     try:
-        conn = sqlite3.connect(f"output/{repo_owner}-{repo_path}.db")    
+        conn = get_repo_connection(repo_owner, repo_path)    
         cursor = conn.cursor()
         cursor.execute("SELECT number FROM pull_requests")
         result = cursor.fetchall()
-        conn.close()
-        return [x[0] for x in result]
+        return {x[0] for x in result}
     except Exception as e:
         logging.error("Error getting existing PR numbers: %s", e)
-        return []
+        return set()
 
 def create_csv(repo_parent, repo_name, log_filename, exclude_file_pattern="", exclude_author_pattern=""):
     """
     Create a CSV file from the git log.
 
+    fill_db reads the log directly with iter_commit_rows, so this is only
+    needed to hand the commits to something else.
+
     Args:
         repo_parent (str): The parent/owner org of the repository.
         repo_name (str): The name of the repository.
@@ -191,59 +715,198 @@ def create_csv(repo_parent, repo_name, log_filename, exclude_file_pattern="", ex
     logging.info("Exclude Author Pattern: %s", exclude_author_pattern)
     logging.info("Reading git log: %s", log_filename)
 
-    with open(log_filename, "r", encoding="utf-8") as file:
-        git_log_text = file.read()
-
-    csv_data = _process_git_log(git_log_text, exclude_file_pattern, exclude_author_pattern)
-
     output_filename = f"output/{repo_parent}-{repo_name}.csv"
-    with open(output_filename, "w", encoding="utf-8") as file:
-        file.write(csv_data)
+    with open(output_filename, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(COMMIT_COLUMN_NAMES)
+        writer.writerows(iter_commit_rows(log_filename, exclude_file_pattern, exclude_author_pattern))
 
     return output_filename
 
 
+def read_commit_log(log_filename, start=0, stop=None):
+    """
+    Stream commits out of a commit log, optionally just the range
+    [start, stop) by position in the log. The offset index lets a range be
+    read without parsing the commits before it.
+
+    Args:
+        log_filename (str): The file path of the git log.
+        start (int, optional): Position of the first commit to read. Defaults to 0.
+        stop (int, optional): Position to stop before, None for the end of the log.
+
+    Returns:
+        generator: A dict per commit with sha, timestamp, date, author, email,
+        message and files, a list of [additions, deletions, filename].
+    """
+    with open(log_filename, "rb") as file:
+        version = _read_log_header(file.readline(), log_filename)
+        if version == 1:
+            file.seek(0)
+            lines = (line.decode("utf-8", errors="replace") for line in file)
+            yield from islice(_parse_legacy_log(lines), start, stop)
+            return
+
+        offset = _get_indexed_offset(log_filename, start) if start else None
+        if offset is not None:
+            file.seek(offset)
+            commits = (json.loads(line) for line in file)
+            yield from islice(commits, None, None if stop is None else stop - start)
+        else:
+            commits = (json.loads(line) for line in file)
+            yield from islice(commits, start, stop)
+
+def _get_indexed_offset(log_filename, position):
+    index_path = _get_index_path(log_filename)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "rb") as f:
+        f.seek(position * _INDEX_ENTRY.size)
+        entry = f.read(_INDEX_ENTRY.size)
+    if len(entry) < _INDEX_ENTRY.size:
+        return None
+    return _INDEX_ENTRY.unpack(entry)[0]
+
+def iter_commit_rows(log_filename, exclude_file_pattern="", exclude_author_pattern="", start=0, stop=None):
+    """
+    Stream (commit_hash, timestamp, date, author, email, filename, churn_count)
+    rows out of a git log file, one per changed file, reading it a line at a
+    time so memory use doesn't grow with the size of the log.
+
+    Args:
+        log_filename (str): The file path of the git log.
+        exclude_file_pattern (str, optional): Regex for files to leave out. Defaults to "".
+        exclude_author_pattern (str, optional): Regex for authors to leave out. Defaults to "".
+        start (int, optional): Position of the first commit to read. Defaults to 0.
+        stop (int, optional): Position to stop before, None for the end of the log.
+
+    Returns:
+        generator: One tuple per file per commit, in log order.
+    """
+    commits = read_commit_log(log_filename, start, stop)
+    yield from _process_git_log(commits, exclude_file_pattern, exclude_author_pattern)
+
+def iter_commit_rows_parallel(log_filename, exclude_file_pattern="", exclude_author_pattern="", workers=None):
+    """
+    Like iter_commit_rows, but parses the log on a pool of worker processes.
+
+    The log is cut into shards at line (so commit) boundaries with mmap,
+    each worker parses a shard into rows, and the rows come back here in
+    log order so a single writer can load them.
+
+    Args:
+        log_filename (str): The file path of the git log.
+        exclude_file_pattern (str, optional): Regex for files to leave out. Defaults to "".
+        exclude_author_pattern (str, optional): Regex for authors to leave out. Defaults to "".
+        workers (int, optional): How many processes to use. Defaults to the number of CPUs.
+
+    Returns:
+        generator: One tuple per file per commit, in log order.
+    """
+    workers = workers or os.cpu_count() or 1
+    with open(log_filename, "rb") as file:
+        version = _read_log_header(file.readline(), log_filename)
+    if version == 1 or workers == 1:
+        # the old text format has multi-line records, read it serially
+        yield from iter_commit_rows(log_filename, exclude_file_pattern, exclude_author_pattern)
+        return
+
+    shards = _find_shards(log_filename, workers)
+    logging.info("Parsing %s in %d shards on %d processes", log_filename, len(shards), workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # keep a couple of shards per worker in flight, so parsed rows don't
+        # pile up in memory while the writer catches up
+        pending = deque()
+        for start, end in shards:
+            pending.append(executor.submit(_parse_shard, log_filename, start, end,
+                                           exclude_file_pattern, exclude_author_pattern))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def _find_shards(log_filename, workers):
+    # (start, end) byte ranges covering every commit line, each ending just
+    # after a newline
+    size = os.path.getsize(log_filename)
+    with open(log_filename, "rb") as file:
+        file.readline()
+        first = file.tell()
+        if first >= size:
+            return []
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            shard_bytes = min(max((size - first) // (workers * 4), MIN_SHARD_BYTES), MAX_SHARD_BYTES)
+            shards = []
+            start = first
+            while start < size:
+                newline = data.find(b"\n", min(start + shard_bytes, size) - 1)
+                end = size if newline == -1 else newline + 1
+                shards.append((start, end))
+                start = end
+    return shards
+
+def _parse_shard(log_filename, start, end, exclude_file_pattern, exclude_author_pattern):
+    # runs in a worker process
+    with open(log_filename, "rb") as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        commits = (json.loads(line) for line in data[start:end].splitlines() if line.strip())
+        return list(_process_git_log(commits, exclude_file_pattern, exclude_author_pattern))
+
 def _strip_timezone_offset(timestamp_str):
-    timezone_offset_pattern = r"[+\-][0-9]{2}:[0-9]{2}$"
-    return re.sub(timezone_offset_pattern, "", timestamp_str)
+    return _TIMEZONE_OFFSET.sub("", timestamp_str)
 
-def _process_git_log(log, exclude_file_pattern="", exclude_author_pattern=""):
-    commits = log.split("^^")
-    csv_data = "commit_hash,timestamp,date,author,email,filename,churn_count\n"
+def _process_git_log(commits, exclude_file_pattern="", exclude_author_pattern=""):
+    file_excluded = _compile_exclude_pattern(exclude_file_pattern)
+    author_excluded = _compile_exclude_pattern(exclude_author_pattern)
 
     for commit in commits:
-        commit = commit.strip()
-        if commit:
-            commit_lines = commit.split("\n")
-            commit_info = commit_lines[0].split("--")
-
+        if author_excluded(commit["author"]):
+            continue
+        row = (commit["sha"], int(commit["timestamp"]), _strip_timezone_offset(commit["date"]),
+               commit["author"], commit["email"])
+        for insertions, deletions, file_path in commit["files"]:
+            if not file_excluded(file_path):
+                yield row + (file_path, insertions + deletions)
+
+def _parse_legacy_log(lines):
+    # reads the version 1 "^^sha--epoch--iso--author--email--message" format
+    commit = None
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("^^"):
+            if commit is not None:
+                yield commit
+            commit_info = line[2:].split("--", 5)
             if len(commit_info) < 5:
-                logging.info("Skipping invalid commit entry: %s", commit_lines)
+                logging.info("Skipping invalid commit entry: %s", line)
+                commit = None
                 continue
 
             commit_hash, epoch, timestamp, author, email = commit_info[:5]
-            timestamp = _strip_timezone_offset(timestamp)
-#            date = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S").date()
-
-            if not _is_excluded(author, exclude_author_pattern):
-                for churn_line in commit_lines[1:]:
-                    churn_info = churn_line.split("\t")
-                    if len(churn_info) < 3:
-                        logging.info("Skipping invalid churn line: %s", churn_line)
-                        continue
-
-                    insertions = _parse_churn_value(churn_info[0])
-                    deletions = _parse_churn_value(churn_info[1])
-                    churn_count = insertions + deletions
-                    file_path = churn_info[2]
-
-                    if not _is_excluded(file_path, exclude_file_pattern):
-                        csv_data += f"{commit_hash},{epoch},{timestamp},{author},{email},{file_path},{churn_count}\n"
+            commit = {
+                "sha": commit_hash.strip(),
+                "timestamp": int(float(epoch)),
+                "date": timestamp,
+                "author": author,
+                "email": email,
+                "message": commit_info[5] if len(commit_info) > 5 else "",
+                "files": [],
+            }
+        elif commit is not None and line.strip():
+            churn_info = line.split("\t")
+            if len(churn_info) < 3:
+                logging.info("Skipping invalid churn line: %s", line)
+                continue
+            commit["files"].append([_parse_churn_value(churn_info[0]), _parse_churn_value(churn_info[1]), churn_info[2]])
+    if commit is not None:
+        yield commit
 
-    return csv_data
+def _compile_exclude_pattern(pattern):
+    # compiled once per log rather than once per line
+    if not pattern:
+        return lambda value: False
+    regex = re.compile(pattern, re.IGNORECASE)
+    return lambda value: regex.search(value) is not None
 
 def _parse_churn_value(value):
     return int(value) if value.strip() not in ["-", ""] else 0
-
-def _is_excluded(value, pattern):
-    return bool(pattern) and bool(re.findall(pattern, value, re.IGNORECASE))
@@ -0,0 +1,331 @@
+import time
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from .http_cache import ResponseCache
+
+GITHUB_API_URL = "https://api.github.com"
+
+# settings for the shared fetchers, see init_github_fetch
+FETCH_SETTINGS = {
+    "api_url": GITHUB_API_URL,
+    "max_workers": 8,
+    "min_remaining": 50,
+    "max_retries": 5,
+    # seconds to wait on a connection or between bytes of a response
+    "timeout": 60,
+    "cache_path": "output/cache/github_responses.db",
+    "cache_max_bytes": 512 * 1024 * 1024,
+}
+
+# response headers worth keeping with a cached body
+CACHED_HEADERS = ["Content-Type", "Link"]
+
+_FETCHERS = {}
+_FETCHERS_LOCK = threading.Lock()
+
+
+def init_github_fetch(max_workers=None, min_remaining=None, api_url=None, cache_max_mb=None, timeout=None):
+    """
+    Configure the shared GitHub fetch layer. Call before the first fetch.
+
+    Args:
+        max_workers (int, optional): How many GitHub requests to run in parallel.
+        min_remaining (int, optional): How much of the rate limit to hold back;
+            once X-RateLimit-Remaining drops to this, requests wait for the reset.
+        api_url (str, optional): The API root, for GitHub Enterprise or a local mock server.
+        cache_max_mb (int, optional): Size cap of the on-disk response cache, 0 turns it off.
+        timeout (float, optional): Seconds to wait on a stalled connection before retrying.
+    """
+    if cache_max_mb is not None:
+        FETCH_SETTINGS["cache_max_bytes"] = int(cache_max_mb) * 1024 * 1024
+    if api_url:
+        FETCH_SETTINGS["api_url"] = api_url
+    if max_workers is not None:
+        FETCH_SETTINGS["max_workers"] = int(max_workers)
+    if min_remaining is not None:
+        FETCH_SETTINGS["min_remaining"] = int(min_remaining)
+    if timeout is not None:
+        FETCH_SETTINGS["timeout"] = float(timeout)
+    logging.info("GitHub fetch settings: %s", FETCH_SETTINGS)
+
+
+def get_fetcher(access_token):
+    """
+    Get the shared GitHubFetcher for an access token, creating it on first use.
+
+    Args:
+        access_token (str): The access token for the GitHub API.
+
+    Returns:
+        GitHubFetcher: The fetcher, shared by every stage of the pipeline.
+    """
+    with _FETCHERS_LOCK:
+        fetcher = _FETCHERS.get(access_token)
+        if fetcher is None:
+            fetcher = GitHubFetcher(access_token,
+                                    max_workers=FETCH_SETTINGS["max_workers"],
+                                    min_remaining=FETCH_SETTINGS["min_remaining"],
+                                    max_retries=FETCH_SETTINGS["max_retries"],
+                                    api_url=FETCH_SETTINGS["api_url"],
+                                    cache=_get_response_cache(),
+                                    timeout=FETCH_SETTINGS["timeout"])
+            _FETCHERS[access_token] = fetcher
+        return fetcher
+
+
+def log_github_fetch_stats():
+    """
+    Log the response cache hit and miss counts for the shared fetchers.
+    """
+    cache = _get_response_cache()
+    if cache is not None:
+        cache.flush()
+        cache.log_stats()
+
+
+_RESPONSE_CACHE = []
+
+def _get_response_cache():
+    # one cache for every fetcher; the caller holds _FETCHERS_LOCK or is logging
+    if not _RESPONSE_CACHE:
+        cache = None
+        if FETCH_SETTINGS["cache_max_bytes"] > 0:
+            cache = ResponseCache(FETCH_SETTINGS["cache_path"], FETCH_SETTINGS["cache_max_bytes"])
+        _RESPONSE_CACHE.append(cache)
+    return _RESPONSE_CACHE[0]
+
+
+class GitHubFetcher:
+    """
+    A small GitHub REST client shared across the pipeline.
+
+    Keeps one pooled HTTP session, tracks the X-RateLimit-Remaining and
+    X-RateLimit-Reset headers so it can slow down before GitHub starts
+    refusing requests, and runs batches of requests on a bounded worker pool.
+    GETs go through an optional ResponseCache and are sent as conditional
+    requests, since 304 responses don't count against the rate limit.
+    """
+
+    def __init__(self, access_token, max_workers=8, min_remaining=50, max_retries=5, api_url=GITHUB_API_URL, cache=None,
+                 timeout=60):
+        self.api_url = api_url.rstrip("/")
+        self.cache = cache
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.min_remaining = min_remaining
+        self.max_retries = max_retries
+
+        self.session = requests.Session()
+        # room for the worker pool plus callers fetching on their own threads
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers * 2)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+        })
+        if access_token:
+            self.session.headers["Authorization"] = f"Bearer {access_token}"
+        # what a token can see differs, so cached responses are kept per
+        # token, under a hash rather than the token itself
+        self._cache_scope = hashlib.sha256(access_token.encode("utf-8")).hexdigest()[:16] if access_token else "anonymous"
+
+        self._lock = threading.Lock()
+        # REST and GraphQL have separate budgets, so track each resource
+        # (X-RateLimit-Resource) on its own: {resource: [remaining, reset_at]}
+        self._rate_limits = {}
+
+    def get(self, path, params=None, immutable=False):
+        """
+        GET a GitHub API path (or full URL), waiting on the rate limit and
+        retrying on rate limit refusals and server errors.
+
+        Args:
+            path (str): The API path or full URL.
+            params (dict, optional): Query string parameters.
+            immutable (bool, optional): The resource can never change (a commit
+                or blob by SHA), so a cached copy is used without asking GitHub.
+
+        Returns:
+            requests.Response: The successful response.
+        """
+        url = path if path.startswith("http") else f"{self.api_url}{path}"
+        if self.cache is None:
+            return self._request("GET", url, "core", params=params)
+
+        url = requests.Request("GET", url, params=params).prepare().url
+        key = f"{self._cache_scope} {url}"
+        cached = self.cache.get(key)
+        headers = {}
+        if cached is not None:
+            if immutable:
+                self.cache.record("hit")
+                self.cache.touch(key)
+                return self._cached_response(url, cached)
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        response = self._request("GET", url, "core", headers=headers)
+        if response.status_code == 304:
+            self.cache.record("revalidated")
+            self.cache.touch(key)
+            return self._cached_response(url, cached)
+
+        self.cache.record("miss")
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified or immutable:
+            kept_headers = {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers}
+            self.cache.put(key, etag, last_modified, kept_headers, response.content)
+        return response
+
+    def graphql(self, query, variables=None):
+        """
+        Run a GraphQL query against the API's /graphql endpoint.
+
+        Returns:
+            dict: The "data" member of the response.
+        """
+        response = self._request("POST", f"{self.api_url}/graphql", "graphql",
+                                 json={"query": query, "variables": variables or {}})
+        payload = response.json()
+        if payload.get("errors"):
+            raise ValueError(f"GraphQL query failed: {payload['errors']}")
+        return payload["data"]
+
+    def _request(self, method, url, resource, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_rate_limit(resource)
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # dropped connections and stalls get the same backoff as server errors
+                if attempt == self.max_retries:
+                    raise
+                delay = 2 ** attempt
+                logging.info("GitHub request for %s failed (%s), retrying in %.1fs", url, e, delay)
+                time.sleep(delay)
+                continue
+            self._update_rate_limit(response, resource)
+
+            delay = self._get_retry_delay(response, attempt)
+            if delay is None or attempt == self.max_retries:
+                response.raise_for_status()
+                return response
+            logging.info("GitHub returned %s for %s, retrying in %.1fs", response.status_code, url, delay)
+            time.sleep(delay)
+
+    def get_json(self, path, params=None, immutable=False):
+        return self.get(path, params=params, immutable=immutable).json()
+
+    def paginate(self, path, params=None):
+        """
+        Yield every item from a paginated GitHub list endpoint, following the
+        Link headers 100 items at a time.
+        """
+        params = dict(params or {})
+        params.setdefault("per_page", 100)
+        response = self.get(path, params=params)
+        while True:
+            for item in response.json():
+                yield item
+            next_link = response.links.get("next")
+            if next_link is None:
+                return
+            response = self.get(next_link["url"])
+
+    def get_commit(self, full_repo_name, sha):
+        """
+        GET a single commit with all of its files. The commit endpoint pages
+        its files list (300 a page) through Link headers like a list
+        endpoint, so later pages are fetched and added to the first.
+
+        Returns:
+            dict: The commit, with every page of its files.
+        """
+        response = self.get(f"/repos/{full_repo_name}/commits/{sha}", immutable=True)
+        commit = response.json()
+        next_link = response.links.get("next")
+        while next_link is not None:
+            response = self.get(next_link["url"], immutable=True)
+            commit.setdefault("files", []).extend(response.json().get("files", []))
+            next_link = response.links.get("next")
+        return commit
+
+    def map_ordered(self, func, items):
+        """
+        Run func over items on the worker pool and yield the results in the
+        same order as items. Only a couple of pool-fulls of work are queued
+        ahead of the consumer, so items can be a lazy (paginated) iterator.
+        """
+        window = self.max_workers * 2
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _cached_response(self, url, cached):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(cached["headers"])
+        response._content = cached["body"]
+        return response
+
+    def _wait_for_rate_limit(self, resource):
+        with self._lock:
+            limit = self._rate_limits.get(resource)
+            if limit is None:
+                return
+            if limit[0] > self.min_remaining:
+                # count requests in flight, so parallel workers don't overshoot
+                limit[0] -= 1
+                return
+            delay = limit[1] - time.time() + 1
+        if delay > 0:
+            logging.info("GitHub %s rate limit nearly used up, waiting %.0fs for the reset", resource, delay)
+            time.sleep(delay)
+        with self._lock:
+            limit = self._rate_limits.get(resource)
+            if limit is not None and time.time() >= limit[1]:
+                del self._rate_limits[resource]
+
+    def _update_rate_limit(self, response, resource):
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset_at = response.headers.get("X-RateLimit-Reset")
+        if remaining is None or reset_at is None:
+            return
+        resource = response.headers.get("X-RateLimit-Resource", resource)
+        remaining = int(remaining)
+        reset_at = int(reset_at)
+        with self._lock:
+            # responses can come back out of order, so only trust the lowest
+            # count we've seen for the current window
+            limit = self._rate_limits.get(resource)
+            if limit is None or limit[1] != reset_at or remaining < limit[0]:
+                self._rate_limits[resource] = [remaining, reset_at]
+
+    def _get_retry_delay(self, response, attempt):
+        status = response.status_code
+        if status in (403, 429):
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None:
+                return float(retry_after)
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                return max(int(response.headers.get("X-RateLimit-Reset", 0)) - time.time(), 0) + 1
+            return None
+        if status >= 500:
+            return 2 ** attempt
+        return None
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+# how many last-used times to hold before writing them, see touch
+TOUCH_BATCH_SIZE = 200
+
+
+class ResponseCache:
+    """
+    An on-disk cache of GitHub API responses, keyed by the caller; the
+    fetchers use the URL and a hash of the token it was fetched with (see
+    GitHubFetcher), so a private response is never served to another token.
+
+    Stores the body with the ETag and Last-Modified validators so requests
+    can be made conditional, and evicts the least recently used responses
+    once the cache grows past max_bytes.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # {key: last used} not yet written
+        self._touched = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # the url column holds the key
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                headers TEXT,
+                body BLOB,
+                size INTEGER,
+                last_used REAL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)')
+        self._conn.commit()
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, key):
+        """
+        Look up a cached response.
+
+        Returns:
+            dict: etag, last_modified, headers and body, or None if not cached.
+        """
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT etag, last_modified, headers, body FROM responses WHERE url = ?
+            ''', (key,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "etag": row[0],
+            "last_modified": row[1],
+            "headers": json.loads(row[2]),
+            "body": row[3],
+        }
+
+    def put(self, key, etag, last_modified, headers, body):
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._conn.execute('SELECT size FROM responses WHERE url = ?', (key,)).fetchone()
+            self._conn.execute('''
+                INSERT OR REPLACE INTO responses (url, etag, last_modified, headers, body, size, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (key, etag, last_modified, json.dumps(headers), body, size, time.time()))
+            self._touched.pop(key, None)
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                # evict by up-to-date last used times
+                self._write_touched()
+                self._evict()
+            self._conn.commit()
+
+    def touch(self, key):
+        """
+        Mark a response as used. The times only matter for eviction, so
+        they're written in batches rather than a transaction per hit.
+        """
+        with self._lock:
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_BATCH_SIZE:
+                self._write_touched()
+                self._conn.commit()
+
+    def flush(self):
+        """
+        Write the last used times held back by touch.
+        """
+        with self._lock:
+            self._write_touched()
+            self._conn.commit()
+
+    def record(self, outcome):
+        """
+        Count a lookup: "hit" (served from disk), "revalidated" (a 304) or "miss".
+        """
+        with self._lock:
+            if outcome == "hit":
+                self.hits += 1
+            elif outcome == "revalidated":
+                self.revalidated += 1
+            else:
+                self.misses += 1
+
+    def log_stats(self):
+        total = self.hits + self.revalidated + self.misses
+        hit_rate = (self.hits + self.revalidated) / total if total else 0
+        logging.info("GitHub response cache: %d hits, %d revalidated (304), %d misses, %.1f%% hit rate, %.1f MB on disk",
+                     self.hits, self.revalidated, self.misses, hit_rate * 100, self._total_bytes / (1024 * 1024))
+
+    def _write_touched(self):
+        self._conn.executemany('UPDATE responses SET last_used = ? WHERE url = ?',
+                               [(last_used, key) for key, last_used in self._touched.items()])
+        self._touched.clear()
+
+    def _evict(self):
+        # drop least recently used responses until we're back under 90% of the cap
+        target = self.max_bytes * 0.9
+        cursor = self._conn.execute('SELECT url, size FROM responses ORDER BY last_used ASC')
+        evict = []
+        for url, size in cursor:
+            if self._total_bytes <= target:
+                break
+            evict.append((url,))
+            self._total_bytes -= size
+        self._conn.executemany('DELETE FROM responses WHERE url = ?', evict)
+        logging.debug("Evicted %d responses from the GitHub response cache", len(evict))
@@ -1,93 +1,49 @@
 import os
 import pandas as pd
-import sqlite3
 import logging
+from datetime import datetime
+from .export_git import iter_commit_rows, iter_commit_rows_parallel, _get_log_file_path
+from .db import get_connection, close_connections
 
-def _connect_to_db(db_name):
-    return sqlite3.connect(db_name)
+# rows per INSERT transaction when loading the commit log
+INSERT_BATCH_SIZE = 5000
 
-def _insert_data(config, conn):
-    repo_name = config['repo_name']
-    repo_owner = config['repo_owner']
-    
-    cursor = conn.cursor()
-
-    # Load CSV files into DataFrames
-    commits_df = pd.read_csv(f'output/{repo_owner}-{repo_name}.csv')
-    # Create commits tables, if it doesn't exist
-    cursor.execute('''
-            CREATE TABLE IF NOT EXISTS commits (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                commit_hash TEXT,
-                timestamp INTEGER,
-                date TEXT,
-                author TEXT,
-                email TEXT,
-                filename TEXT,
-                churn_count INTEGER,
-                description TEXT,
-                UNIQUE(commit_hash, filename)
-            )
-        ''')
-
-    # Insert data into the commits table while respecting the unique constraint
-    count_dupes = 0
-    for index, row in commits_df.iterrows():
-        try:
-            cursor.execute('''
-                    INSERT INTO commits (commit_hash, timestamp, date, author, email, filename, churn_count)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (row['commit_hash'], row['timestamp'], row['date'], row['author'], row['email'], row['filename'], row['churn_count']))
-        except sqlite3.IntegrityError:
-            # Skip the duplicate entry
-            logging.debug("Commit already exists for commit_hash: %s and filename: %s.", row['commit_hash'], row['filename'])
-            count_dupes += 1
+# per-row rollup triggers that bulk loads replace with set-based updates
+BULK_LOAD_TRIGGERS = ("git_commits_rollup_insert", "commit_files_rollup_insert")
 
-    conn.commit()
-    if count_dupes > 0:
-        logging.info("Skipped %d duplicate entries.", count_dupes)
-
-    # create tags table, if it doesn't exist
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tags (
+# schema changes, in order; each database records the versions it has in
+# the schema_version table, and fill_db brings it up to date before loading
+SCHEMA_MIGRATIONS = [
+    (1, "tables created by fill_db", [
+        '''CREATE TABLE IF NOT EXISTS commits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            commit_hash TEXT,
+            timestamp INTEGER,
+            date TEXT,
+            author TEXT,
+            email TEXT,
+            filename TEXT,
+            churn_count INTEGER,
+            description TEXT,
+            UNIQUE(commit_hash, filename)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS tags (
             id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL UNIQUE            
-        )
-    ''')
-
-    tags = config.get('tags', [])
-
-    for tag in tags:
-        cursor.execute('INSERT OR IGNORE INTO tags (name) VALUES (?)', (tag,))
-
-    # Create commit_tags table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS commit_tags (
+            name TEXT NOT NULL UNIQUE
+        )''',
+        '''CREATE TABLE IF NOT EXISTS commit_tags (
             commit_id INTEGER,
             tag_id INTEGER,
             value REAL,
             PRIMARY KEY (commit_id, tag_id),
             FOREIGN KEY (commit_id) REFERENCES commits(id),
             FOREIGN KEY (tag_id) REFERENCES tags(id)
-        )
-    ''')
-
-    conn.commit()
-
-def _import_pull_requests(config, conn):
-    repo_name = config['repo_name']
-    repo_owner = config['repo_owner']
-    file_path = f'output/{repo_owner}-{repo_name}_pull_requests.txt'
-    pull_requests_df = pd.read_csv(file_path, delimiter='\t')
-
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS pull_requests (
+        )''',
+        '''CREATE TABLE IF NOT EXISTS pull_requests (
             id INTEGER PRIMARY KEY,
             number INTEGER,
             title TEXT,
-            user_login TEXT,       
+            user_login TEXT,
             state TEXT,
             created_at TEXT,
             merged INTEGER,
@@ -98,22 +54,16 @@ def _import_pull_requests(config, conn):
             comments TEXT,
             review_comments TEXT,
             closed_at TEXT,
-            html_url TEXT, 
-            description TEXT
-        )
-    ''')
-
-    pull_requests_df.to_sql('pull_requests', conn, if_exists='append', index=False)
-
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pull_requests_merge_commit_sha ON pull_requests (merge_commit_sha)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pull_requests_merged_at ON pull_requests (merged_at)')
-
-    conn.commit()
-
-def _create_summaries_table(conn):
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS summaries (
+            html_url TEXT,
+            description TEXT,
+            updated_at TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS pull_request_commits (
+            pr_number INTEGER,
+            commit_hash TEXT,
+            PRIMARY KEY (pr_number, commit_hash)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS summaries (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT,
             hash TEXT,
@@ -124,29 +74,556 @@ def _create_summaries_table(conn):
             end_date DATE,
             createdAt DATE,
             UNIQUE(name, hash)
+        )''',
+    ]),
+    (2, "indexes for the web and insights queries", [
+        # author leaderboards, and their first/last commit dates
+        'CREATE INDEX IF NOT EXISTS idx_commits_author ON commits (author, timestamp, date, commit_hash)',
+        # everything filtered on a start date
+        'CREATE INDEX IF NOT EXISTS idx_commits_timestamp ON commits (timestamp, author, commit_hash, filename, date)',
+        'CREATE INDEX IF NOT EXISTS idx_commits_date ON commits (date)',
+        'CREATE INDEX IF NOT EXISTS idx_commits_filename ON commits (filename, commit_hash)',
+        # the file views only count files that got a description
+        '''CREATE INDEX IF NOT EXISTS idx_commits_described_filename
+           ON commits (filename, commit_hash, churn_count) WHERE description IS NOT NULL''',
+        'CREATE INDEX IF NOT EXISTS idx_commit_tags_tag_id ON commit_tags (tag_id, commit_id, value)',
+        # pr.merge_commit_sha = c.commit_hash is served by this one and the
+        # UNIQUE(commit_hash, filename) index on commits
+        'CREATE INDEX IF NOT EXISTS idx_pull_requests_merge_commit_sha ON pull_requests (merge_commit_sha)',
+        'CREATE INDEX IF NOT EXISTS idx_pull_requests_closed_at ON pull_requests (closed_at)',
+        'CREATE INDEX IF NOT EXISTS idx_pull_requests_merged_at ON pull_requests (merged_at)',
+        'CREATE INDEX IF NOT EXISTS idx_pull_request_commits_commit_hash ON pull_request_commits (commit_hash)',
+    ]),
+    # one row per commit, with authors and paths interned to integer ids;
+    # commit_files keeps the old commits ids so commit_tags still lines up,
+    # and the commits view (with its triggers) keeps the old queries working
+    (3, "normalized commits, authors, paths and commit_files", [
+        '''CREATE TABLE authors (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            UNIQUE(name, email)
+        )''',
+        '''CREATE TABLE paths (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE
+        )''',
+        '''CREATE TABLE git_commits (
+            id INTEGER PRIMARY KEY,
+            commit_hash TEXT NOT NULL UNIQUE,
+            timestamp INTEGER,
+            date TEXT,
+            author_id INTEGER REFERENCES authors(id)
+        )''',
+        '''CREATE TABLE commit_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            commit_id INTEGER NOT NULL REFERENCES git_commits(id),
+            path_id INTEGER NOT NULL REFERENCES paths(id),
+            churn_count INTEGER,
+            description TEXT,
+            UNIQUE(commit_id, path_id)
+        )''',
+        '''INSERT INTO authors (name, email)
+           SELECT DISTINCT COALESCE(author, ''), COALESCE(email, '') FROM commits''',
+        '''INSERT INTO paths (path)
+           SELECT DISTINCT filename FROM commits WHERE filename IS NOT NULL''',
+        '''INSERT INTO git_commits (commit_hash, timestamp, date, author_id)
+           SELECT c.commit_hash, MIN(c.timestamp), MIN(c.date), MIN(a.id)
+           FROM commits c
+           JOIN authors a ON a.name = COALESCE(c.author, '') AND a.email = COALESCE(c.email, '')
+           WHERE c.commit_hash IS NOT NULL
+           GROUP BY c.commit_hash''',
+        '''INSERT INTO commit_files (id, commit_id, path_id, churn_count, description)
+           SELECT c.id, g.id, p.id, c.churn_count, c.description
+           FROM commits c
+           JOIN git_commits g ON g.commit_hash = c.commit_hash
+           JOIN paths p ON p.path = c.filename''',
+        'DROP TABLE commits',
+        '''CREATE VIEW commits AS
+           SELECT f.id, g.commit_hash, g.timestamp, g.date, a.name AS author, a.email,
+                  p.path AS filename, f.churn_count, f.description
+           FROM commit_files f
+           JOIN git_commits g ON g.id = f.commit_id
+           JOIN authors a ON a.id = g.author_id
+           JOIN paths p ON p.id = f.path_id''',
+        '''CREATE TRIGGER commits_insert INSTEAD OF INSERT ON commits
+           BEGIN
+               INSERT OR IGNORE INTO authors (name, email)
+               VALUES (COALESCE(NEW.author, ''), COALESCE(NEW.email, ''));
+               INSERT OR IGNORE INTO paths (path) VALUES (NEW.filename);
+               INSERT OR IGNORE INTO git_commits (commit_hash, timestamp, date, author_id)
+               VALUES (NEW.commit_hash, NEW.timestamp, NEW.date,
+                       (SELECT id FROM authors WHERE name = COALESCE(NEW.author, '') AND email = COALESCE(NEW.email, '')));
+               INSERT OR IGNORE INTO commit_files (id, commit_id, path_id, churn_count, description)
+               VALUES (NEW.id,
+                       (SELECT id FROM git_commits WHERE commit_hash = NEW.commit_hash),
+                       (SELECT id FROM paths WHERE path = NEW.filename),
+                       NEW.churn_count, NEW.description);
+           END''',
+        '''CREATE TRIGGER commits_update INSTEAD OF UPDATE OF churn_count, description ON commits
+           BEGIN
+               UPDATE commit_files SET churn_count = NEW.churn_count, description = NEW.description
+               WHERE id = OLD.id;
+           END''',
+        '''CREATE TRIGGER commits_delete INSTEAD OF DELETE ON commits
+           BEGIN
+               DELETE FROM commit_files WHERE id = OLD.id;
+           END''',
+        'CREATE INDEX idx_git_commits_timestamp ON git_commits (timestamp, author_id)',
+        'CREATE INDEX idx_git_commits_date ON git_commits (date)',
+        'CREATE INDEX idx_git_commits_author_id ON git_commits (author_id, timestamp)',
+        'CREATE INDEX idx_commit_files_path_id ON commit_files (path_id, commit_id)',
+        '''CREATE INDEX idx_commit_files_described_path_id
+           ON commit_files (path_id, commit_id, churn_count) WHERE description IS NOT NULL''',
+    ]),
+    # per-day totals for the dashboard and insights, so they read a row per
+    # day instead of scanning the history; triggers keep them current as
+    # commits are loaded, described and tagged. Days are UTC.
+    (4, "rollup tables for the web and insights aggregates", [
+        '''CREATE TABLE author_day_stats (
+            day TEXT NOT NULL,
+            author_id INTEGER NOT NULL,
+            commits INTEGER NOT NULL DEFAULT 0,
+            files INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, author_id)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE path_day_stats (
+            day TEXT NOT NULL,
+            path_id INTEGER NOT NULL,
+            commits INTEGER NOT NULL DEFAULT 0,
+            churn INTEGER NOT NULL DEFAULT 0,
+            described_commits INTEGER NOT NULL DEFAULT 0,
+            described_churn INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, path_id)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE tag_day_stats (
+            day TEXT NOT NULL,
+            tag_id INTEGER NOT NULL,
+            commits INTEGER NOT NULL DEFAULT 0,
+            total_value REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, tag_id)
+        ) WITHOUT ROWID''',
+        '''INSERT INTO author_day_stats (day, author_id, commits, files)
+           SELECT date(g.timestamp, 'unixepoch'), g.author_id, COUNT(*),
+                  SUM((SELECT COUNT(*) FROM commit_files f WHERE f.commit_id = g.id))
+           FROM git_commits g
+           GROUP BY 1, 2''',
+        '''INSERT INTO path_day_stats (day, path_id, commits, churn, described_commits, described_churn)
+           SELECT date(g.timestamp, 'unixepoch'), f.path_id, COUNT(*), COALESCE(SUM(f.churn_count), 0),
+                  COUNT(f.description), COALESCE(SUM(CASE WHEN f.description IS NOT NULL THEN f.churn_count END), 0)
+           FROM commit_files f
+           JOIN git_commits g ON g.id = f.commit_id
+           GROUP BY 1, 2''',
+        '''INSERT INTO tag_day_stats (day, tag_id, commits, total_value)
+           SELECT date(g.timestamp, 'unixepoch'), ct.tag_id, COUNT(*), TOTAL(ct.value)
+           FROM commit_tags ct
+           JOIN commit_files f ON f.id = ct.commit_id
+           JOIN git_commits g ON g.id = f.commit_id
+           GROUP BY 1, 2''',
+        '''CREATE TRIGGER git_commits_rollup_insert AFTER INSERT ON git_commits
+           BEGIN
+               INSERT INTO author_day_stats (day, author_id, commits)
+               VALUES (date(NEW.timestamp, 'unixepoch'), NEW.author_id, 1)
+               ON CONFLICT(day, author_id) DO UPDATE SET commits = commits + 1;
+           END''',
+        '''CREATE TRIGGER commit_files_rollup_insert AFTER INSERT ON commit_files
+           BEGIN
+               INSERT INTO author_day_stats (day, author_id, files)
+               SELECT date(timestamp, 'unixepoch'), author_id, 1
+               FROM git_commits WHERE id = NEW.commit_id
+               ON CONFLICT(day, author_id) DO UPDATE SET files = files + 1;
+               INSERT INTO path_day_stats (day, path_id, commits, churn, described_commits, described_churn)
+               SELECT date(timestamp, 'unixepoch'), NEW.path_id, 1, COALESCE(NEW.churn_count, 0),
+                      NEW.description IS NOT NULL,
+                      CASE WHEN NEW.description IS NOT NULL THEN COALESCE(NEW.churn_count, 0) ELSE 0 END
+               FROM git_commits WHERE id = NEW.commit_id
+               ON CONFLICT(day, path_id) DO UPDATE SET
+                   commits = commits + 1,
+                   churn = churn + excluded.churn,
+                   described_commits = described_commits + excluded.described_commits,
+                   described_churn = described_churn + excluded.described_churn;
+           END''',
+        '''CREATE TRIGGER commit_files_rollup_update AFTER UPDATE OF churn_count, description ON commit_files
+           BEGIN
+               UPDATE path_day_stats SET
+                   churn = churn - COALESCE(OLD.churn_count, 0) + COALESCE(NEW.churn_count, 0),
+                   described_commits = described_commits
+                       - (OLD.description IS NOT NULL) + (NEW.description IS NOT NULL),
+                   described_churn = described_churn
+                       - CASE WHEN OLD.description IS NOT NULL THEN COALESCE(OLD.churn_count, 0) ELSE 0 END
+                       + CASE WHEN NEW.description IS NOT NULL THEN COALESCE(NEW.churn_count, 0) ELSE 0 END
+               WHERE path_id = NEW.path_id
+                 AND day = (SELECT date(timestamp, 'unixepoch') FROM git_commits WHERE id = NEW.commit_id);
+           END''',
+        # a file's tags go with it, while the rollup can still find their day
+        '''CREATE TRIGGER commit_files_delete_tags BEFORE DELETE ON commit_files
+           BEGIN
+               DELETE FROM commit_tags WHERE commit_id = OLD.id;
+           END''',
+        '''CREATE TRIGGER commit_files_rollup_delete AFTER DELETE ON commit_files
+           BEGIN
+               UPDATE author_day_stats SET files = files - 1
+               WHERE (day, author_id) = (SELECT date(timestamp, 'unixepoch'), author_id
+                                         FROM git_commits WHERE id = OLD.commit_id);
+               UPDATE path_day_stats SET
+                   commits = commits - 1,
+                   churn = churn - COALESCE(OLD.churn_count, 0),
+                   described_commits = described_commits - (OLD.description IS NOT NULL),
+                   described_churn = described_churn
+                       - CASE WHEN OLD.description IS NOT NULL THEN COALESCE(OLD.churn_count, 0) ELSE 0 END
+               WHERE path_id = OLD.path_id
+                 AND day = (SELECT date(timestamp, 'unixepoch') FROM git_commits WHERE id = OLD.commit_id);
+               DELETE FROM path_day_stats
+               WHERE path_id = OLD.path_id AND commits <= 0
+                 AND day = (SELECT date(timestamp, 'unixepoch') FROM git_commits WHERE id = OLD.commit_id);
+           END''',
+        '''CREATE TRIGGER commit_tags_rollup_insert AFTER INSERT ON commit_tags
+           BEGIN
+               INSERT INTO tag_day_stats (day, tag_id, commits, total_value)
+               SELECT date(g.timestamp, 'unixepoch'), NEW.tag_id, 1, COALESCE(NEW.value, 0)
+               FROM commit_files f JOIN git_commits g ON g.id = f.commit_id
+               WHERE f.id = NEW.commit_id
+               ON CONFLICT(day, tag_id) DO UPDATE SET
+                   commits = commits + 1,
+                   total_value = total_value + excluded.total_value;
+           END''',
+        '''CREATE TRIGGER commit_tags_rollup_update AFTER UPDATE OF value ON commit_tags
+           BEGIN
+               UPDATE tag_day_stats SET total_value = total_value - COALESCE(OLD.value, 0) + COALESCE(NEW.value, 0)
+               WHERE tag_id = NEW.tag_id
+                 AND day = (SELECT date(g.timestamp, 'unixepoch')
+                            FROM commit_files f JOIN git_commits g ON g.id = f.commit_id
+                            WHERE f.id = NEW.commit_id);
+           END''',
+        '''CREATE TRIGGER commit_tags_rollup_delete AFTER DELETE ON commit_tags
+           BEGIN
+               UPDATE tag_day_stats SET commits = commits - 1, total_value = total_value - COALESCE(OLD.value, 0)
+               WHERE tag_id = OLD.tag_id
+                 AND day = (SELECT date(g.timestamp, 'unixepoch')
+                            FROM commit_files f JOIN git_commits g ON g.id = f.commit_id
+                            WHERE f.id = OLD.commit_id);
+               DELETE FROM tag_day_stats
+               WHERE tag_id = OLD.tag_id AND commits <= 0
+                 AND day = (SELECT date(g.timestamp, 'unixepoch')
+                            FROM commit_files f JOIN git_commits g ON g.id = f.commit_id
+                            WHERE f.id = OLD.commit_id);
+           END''',
+    ]),
+    # the normalized patch hash of each annotated file, so identical patches
+    # under different commits are only summarized once
+    (5, "patch fingerprints for duplicate diffs", [
+        '''CREATE TABLE patch_fingerprints (
+            commit_file_id INTEGER PRIMARY KEY REFERENCES commit_files(id),
+            fingerprint TEXT NOT NULL
+        )''',
+        'CREATE INDEX idx_patch_fingerprints_fingerprint ON patch_fingerprints (fingerprint, commit_file_id)',
+        '''CREATE TRIGGER commit_files_delete_fingerprint AFTER DELETE ON commit_files
+           BEGIN
+               DELETE FROM patch_fingerprints WHERE commit_file_id = OLD.id;
+           END''',
+    ]),
+    # whether a file's tags came from the LLM or the local tag model, which
+    # only learns from the LLM's
+    (6, "tag source", [
+        "ALTER TABLE commit_tags ADD COLUMN source TEXT NOT NULL DEFAULT 'llm'",
+    ]),
+    # each author's first and last commit date on the day, so their first and
+    # last activity aren't cut down to a UTC day
+    (7, "author activity dates in the rollup", [
+        'ALTER TABLE author_day_stats ADD COLUMN first_date TEXT',
+        'ALTER TABLE author_day_stats ADD COLUMN last_date TEXT',
+        '''UPDATE author_day_stats SET (first_date, last_date) = (
+               SELECT MIN(g.date), MAX(g.date) FROM git_commits g
+               WHERE g.author_id = author_day_stats.author_id
+                 AND g.timestamp >= CAST(strftime('%s', author_day_stats.day) AS INTEGER)
+                 AND g.timestamp < CAST(strftime('%s', author_day_stats.day, '+1 day') AS INTEGER))''',
+        'DROP TRIGGER git_commits_rollup_insert',
+        '''CREATE TRIGGER git_commits_rollup_insert AFTER INSERT ON git_commits
+           BEGIN
+               INSERT INTO author_day_stats (day, author_id, commits, first_date, last_date)
+               VALUES (date(NEW.timestamp, 'unixepoch'), NEW.author_id, 1, NEW.date, NEW.date)
+               ON CONFLICT(day, author_id) DO UPDATE SET
+                   commits = commits + 1,
+                   first_date = CASE WHEN first_date IS NULL OR excluded.first_date < first_date
+                                     THEN excluded.first_date ELSE first_date END,
+                   last_date = CASE WHEN last_date IS NULL OR excluded.last_date > last_date
+                                    THEN excluded.last_date ELSE last_date END;
+           END''',
+    ]),
+]
+
+def _insert_data(config, conn, git_log):
+    cursor = conn.cursor()
+
+    # Stream rows from the log into the commit tables in batches, all in one
+    # transaction, skipping ones the unique constraints say we already have.
+    # A failed load rolls back and is simply redone on the next run. With more
+    # than one ingest worker the parsing happens in other processes, but
+    # this connection stays the only writer.
+    ingest_workers = int(config.get('ingest_workers', 1))
+    if ingest_workers > 1:
+        rows = iter_commit_rows_parallel(git_log,
+                                         config.get('exclude_file_pattern', ''),
+                                         config.get('exclude_authors', ''),
+                                         workers=ingest_workers)
+    else:
+        rows = iter_commit_rows(git_log,
+                                config.get('exclude_file_pattern', ''),
+                                config.get('exclude_authors', ''))
+    count_rows = 0
+    count_dupes = 0
+    try:
+        cursor.execute('BEGIN')
+        # the per-row rollup triggers are for the odd row written later; a
+        # bulk load adds its rows to the rollups a batch at a time instead.
+        # DDL is transactional in SQLite, so the triggers are back (and no
+        # other connection saw them gone) whether this commits or rolls back.
+        triggers = _drop_triggers(cursor, BULK_LOAD_TRIGGERS)
+        for batch in _batched(rows, INSERT_BATCH_SIZE):
+            count_rows += len(batch)
+            first_commit_id, first_file_id = _next_commit_ids(cursor)
+            count_dupes += len(batch) - _insert_commit_rows(cursor, batch)
+            _add_to_rollups(cursor, first_commit_id, first_file_id)
+        for trigger_sql in triggers:
+            cursor.execute(trigger_sql)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    logging.info("Read %d file changes from %s", count_rows, git_log)
+    if count_dupes > 0:
+        logging.info("Skipped %d duplicate entries.", count_dupes)
+
+    tags = config.get('tags', [])
+
+    cursor.executemany('INSERT INTO tags (name) VALUES (?) ON CONFLICT(name) DO NOTHING', [(tag,) for tag in tags])
+    conn.commit()
+
+def _insert_commit_rows(cursor, rows):
+    # writes straight to the normalized tables rather than through the
+    # commits view's trigger, interning authors, paths and commits first;
+    # returns how many file rows were new
+    cursor.executemany('INSERT OR IGNORE INTO authors (name, email) VALUES (?, ?)',
+                       {(row[3], row[4]) for row in rows})
+    cursor.executemany('INSERT OR IGNORE INTO paths (path) VALUES (?)',
+                       {(row[5],) for row in rows})
+    cursor.executemany('''
+        INSERT INTO git_commits (commit_hash, timestamp, date, author_id)
+        VALUES (?, ?, ?, (SELECT id FROM authors WHERE name = ? AND email = ?))
+        ON CONFLICT(commit_hash) DO NOTHING
+    ''', {row[:5]: None for row in rows})
+    cursor.executemany('''
+        INSERT INTO commit_files (commit_id, path_id, churn_count)
+        VALUES ((SELECT id FROM git_commits WHERE commit_hash = ?),
+                (SELECT id FROM paths WHERE path = ?), ?)
+        ON CONFLICT(commit_id, path_id) DO NOTHING
+    ''', [(row[0], row[5], row[6]) for row in rows])
+    return cursor.rowcount
+
+def _drop_triggers(cursor, names):
+    # returns the SQL to create them again
+    cursor.execute(f'''SELECT sql FROM sqlite_master
+                       WHERE type = 'trigger' AND name IN ({",".join("?" * len(names))})''', names)
+    triggers = [row[0] for row in cursor.fetchall()]
+    for name in names:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    return triggers
+
+def _next_commit_ids(cursor):
+    # new rows get ids past the current largest, so these mark where a
+    # batch's rows start
+    cursor.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM git_commits')
+    first_commit_id = cursor.fetchone()[0]
+    cursor.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM commit_files')
+    return first_commit_id, cursor.fetchone()[0]
+
+def _add_to_rollups(cursor, first_commit_id, first_file_id):
+    # what the git_commits and commit_files insert triggers would have added
+    # for these rows, a day and author (or path) at a time
+    cursor.execute('''
+        INSERT INTO author_day_stats (day, author_id, commits, first_date, last_date)
+        SELECT date(timestamp, 'unixepoch'), author_id, COUNT(*), MIN(date), MAX(date)
+        FROM git_commits WHERE id >= ?
+        GROUP BY 1, 2
+        ON CONFLICT(day, author_id) DO UPDATE SET
+            commits = commits + excluded.commits,
+            first_date = CASE WHEN first_date IS NULL OR excluded.first_date < first_date
+                              THEN excluded.first_date ELSE first_date END,
+            last_date = CASE WHEN last_date IS NULL OR excluded.last_date > last_date
+                             THEN excluded.last_date ELSE last_date END
+    ''', (first_commit_id,))
+    cursor.execute('''
+        INSERT INTO author_day_stats (day, author_id, files)
+        SELECT date(g.timestamp, 'unixepoch'), g.author_id, COUNT(*)
+        FROM commit_files f JOIN git_commits g ON g.id = f.commit_id
+        WHERE f.id >= ?
+        GROUP BY 1, 2
+        ON CONFLICT(day, author_id) DO UPDATE SET files = files + excluded.files
+    ''', (first_file_id,))
+    cursor.execute('''
+        INSERT INTO path_day_stats (day, path_id, commits, churn, described_commits, described_churn)
+        SELECT date(g.timestamp, 'unixepoch'), f.path_id, COUNT(*), COALESCE(SUM(f.churn_count), 0),
+               COUNT(f.description), COALESCE(SUM(CASE WHEN f.description IS NOT NULL THEN f.churn_count END), 0)
+        FROM commit_files f JOIN git_commits g ON g.id = f.commit_id
+        WHERE f.id >= ?
+        GROUP BY 1, 2
+        ON CONFLICT(day, path_id) DO UPDATE SET
+            commits = commits + excluded.commits,
+            churn = churn + excluded.churn,
+            described_commits = described_commits + excluded.described_commits,
+            described_churn = described_churn + excluded.described_churn
+    ''', (first_file_id,))
+
+def _import_pull_requests(config, conn):
+    repo_name = config['repo_name']
+    repo_owner = config['repo_owner']
+    file_path = f'output/{repo_owner}-{repo_name}_pull_requests.txt'
+    pull_requests_df = pd.read_csv(file_path, delimiter='\t')
+
+    cursor = conn.cursor()
+
+    # databases from before the incremental PR sync don't have updated_at
+    _add_column_if_missing(cursor, 'pull_requests', 'updated_at', 'TEXT')
+
+    # earlier versions appended every PR on every run, keep one row per
+    # number (preferring one with a description) so number can be unique;
+    # once the unique index is there, there's nothing left to clean up
+    if not _index_exists(cursor, 'idx_pull_requests_number'):
+        cursor.execute('''
+            DELETE FROM pull_requests WHERE id NOT IN (
+                SELECT COALESCE(MAX(CASE WHEN description IS NOT NULL THEN id END), MAX(id))
+                FROM pull_requests
+                GROUP BY number
+            )
+        ''')
+        cursor.execute('CREATE UNIQUE INDEX idx_pull_requests_number ON pull_requests (number)')
+
+    # upsert new and changed PRs; the generated description is kept unless the
+    # PR now points at a different merge commit
+    columns = [c for c in pull_requests_df.columns if c != 'description']
+    updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != 'number')
+    cursor.executemany(f'''
+        INSERT INTO pull_requests ({", ".join(columns)})
+        VALUES ({", ".join("?" for _ in columns)})
+        ON CONFLICT(number) DO UPDATE SET {updates},
+            description = CASE WHEN pull_requests.merge_commit_sha IS excluded.merge_commit_sha
+                               THEN pull_requests.description ELSE NULL END
+    ''', _df_rows(pull_requests_df[columns]))
+    logging.info("Upserted %d pull requests", len(pull_requests_df))
+
+    conn.commit()
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _index_exists(cursor, index_name):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index_name,))
+    return cursor.fetchone() is not None
+
+def _add_column_if_missing(cursor, table, column, column_type):
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+def _df_rows(df):
+    # plain Python values with NaN as None, which is what sqlite3 can bind
+    df = df.astype(object)
+    return df.where(df.notna(), None).itertuples(index=False, name=None)
+
+def _import_pull_request_commits(config, conn):
+    # only the GraphQL backend writes this file, the REST backend links PRs
+    # to commits through pull_requests.merge_commit_sha alone
+    repo_name = config['repo_name']
+    repo_owner = config['repo_owner']
+    file_path = f'output/{repo_owner}-{repo_name}_pull_request_commits.txt'
+
+    cursor = conn.cursor()
+    if os.path.exists(file_path):
+        pr_commits_df = pd.read_csv(file_path, delimiter='\t')
+        cursor.executemany('''
+            INSERT INTO pull_request_commits (pr_number, commit_hash) VALUES (?, ?)
+            ON CONFLICT(pr_number, commit_hash) DO NOTHING
+        ''', _df_rows(pr_commits_df[['pr_number', 'commit_hash']]))
+
+    conn.commit()
+
+def _migrate_schema(conn):
+    """
+    Bring the database up to the latest schema version, each migration in a
+    transaction of its own.
+
+    Returns:
+        int: How many migrations were applied.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
         )
     ''')
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    current_version = cursor.fetchone()[0]
+
+    applied = 0
+    for version, description, statements in SCHEMA_MIGRATIONS:
+        if version <= current_version:
+            continue
+        logging.info("Migrating database to schema version %d: %s", version, description)
+        try:
+            cursor.execute('BEGIN')
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                           (version, description, datetime.now().isoformat()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied += 1
+    return applied
+
+def _update_statistics(conn, full):
+    # a full ANALYZE after a migration, so existing databases pick up the new
+    # indexes; otherwise the cheap optimize, which only re-analyzes tables
+    # whose stats have gone stale
+    conn.execute('ANALYZE' if full else 'PRAGMA optimize')
     conn.commit()
 
 
-def fill_db(config, drop_existing=False):
+def fill_db(config, drop_existing=False, git_log=None):
     """
     Create (if needed) and fill the database with data from exported data.
     
     Args:
         repo_name (str): The name of the repository.
         drop_existing (bool, optional): Whether to drop the existing database before filling it. Defaults to False.
+        git_log (str, optional): The git log to load commits from. Defaults to the exported log for the repo.
     """
     repo_name = config['repo_name']
     repo_owner = config['repo_owner']
     db_path = f'output/{repo_owner}-{repo_name}.db'
     if drop_existing and os.path.exists(db_path):
+        close_connections(db_path)
         os.remove(db_path)
         
-    conn = _connect_to_db(db_path)
-    _insert_data(config, conn)
+    if git_log is None:
+        git_log = _get_log_file_path(repo_owner, repo_name)
+
+    conn = get_connection(db_path)
+    migrated = _migrate_schema(conn)
+    _insert_data(config, conn, git_log)
     _import_pull_requests(config, conn)
-    _create_summaries_table(conn)  # Ensure the summaries table is created
-    conn.close()
+    _import_pull_request_commits(config, conn)
+    _update_statistics(conn, full=migrated > 0)
 
     return db_path
\ No newline at end of file
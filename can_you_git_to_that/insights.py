@@ -1,9 +1,9 @@
 from openai import OpenAI
-import sqlite3
 import json
 import hashlib
 from .llm_config import get_base_url, get_key, get_prompt, num_tokens_from_string
 from .llm import generate_summary
+from .db import get_repo_connection
 import logging
 from datetime import datetime, timedelta
 
@@ -34,20 +34,19 @@ def _generate_summary(repo_owner, repo_name, ai_service, model, start_date, end_
         logging.info(f"{summary_name.replace('-', ' ').capitalize()} already exists with the same data")
 
 def _get_overall_tags(repo_owner, repo_name):
-    conn = sqlite3.connect(f"output/{repo_owner}-{repo_name}.db")
+    conn = get_repo_connection(repo_owner, repo_name)
     cursor = conn.cursor()    
     
     query = '''
-        SELECT t.name, SUM(ct.value) AS total_value
+        SELECT t.name, SUM(s.total_value) AS total_value
         FROM tags t
-        JOIN commit_tags ct ON t.id = ct.tag_id
+        JOIN tag_day_stats s ON t.id = s.tag_id
         GROUP BY t.name
         ORDER BY total_value DESC
     '''
 
     cursor.execute(query)
     results = cursor.fetchall()
-    conn.close()
     rows = []
     for row in results:
         row_data = {    "tag": row[0], 
@@ -57,30 +56,28 @@ def _get_overall_tags(repo_owner, repo_name):
     return json.dumps(rows, indent=4)
 
 def _get_tags_by_week(repo_owner, repo_name):
-    conn = sqlite3.connect(f"output/{repo_owner}-{repo_name}.db")
+    conn = get_repo_connection(repo_owner, repo_name)
     cursor = conn.cursor()    
 
     query = '''
-            SELECT t.name, ct.value, c.timestamp
+            SELECT t.name, s.total_value, s.day
             FROM tags t
-            JOIN commit_tags ct ON t.id = ct.tag_id
-            JOIN commits c ON ct.commit_id = c.id
+            JOIN tag_day_stats s ON t.id = s.tag_id
         '''
 
     cursor.execute(query)
     rows = cursor.fetchall()
-    conn.close()
 
     data = defaultdict(lambda: defaultdict(int))
 
-    for tag, value, commit_timestamp in rows:
-        commit_datetime = datetime.fromtimestamp(commit_timestamp)
+    for tag, value, day in rows:
+        commit_datetime = datetime.strptime(day, '%Y-%m-%d')
         year, week, _ = commit_datetime.isocalendar()
         week_str = f"{year}-{week:02d}"
         data[week_str][tag] += value
 
     # Ensure all weeks are included
-    since_date = min(datetime.fromtimestamp(row[2]) for row in rows)
+    since_date = datetime.strptime(min(row[2] for row in rows), '%Y-%m-%d')
     current_date = datetime.now()
     week_list = []
     while since_date <= current_date:
@@ -130,19 +127,22 @@ def _get_tags_by_week(repo_owner, repo_name):
     return json.dumps(full_result, indent=4)
 
 def _get_file_commit_count(repo_owner, repo_name):
-    conn = sqlite3.connect(f"output/{repo_owner}-{repo_name}.db")
+    conn = get_repo_connection(repo_owner, repo_name)
     cursor = conn.cursor()    
     
     query = """
-        SELECT filename, COUNT(DISTINCT commit_hash) as commit_count
-        FROM commits
-        GROUP BY filename
-        ORDER BY commit_count DESC;
+        SELECT p.path AS filename, x.commit_count
+        FROM (
+            SELECT path_id, SUM(commits) as commit_count
+            FROM path_day_stats
+            GROUP BY path_id
+        ) x
+        JOIN paths p ON p.id = x.path_id
+        ORDER BY x.commit_count DESC;
     """
 
     cursor.execute(query)
     results = cursor.fetchall()
-    conn.close()
 
     rows = []
     for row in results:
@@ -155,42 +155,28 @@ def _get_file_commit_count(repo_owner, repo_name):
 
 
 def _get_commit_count_by_date(repo_parent, repo_name):
-    conn = sqlite3.connect(f"output/{repo_parent}-{repo_name}.db")
+    conn = get_repo_connection(repo_parent, repo_name)
     cursor = conn.cursor()    
     
+    # one row per day, with how many commits and file changes it had
     query = """
-        SELECT date, commit_hash, filename
-        FROM commits
+        SELECT day, SUM(commits), SUM(files)
+        FROM author_day_stats
+        GROUP BY day
+        HAVING SUM(commits) > 0
+        ORDER BY day
     """
 
     cursor.execute(query)
     results = cursor.fetchall()
-    conn.close()
     today = datetime.today().date()
-    track = {}
-    filetrack = {}
-    for row in results:
-        commit_date = datetime.strptime(row[0], '%Y-%m-%dT%H:%M:%S').date()
-        chash = row[1]
-        filename = row[2]
-        if commit_date not in track:
-            track[commit_date] = set()
-        track[commit_date].add(chash)
-        if chash not in filetrack:
-            filetrack[chash] = set()
-        filetrack[chash].add(filename)
             
     rows = []
-    dates = list(track.keys())
-    dates.sort()
-    for d in dates:
-        commit_date = d
+    for day, commit_count, filecount in results:
+        commit_date = datetime.strptime(day, '%Y-%m-%d').date()
         days_before_today = (today - commit_date).days
-        filecount = 0
-        for hashes in track[d]:
-            filecount += len(filetrack[hashes])
-        row_data = {    "date": str(d), 
-                        "commit_count": len(track[d]),
+        row_data = {    "date": str(commit_date), 
+                        "commit_count": commit_count,
                         "file_count": filecount,
                         "days_ago": days_before_today
                     }
@@ -199,12 +185,16 @@ def _get_commit_count_by_date(repo_parent, repo_name):
     return json.dumps(rows, indent=4)   
 
 def _get_churn(repo_owner, repo_name):
-    conn = sqlite3.connect(f"output/{repo_owner}-{repo_name}.db")
+    conn = get_repo_connection(repo_owner, repo_name)
     cursor = conn.cursor()    
     cursor.execute("""
-        SELECT filename, SUM(churn_count) AS total_churn
-        FROM commits where description is not null
-        GROUP BY filename
+        SELECT p.path AS filename, x.total_churn
+        FROM (
+            SELECT path_id, SUM(described_churn) AS total_churn
+            FROM path_day_stats where described_commits > 0
+            GROUP BY path_id
+        ) x
+        JOIN paths p ON p.id = x.path_id
     """)
     churn_data = cursor.fetchall()
 
@@ -245,7 +235,7 @@ def _get_churn(repo_owner, repo_name):
     return json.dumps(json_data, indent=4)
 
 def _save_summary(which, summary, repo_owner, repo_name, data_hash, ai_service, ai_model, start_date, end_date):
-    conn = sqlite3.connect(f"output/{repo_owner}-{repo_name}.db")
+    conn = get_repo_connection(repo_owner, repo_name)
     cursor = conn.cursor()
     cursor.execute('''
         INSERT INTO summaries (name, hash, ai_service, ai_model, summary, start_date, end_date, createdAt)
@@ -253,10 +243,9 @@ def _save_summary(which, summary, repo_owner, repo_name, data_hash, ai_service,
     ''', (which, data_hash, ai_service, ai_model, summary, start_date, end_date))
 
     conn.commit()
-    conn.close()
 
 def _commit_hash_exists(which_name, summary_hash, repo_owner, repo_name):
-    conn = sqlite3.connect(f"output/{repo_owner}-{repo_name}.db")
+    conn = get_repo_connection(repo_owner, repo_name)
     cursor = conn.cursor()
 
     cursor.execute('''
@@ -265,7 +254,6 @@ def _commit_hash_exists(which_name, summary_hash, repo_owner, repo_name):
     ''', (which_name, summary_hash))
 
     result = cursor.fetchone()
-    conn.close()
 
     if result is None:
         return False
@@ -280,18 +268,25 @@ def _generate_hash(input_string):
 
 
 def _get_author_commit_count(repo_parent, repo_name):
-    conn = sqlite3.connect(f"output/{repo_parent}-{repo_name}.db")
+    conn = get_repo_connection(repo_parent, repo_name)
     cursor = conn.cursor()    
     
     query = """
-    SELECT author,
-        COUNT(*) as total_commits,
-        MIN(date) as first_commit_date,
-        MAX(date) as last_commit_date
-    FROM 
-        commits
+    SELECT a.name AS author,
+        SUM(x.total_commits) as total_commits,
+        MIN(x.first_commit_date) as first_commit_date,
+        MAX(x.last_commit_date) as last_commit_date
+    FROM (
+        SELECT author_id,
+            SUM(files) as total_commits,
+            MIN(first_date) as first_commit_date,
+            MAX(last_date) as last_commit_date
+        FROM author_day_stats
+        GROUP BY author_id
+    ) x
+    JOIN authors a ON a.id = x.author_id
     GROUP BY 
-        author
+        a.name
     ORDER BY 
         total_commits DESC
     """
@@ -299,7 +294,6 @@ def _get_author_commit_count(repo_parent, repo_name):
     # Execute the query
     cursor.execute(query)
     result = cursor.fetchall()
-    conn.close()
     rows = []    
     for row in result:
         row_data = {    "author": row[0], 
@@ -1,12 +1,285 @@
-from openai import OpenAI
+from openai import OpenAI, APIStatusError, APIConnectionError
 import json
+import time
+import random
 import logging
 import datetime
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from .llm_config import get_base_url, get_key, num_tokens_from_string, get_prompt, get_LLM_pricing
+from .llm_cache import LLMCache
+from .diff_reducer import reduce_diff, get_token_budget
+
+# per-service request limits, see init_llm, and the response cache, see init_llm_cache
+LLM_SETTINGS = {
+    "max_retries": 6,
+    "max_backoff": 60,
+    "cache_enabled": True,
+    # ask again rather than use answers cached before this run
+    "cache_refresh": False,
+    # shared by every repo
+    "cache_path": "output/cache/llm_responses.db",
+    "services": {
+        "openai": {"max_concurrency": 8, "requests_per_minute": 500},
+        # a local ollama works through one request at a time anyway
+        "ollama": {"max_concurrency": 1, "requests_per_minute": 0},
+    },
+}
 
 SESSION_COST = 0.0
-        
-def summarize_diff(filename, diff, file_sample, ai_service, ai_model):
+_COST_LOCK = threading.Lock()
+
+_CLIENTS = {}
+_LIMITERS = {}
+_LLM_CACHE = []
+# when this run started using the cache, see cache_refresh
+_CACHE_OPENED = []
+_IN_FLIGHT = {}
+_SERVICES_LOCK = threading.Lock()
+
+
+def init_llm(ai_service, max_concurrency=None, requests_per_minute=None):
+    """
+    Configure the request limits for an AI service. Call before the first request.
+
+    Args:
+        ai_service (str): The AI service, e.g. openai or ollama.
+        max_concurrency (int, optional): How many requests to have in flight at once.
+        requests_per_minute (int, optional): How many requests to start per minute, 0 for no limit.
+    """
+    settings = LLM_SETTINGS["services"].setdefault(ai_service, {"max_concurrency": 1, "requests_per_minute": 0})
+    if max_concurrency is not None:
+        settings["max_concurrency"] = max(1, int(max_concurrency))
+    if requests_per_minute is not None:
+        settings["requests_per_minute"] = int(requests_per_minute)
+    with _SERVICES_LOCK:
+        _LIMITERS.pop(ai_service, None)
+    logging.info("LLM settings for %s: %s", ai_service, settings)
+
+
+def init_llm_cache(enabled=None, path=None, refresh=None):
+    """
+    Configure the LLM response cache. Call before the first request.
+
+    Args:
+        enabled (bool, optional): Whether to answer repeated requests from the cache.
+        path (str, optional): The cache database, shared by every repo.
+        refresh (bool, optional): Whether to ask again instead of using answers
+            cached by earlier runs, replacing them.
+    """
+    if enabled is not None:
+        LLM_SETTINGS["cache_enabled"] = enabled
+    if path:
+        LLM_SETTINGS["cache_path"] = path
+    if refresh is not None:
+        LLM_SETTINGS["cache_refresh"] = refresh
+    logging.info("LLM cache settings: enabled %s, refresh %s, %s",
+                 LLM_SETTINGS["cache_enabled"], LLM_SETTINGS["cache_refresh"], LLM_SETTINGS["cache_path"])
+
+
+def log_llm_cache_stats():
+    """
+    Log the LLM response cache hit rates for each kind of request.
+    """
+    cache = _get_llm_cache()
+    if cache is not None:
+        cache.log_stats()
+
+
+def map_ordered(ai_service, func, items):
+    """
+    Run func over items on a worker pool sized to the service's concurrency
+    limit and yield the results in the same order as items. Only a couple of
+    pool-fulls of work are queued ahead of the consumer, so items can be lazy.
+    """
+    max_workers = _get_service_settings(ai_service)["max_concurrency"]
+    window = max_workers * 2
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class _ServiceLimiter:
+    """
+    Caps the requests in flight to one AI service and spaces out their starts
+    to stay under its requests-per-minute limit. A rate limit refusal holds
+    off every worker, not just the one that got it.
+    """
+
+    def __init__(self, max_concurrency, requests_per_minute):
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def __enter__(self):
+        self._slots.acquire()
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._slots.release()
+
+    def hold_off(self, delay):
+        with self._lock:
+            self._next_start = max(self._next_start, time.monotonic() + delay)
+
+
+def _get_service_settings(ai_service):
+    return LLM_SETTINGS["services"].get(ai_service, {"max_concurrency": 1, "requests_per_minute": 0})
+
+
+def _get_limiter(ai_service):
+    with _SERVICES_LOCK:
+        limiter = _LIMITERS.get(ai_service)
+        if limiter is None:
+            settings = _get_service_settings(ai_service)
+            limiter = _ServiceLimiter(settings["max_concurrency"], settings["requests_per_minute"])
+            _LIMITERS[ai_service] = limiter
+        return limiter
+
+
+def _get_llm_cache():
+    with _SERVICES_LOCK:
+        if not _LLM_CACHE:
+            cache = None
+            if LLM_SETTINGS["cache_enabled"]:
+                cache = LLMCache(LLM_SETTINGS["cache_path"])
+            _LLM_CACHE.append(cache)
+            _CACHE_OPENED.append(time.time() if LLM_SETTINGS["cache_refresh"] else 0)
+        return _LLM_CACHE[0]
+
+
+def _get_client(ai_service):
+    # one client (and connection pool) per service, shared by every thread;
+    # retries are ours, so they can back off every worker at once
+    with _SERVICES_LOCK:
+        client = _CLIENTS.get(ai_service)
+        if client is None:
+            client = OpenAI(
+                base_url = get_base_url(ai_service),
+                api_key= get_key(ai_service),
+                max_retries=0,
+            )
+            _CLIENTS[ai_service] = client
+        return client
+
+
+def _chat_completion(kind, system, prompt, ai_service, ai_model, temperature, cache_on=None, validate=None):
+    # the same request always gets the same (cached) answer, whichever
+    # repo or stage it comes from; cache_on, when given, is the part of the
+    # prompt that decides the answer, so requests that differ only in the
+    # rest of it share one. validate, when given, says whether the caller
+    # can use an answer: one it can't is never cached, and one cached
+    # before it could tell is dropped and asked again
+    cache = _get_llm_cache()
+    if cache is None:
+        response = _request_completion(system, prompt, ai_service, ai_model, temperature)
+        return response.choices[0].message.content
+
+    key = LLMCache.make_key(ai_service, ai_model, temperature, system, prompt if cache_on is None else cache_on)
+    while True:
+        cached = cache.get(key, _CACHE_OPENED[0])
+        if cached is not None:
+            if validate is None or validate(cached[0]):
+                logging.debug("LLM cache hit for %s", kind)
+                cache.record(kind, True, cached[1])
+                return cached[0]
+            logging.info("Dropping unusable cached %s answer", kind)
+            cache.discard(key)
+        # when workers ask the same thing at once, only one of them asks the
+        # LLM and the rest wait for its answer
+        with _SERVICES_LOCK:
+            in_flight = _IN_FLIGHT.get(key)
+            if in_flight is None:
+                in_flight = _IN_FLIGHT[key] = threading.Event()
+                break
+        # then look again; if their request failed, we'll make our own
+        in_flight.wait()
+
+    try:
+        cache.record(kind, False)
+        response = _request_completion(system, prompt, ai_service, ai_model, temperature)
+        content = response.choices[0].message.content
+        if content is not None and (validate is None or validate(content)):
+            usage = response.usage
+            cache.put(key, ai_service, ai_model, content,
+                      usage.prompt_tokens if usage is not None else None,
+                      usage.completion_tokens if usage is not None else None)
+        return content
+    finally:
+        with _SERVICES_LOCK:
+            del _IN_FLIGHT[key]
+        in_flight.set()
+
+
+def _request_completion(system, prompt, ai_service, ai_model, temperature):
+    client = _get_client(ai_service)
+    limiter = _get_limiter(ai_service)
+    max_retries = LLM_SETTINGS["max_retries"]
+    for attempt in range(max_retries + 1):
+        try:
+            with limiter:
+                response = client.chat.completions.create(
+                    model=ai_model,
+                    messages=[
+                        {"role": "system", "content": system},
+                        {"role": "user", "content": prompt},
+                    ],
+                    temperature=temperature
+                )
+            break
+        except (APIStatusError, APIConnectionError) as e:
+            delay = _get_retry_delay(e, attempt)
+            if delay is None or attempt == max_retries:
+                raise
+            logging.info("%s request failed (%s), retrying in %.1fs", ai_service, e, delay)
+            limiter.hold_off(delay)
+    _track_LLM_cost(response, ai_service, ai_model)
+    return response
+
+
+def _get_retry_delay(error, attempt):
+    # rate limits (429) and server errors (5xx) are worth another try, as are
+    # dropped connections; anything else is our fault and won't get better
+    if isinstance(error, APIStatusError):
+        if error.status_code != 429 and error.status_code < 500:
+            return None
+        retry_after = error.response.headers.get("retry-after")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    # exponential, with jitter so the workers don't all come back at once
+    return min(2 ** attempt, LLM_SETTINGS["max_backoff"]) * random.uniform(0.5, 1.0)
+
+def get_template_tokens(kinds, props):
+    """
+    How many tokens the prompts for these kinds of request take without their
+    data, the largest if there's more than one, so it can come out of the
+    token budget.
+
+    Args:
+        kinds (list): Prompt names, each with a _system.txt and _user.txt template.
+        props (dict): What to render them with, with the data left empty.
+    """
+    return max(num_tokens_from_string(get_prompt(f'{kind}_system.txt', props)) +
+               num_tokens_from_string(get_prompt(f'{kind}_user.txt', props))
+               for kind in kinds)
+
+def summarize_diff(filename, diff, file_sample, ai_service, ai_model, validate=None):
     """
     Summarizes the difference between two files or the content of a single file.
 
@@ -16,40 +289,59 @@ def summarize_diff(filename, diff, file_sample, ai_service, ai_model):
         file_sample (str): The content of the file being summarized.
         ai_service (str): The AI service being used.
         ai_model (str): The AI model being used.
+        validate (callable, optional): Whether a summary is usable; one that isn't is not cached.
 
     Returns:
         str: The summarized difference.
 
     """
-    system = get_prompt('summarize_diff_system.txt', {})
-
     clause = "Unified Diff:"
     data = diff
     if diff is None:
         clause = "File Content:"
         data = file_sample
 
-    user_prompt_prompts = {"filename": filename, "clause": clause, "data": data}
+    # fit the diff to what the model's token budget leaves after the
+    # instructions, or, when it's far too big, summarize it in parts and
+    # combine those
+    overhead = get_template_tokens(["summarize_diff", "summarize_diff_part"],
+                                   {"filename": filename, "clause": clause, "data": "", "part": 1, "parts": 1})
+    parts = reduce_diff(data, get_token_budget(ai_model, overhead))
+    if len(parts) > 1:
+        return _summarize_diff_parts(filename, clause, parts, ai_service, ai_model, validate)
+
+    system = get_prompt('summarize_diff_system.txt', {})
+
+    user_prompt_prompts = {"filename": filename, "clause": clause, "data": parts[0]}
     prompt = get_prompt('summarize_diff_user.txt', user_prompt_prompts)
     
     num_tokens = num_tokens_from_string(prompt)
     
     logging.info("summarize diff has prompt w/num tokens: %s", num_tokens)
 
-    client = OpenAI(
-        base_url = get_base_url(ai_service),
-        api_key= get_key(ai_service),
-    )
-    response = client.chat.completions.create(
-        model=ai_model,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.2
-    )
-    _track_LLM_cost(response, ai_service, ai_model)
-    return response.choices[0].message.content.strip()
+    return _chat_completion("summarize_diff", system, prompt, ai_service, ai_model, 0.2, validate=validate).strip()
+
+def _summarize_diff_parts(filename, clause, parts, ai_service, ai_model, validate=None):
+    logging.info("summarize diff for %s in %d parts", filename, len(parts))
+    system = get_prompt('summarize_diff_part_system.txt', {})
+
+    def summarize_part(numbered_part):
+        number, part = numbered_part
+        prompt = get_prompt('summarize_diff_part_user.txt',
+                            {"filename": filename, "clause": clause, "data": part, "part": number, "parts": len(parts)})
+        return _chat_completion("summarize_diff_part", system, prompt, ai_service, ai_model, 0.2).strip()
+
+    # one after another: this already runs on a worker of the annotation
+    # pool, and a pool per file would multiply the threads
+    summaries = [summarize_part(numbered_part) for numbered_part in enumerate(parts, 1)]
+
+    system = get_prompt('combine_diff_summaries_system.txt', {})
+    prompt = get_prompt('combine_diff_summaries_user.txt', {"filename": filename, "summaries": summaries})
+
+    num_tokens = num_tokens_from_string(prompt)
+    logging.info("combine diff summaries has prompt w/num tokens: %s", num_tokens)
+
+    return _chat_completion("combine_diff_summaries", system, prompt, ai_service, ai_model, 0.2, validate=validate).strip()
 
 def shorter_summarize_diff(filename, long_summary, ai_service, ai_model):
     system = get_prompt('shorter_summarize_diff_system.txt', {})
@@ -60,24 +352,45 @@ def shorter_summarize_diff(filename, long_summary, ai_service, ai_model):
     num_tokens = num_tokens_from_string(prompt)
     logging.info("shorter_summarize_diff has prompt w/num tokens: %s", num_tokens)
 
-    client = OpenAI(
-        base_url = get_base_url(ai_service),
-        api_key= get_key(ai_service),
-    )
-    response = client.chat.completions.create(
-        model=ai_model,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.4
-    )
-    _track_LLM_cost(response, ai_service, ai_model)
-    return response.choices[0].message.content.strip()
-
-def classify_description(tags, desc, ai_service, ai_model):
-
-    system = get_prompt('classify_description_system.txt', {"tags":tags})
+    return _chat_completion("shorter_summarize_diff", system, prompt, ai_service, ai_model, 0.4).strip()
+
+# worked examples for the classify prompts, with the categories each would
+# get from the default tags and their weights; see _classify_examples
+CLASSIFY_EXAMPLES = [
+    ("Fixed a bug causing crashes when the user clicks the save button.", [("Bug_Fix", 10)]),
+    ("Updated the CSS styles for the homepage to improve the layout on mobile devices.",
+     [("UX_Layout_CSS", 5), ("Frontend", 5)]),
+    ("Added new endpoints with documentation to the API for user authentication.",
+     [("API", 5), ("Authentication", 3), ("Documentation", 2)]),
+]
+
+def _classify_examples(tags):
+    # the examples, as (description, {category: weight}), using only the
+    # configured tags, so the model isn't shown a category it mustn't answer
+    # with; weights are scaled back up to 10 when some are left out
+    examples = []
+    for description, weights in CLASSIFY_EXAMPLES:
+        weights = [(tag, weight) for tag, weight in weights if tag in tags]
+        if weights:
+            examples.append((description, _weights_to_ten(weights)))
+    if not examples and tags:
+        # tags unlike the defaults; at least show the format with real ones
+        examples.append((f"A change to the {tags[0]}.", {tags[0]: 10}))
+        if len(tags) > 1:
+            examples.append((f"A change to the {tags[0]} and the {tags[1]}.", {tags[0]: 5, tags[1]: 5}))
+    return examples
+
+def _weights_to_ten(weights):
+    total = sum(weight for _, weight in weights)
+    scaled = {tag: weight * 10 // total for tag, weight in weights}
+    scaled[weights[0][0]] += 10 - sum(scaled.values())
+    return scaled
+
+def classify_description(tags, desc, ai_service, ai_model, validate=None):
+
+    examples = [(description, ",".join(f"{tag},{weight}" for tag, weight in weights.items()))
+                for description, weights in _classify_examples(tags)]
+    system = get_prompt('classify_description_system.txt', {"tags": tags, "examples": examples})
 
     props = {"description": desc}
     prompt = get_prompt('classify_description_user.txt', props)
@@ -85,21 +398,28 @@ def classify_description(tags, desc, ai_service, ai_model):
     num_tokens = num_tokens_from_string(prompt)
 
     logging.info("classify description has prompt w/num tokens: %s", num_tokens)
-    client = OpenAI(
-        base_url = get_base_url(ai_service),
-        api_key= get_key(ai_service),
-    )
-    model = ai_model
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.2
-    )
-    _track_LLM_cost(response, ai_service, ai_model)    
-    return response.choices[0].message.content 
+    return _chat_completion("classify_description", system, prompt, ai_service, ai_model, 0.2, validate=validate)
+
+def classify_descriptions(tags, descriptions, ai_service, ai_model, validate=None):
+    """
+    Classify several descriptions in one request, see classify_description.
+
+    Returns:
+        str: The model's response, a JSON object of {"<number>": {tag: weight}},
+            numbered from 1 in the order given.
+    """
+    examples = _classify_examples(tags)
+    example_response = json.dumps({str(number): weights for number, (_, weights) in enumerate(examples, 1)})
+    system = get_prompt('classify_descriptions_system.txt',
+                        {"tags": tags, "examples": [description for description, _ in examples],
+                         "example_response": example_response})
+
+    prompt = get_prompt('classify_descriptions_user.txt', {"descriptions": descriptions})
+
+    num_tokens = num_tokens_from_string(prompt)
+
+    logging.info("classify %s descriptions has prompt w/num tokens: %s", len(descriptions), num_tokens)
+    return _chat_completion("classify_descriptions", system, prompt, ai_service, ai_model, 0.2, validate=validate)
 
 def summarize_pr(prs, ai_service, ai_model):
 
@@ -110,21 +430,21 @@ def summarize_pr(prs, ai_service, ai_model):
     num_tokens = num_tokens_from_string(prompt)
     logging.info("summarize pr has prompt w/num tokens: %s", num_tokens)
 
-    client = OpenAI(
-        base_url = get_base_url(ai_service),
-        api_key= get_key(ai_service),
-    )
-    model = ai_model
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.2
-    )
-    _track_LLM_cost(response, ai_service, ai_model)
-    return response.choices[0].message.content 
+    return _chat_completion("summarize_pr", system, prompt, ai_service, ai_model, 0.2)
+
+def combine_pr_summaries(summaries, ai_service, ai_model):
+    """
+    Combine the summaries of the parts of a pull request too large to
+    summarize at once, see summarize_pr.
+    """
+    system = get_prompt('combine_pr_summaries_system.txt', {})
+
+    prompt = get_prompt('combine_pr_summaries_user.txt', {"summaries": summaries})
+
+    num_tokens = num_tokens_from_string(prompt)
+    logging.info("combine pr summaries has prompt w/num tokens: %s", num_tokens)
+
+    return _chat_completion("combine_pr_summaries", system, prompt, ai_service, ai_model, 0.2)
 
 
 def describe_code(func_name, func_code, filename, ai_service, ai_model):
@@ -135,21 +455,9 @@ def describe_code(func_name, func_code, filename, ai_service, ai_model):
     num_tokens = num_tokens_from_string(prompt)
     logging.info("describe code has prompt w/num tokens: %s", num_tokens)
 
-    client = OpenAI(
-        base_url = get_base_url(ai_service),
-        api_key= get_key(ai_service),
-    )
-    model = ai_model
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.1
-    )
-    _track_LLM_cost(response, ai_service, ai_model)
-    return response.choices[0].message.content 
+    # keyed on the code alone, so a function moved or vendored to another
+    # path isn't paid for again
+    return _chat_completion("describe_code", system, prompt, ai_service, ai_model, 0.1, cache_on=func_code)
 
 
 def rate_code(func_name, func_code, filename, ai_service, ai_model):
@@ -160,21 +468,9 @@ def rate_code(func_name, func_code, filename, ai_service, ai_model):
     num_tokens = num_tokens_from_string(prompt)
     logging.info("rate code has prompt w/num tokens: %s", num_tokens)
 
-    client = OpenAI(
-        base_url = get_base_url(ai_service),
-        api_key= get_key(ai_service),
-    )
-    model = ai_model
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.1
-    )
-    _track_LLM_cost(response, ai_service, ai_model)
-    return response.choices[0].message.content 
+    # keyed on the code alone, so a function moved or vendored to another
+    # path isn't paid for again
+    return _chat_completion("rate_code", system, prompt, ai_service, ai_model, 0.1, cache_on=func_code)
 
 
 def generate_summary(which, data, service_name, model_name):
@@ -186,20 +482,7 @@ def generate_summary(which, data, service_name, model_name):
     num_tokens = num_tokens_from_string(prompt)
     logging.info("insights generate summary has prompt w/num tokens: %s", num_tokens)
 
-    client = OpenAI(
-        base_url = get_base_url(service_name),
-        api_key= get_key(service_name),
-    )
-    response = client.chat.completions.create(
-        model=model_name,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.2
-    )
-    _track_LLM_cost(response, service_name, model_name)
-    return response.choices[0].message.content 
+    return _chat_completion(which, system, prompt, service_name, model_name, 0.2)
 
 def _track_LLM_cost(response, service_name, model_name):
     llm_pricing = get_LLM_pricing()
@@ -211,9 +494,11 @@ def _track_LLM_cost(response, service_name, model_name):
             input_tokens = response.usage.prompt_tokens
             total += (input_tokens/1000000) * float(pricing['input'])
             global SESSION_COST
-            SESSION_COST += total
-            logging.info("LLM total session cost: $%s", SESSION_COST)
-            _log_LLM_cost(llm_pricing['logfile'], service_name, model_name, input_tokens, output_tokens, total)
+            # workers finish requests concurrently
+            with _COST_LOCK:
+                SESSION_COST += total
+                logging.info("LLM total session cost: $%s", SESSION_COST)
+                _log_LLM_cost(llm_pricing['logfile'], service_name, model_name, input_tokens, output_tokens, total)
 
     except Exception as ee:
         logging.error("Error tracking LLM cost: %s", ee)
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+
+class LLMCache:
+    """
+    An on-disk cache of LLM responses, keyed by a hash of everything that
+    goes into the request: service, model, temperature and both prompts,
+    or the part of the user prompt that decides the answer.
+
+    One cache is shared by every repo, so the same diff (in a fork) or
+    function (anywhere) is only paid for once. Hits and misses are
+    counted per kind of request, for log_stats.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._stats = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                service TEXT,
+                model TEXT,
+                content TEXT,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                created_at REAL
+            )
+        ''')
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(ai_service, ai_model, temperature, system, prompt):
+        request = json.dumps([ai_service, ai_model, float(temperature), system, prompt])
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def get(self, key, newer_than=0):
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): The request's key, see make_key.
+            newer_than (float, optional): Ignore responses cached before this time.
+
+        Returns:
+            tuple: The response content and the tokens it took, or None if not cached.
+        """
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT content, prompt_tokens, completion_tokens FROM responses
+                WHERE key = ? AND created_at >= ?
+            ''', (key, newer_than)).fetchone()
+        if row is None:
+            return None
+        return row[0], (row[1] or 0) + (row[2] or 0)
+
+    def put(self, key, ai_service, ai_model, content, prompt_tokens=None, completion_tokens=None):
+        with self._lock:
+            self._conn.execute('''
+                INSERT OR REPLACE INTO responses (key, service, model, content, prompt_tokens, completion_tokens, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (key, ai_service, ai_model, content, prompt_tokens, completion_tokens, time.time()))
+            self._conn.commit()
+
+    def discard(self, key):
+        """
+        Drop a cached response, e.g. one its caller couldn't use.
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._conn.commit()
+
+    def record(self, kind, hit, tokens_saved=0):
+        """
+        Count a lookup for one kind of request as a hit or a miss.
+        """
+        with self._lock:
+            stats = self._stats.setdefault(kind, {"hits": 0, "misses": 0, "tokens_saved": 0})
+            if hit:
+                stats["hits"] += 1
+                stats["tokens_saved"] += tokens_saved
+            else:
+                stats["misses"] += 1
+
+    def log_stats(self):
+        with self._lock:
+            stats = {kind: dict(counts) for kind, counts in self._stats.items()}
+            count = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        for kind, counts in sorted(stats.items()):
+            total = counts["hits"] + counts["misses"]
+            hit_rate = counts["hits"] / total if total else 0
+            logging.info("LLM cache %s: %d hits, %d misses, %.1f%% hit rate, %d tokens saved",
+                         kind, counts["hits"], counts["misses"], hit_rate * 100, counts["tokens_saved"])
+        logging.info("LLM cache holds %d responses in %s", count, self.path)
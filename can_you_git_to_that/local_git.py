@@ -0,0 +1,158 @@
+import re
+import logging
+import threading
+import subprocess
+
+_COMMIT_LINE = re.compile(r"^[0-9a-f]{40}([0-9a-f]{24})?$")
+_INDEX_LINE = re.compile(r"^index ([0-9a-f]+)\.\.([0-9a-f]+)")
+
+
+class LocalDiffProvider:
+    """
+    Reads diffs and file contents for annotation from a local clone instead
+    of the GitHub API.
+
+    Patches for any number of commits come out of a single
+    `git diff-tree --stdin` process, and blob contents from one long-running
+    `git cat-file --batch` process, so there's no subprocess per request.
+    """
+
+    def __init__(self, repo_local_full_path):
+        self.repo_local_full_path = repo_local_full_path
+        self._cat_file = None
+        self._cat_file_lock = threading.Lock()
+
+    def iter_commit_files(self, commit_shas):
+        """
+        Yield (commit_sha, files) for each commit, in order, where files maps
+        each changed filename to (patch, blob_spec). The patch is in the same
+        hunk-only form GitHub returns, or None for binary files and pure
+        renames; blob_spec can be passed to read_blob. Commits with no changes
+        (empty commits, merges that match their first parent) get empty files;
+        shas the clone doesn't have are skipped.
+        """
+        command = [
+            "git", "-C", self.repo_local_full_path,
+            "-c", "core.quotepath=off",
+            # --always, so every commit gets its sha line, even with no diff
+            "diff-tree", "--stdin", "--always", "-p", "-r", "--root", "-M",
+            "--full-index", "--diff-merges=first-parent",
+            "--no-color", "--no-ext-diff",
+        ]
+        proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                encoding="utf-8", errors="replace")
+
+        # feed the shas from a thread, so a large batch can't deadlock against
+        # git filling up its stdout pipe
+        def feed():
+            try:
+                for sha in commit_shas:
+                    proc.stdin.write(f"{sha}\n")
+            finally:
+                proc.stdin.close()
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        try:
+            current_sha = None
+            lines = []
+            for line in proc.stdout:
+                line = line.rstrip("\n")
+                if _COMMIT_LINE.match(line):
+                    if current_sha is not None:
+                        yield current_sha, _parse_commit_patch(current_sha, lines)
+                    current_sha = line
+                    lines = []
+                else:
+                    lines.append(line)
+            if current_sha is not None:
+                yield current_sha, _parse_commit_patch(current_sha, lines)
+        finally:
+            proc.stdout.close()
+            proc.wait()
+            feeder.join()
+        if proc.returncode != 0:
+            logging.error("git diff-tree exited with status %s", proc.returncode)
+
+    def read_blob(self, blob_spec):
+        """
+        Read a blob's content, by object id or by "<commit>:<path>".
+        """
+        with self._cat_file_lock:
+            if self._cat_file is None:
+                self._cat_file = subprocess.Popen(
+                    ["git", "-C", self.repo_local_full_path, "cat-file", "--batch"],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            self._cat_file.stdin.write(f"{blob_spec}\n".encode("utf-8"))
+            self._cat_file.stdin.flush()
+            header = self._cat_file.stdout.readline().decode("utf-8").split()
+            if len(header) < 3:
+                logging.error("Blob not found in local clone: %s", blob_spec)
+                return None
+            size = int(header[2])
+            content = self._cat_file.stdout.read(size)
+            self._cat_file.stdout.read(1)  # trailing newline
+        return content.decode("utf-8", errors="replace")
+
+    def close(self):
+        with self._cat_file_lock:
+            if self._cat_file is not None:
+                self._cat_file.stdin.close()
+                self._cat_file.wait()
+                self._cat_file = None
+
+
+def _parse_commit_patch(commit_sha, lines):
+    files = {}
+    for section in _split_file_sections(lines):
+        filename = None
+        old_name = None
+        blob_spec = None
+        hunk_start = None
+        for i, line in enumerate(section):
+            if hunk_start is not None:
+                break
+            if line.startswith("rename to "):
+                filename = line[len("rename to "):]
+            elif line.startswith("+++ b/"):
+                filename = line[len("+++ b/"):]
+            elif line.startswith("--- a/"):
+                old_name = line[len("--- a/"):]
+            elif line.startswith("index "):
+                match = _INDEX_LINE.match(line)
+                if match:
+                    old_oid, new_oid = match.groups()
+                    # deleted files only have the old side
+                    blob_spec = old_oid if set(new_oid) == {"0"} else new_oid
+            elif line.startswith("@@"):
+                hunk_start = i
+        if filename is None:
+            filename = old_name or _name_from_header(section[0])
+        if filename is None:
+            continue
+        if blob_spec is None:
+            blob_spec = f"{commit_sha}:{filename}"
+        patch = "\n".join(section[hunk_start:]) if hunk_start is not None else None
+        files[filename] = (patch, blob_spec)
+    return files
+
+
+def _split_file_sections(lines):
+    section = None
+    for line in lines:
+        if line.startswith("diff --git "):
+            if section:
+                yield section
+            section = [line]
+        elif section is not None:
+            section.append(line)
+    if section:
+        yield section
+
+
+def _name_from_header(header):
+    # "diff --git a/path b/path", only used when nothing better is available
+    parts = header[len("diff --git "):].split(" b/", 1)
+    if len(parts) == 2:
+        return parts[1]
+    return None
@@ -0,0 +1,240 @@
+import os
+import time
+import queue
+import logging
+import threading
+from .db import get_db_path, get_connection, close_connections
+
+# settings for result writers, see init_result_writer
+WRITER_SETTINGS = {
+    # results per transaction
+    "batch_size": 200,
+    # how long a partial batch waits for more results before it's written
+    "flush_interval": 1.0,
+    # when the recovery log is fsynced: after every batch, only on close, or never
+    "log_fsync": "batch",
+    # results queued ahead of the writer before producers have to wait
+    "max_pending": 10000,
+}
+
+LOG_FSYNC_POLICIES = ("batch", "close", "never")
+
+_CLOSE = object()
+_FLUSH = object()
+
+
+def init_result_writer(batch_size=None, log_fsync=None):
+    """
+    Configure the result writers. Call before the first one is created.
+
+    Args:
+        batch_size (int, optional): How many results to write per transaction.
+        log_fsync (str, optional): When to fsync the recovery log: batch, close or never.
+    """
+    if batch_size is not None:
+        WRITER_SETTINGS["batch_size"] = max(1, int(batch_size))
+    if log_fsync is not None:
+        log_fsync = log_fsync.strip().lower()
+        if log_fsync not in LOG_FSYNC_POLICIES:
+            raise ValueError(f"Unknown log fsync policy: {log_fsync}")
+        WRITER_SETTINGS["log_fsync"] = log_fsync
+    logging.info("Result writer settings: %s", WRITER_SETTINGS)
+
+
+def get_diffs_log_path(repo_owner, repo_name):
+    return f"output/{repo_owner}-{repo_name}_diffs_log.txt"
+
+
+class ResultWriter:
+    """
+    Writes annotation results (file summaries and tag values) to a repo's
+    database from a single background thread.
+
+    Results are queued by the annotation workers and written in batches, one
+    transaction per batch. Summaries are also appended to the diffs log, which
+    backfill_descriptions_from_log can replay into a rebuilt database; the log
+    is written (and fsynced, per the log_fsync setting) before the batch is
+    committed. Use as a context manager, so everything queued is written
+    before the caller moves on, even when it fails part way.
+    """
+
+    def __init__(self, repo_owner, repo_name):
+        self.db_path = get_db_path(repo_owner, repo_name)
+        self.log_path = get_diffs_log_path(repo_owner, repo_name)
+        self.batch_size = WRITER_SETTINGS["batch_size"]
+        self.flush_interval = WRITER_SETTINGS["flush_interval"]
+        self.log_fsync = WRITER_SETTINGS["log_fsync"]
+
+        self._queue = queue.Queue(maxsize=WRITER_SETTINGS["max_pending"])
+        self._error = None
+        self._closed = False
+        self._stats = {"summaries": 0, "tags": 0, "batches": 0, "missing": 0}
+        self._thread = threading.Thread(target=self._run, name=f"result-writer-{repo_name}", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_summary(self, commit_hash, filename, summary):
+        """
+        Queue a description for one file in a commit.
+        """
+        self._put(("summary", commit_hash, filename, summary))
+
+    def write_tags(self, commit_id, tag_values, source="llm"):
+        """
+        Queue the tag values for one commits row.
+
+        Args:
+            commit_id (int): The id of the commits row.
+            tag_values (dict): The value for each tag name.
+            source (str): Where the values came from, llm or model.
+        """
+        self._put(("tags", commit_id, dict(tag_values), source))
+
+    def flush(self):
+        """
+        Block until everything queued so far is committed.
+        """
+        done = threading.Event()
+        self._put((_FLUSH, done))
+        while not done.wait(0.5):
+            if not self._thread.is_alive():
+                break
+        self._raise_error()
+
+    def close(self):
+        """
+        Write whatever is still queued and stop the writer thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((_CLOSE,))
+        self._thread.join()
+        logging.info("Result writer wrote %d summaries and tags for %d commits in %d batches",
+                     self._stats["summaries"], self._stats["tags"], self._stats["batches"])
+        self._raise_error()
+
+    def _put(self, item):
+        if self._closed:
+            raise ValueError("Result writer is closed")
+        self._raise_error()
+        self._queue.put(item)
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        try:
+            self._write_loop()
+        except Exception as e:
+            logging.error("Result writer for %s stopped: %s", self.db_path, e)
+            self._error = e
+
+    def _write_loop(self):
+        log_file = open(self.log_path, "a", encoding="utf-8")
+        try:
+            conn = get_connection(self.db_path)
+            tag_ids = {}
+            running = True
+            while running:
+                batch, waiters, running = self._next_batch()
+                if batch:
+                    try:
+                        self._write_batch(conn, log_file, batch, tag_ids)
+                    except Exception as e:
+                        # the summaries are in the log, so a backfill can
+                        # still recover them
+                        logging.error("Error writing %d results to %s: %s", len(batch), self.db_path, e)
+                        self._error = e
+                for waiter in waiters:
+                    waiter.set()
+        finally:
+            if self.log_fsync != "never":
+                log_file.flush()
+                os.fsync(log_file.fileno())
+            log_file.close()
+            close_connections(self.db_path)
+
+    def _next_batch(self):
+        # wait for a first result, then take whatever else arrives within
+        # the flush interval, up to a batch
+        batch = []
+        waiters = []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item[0] is _CLOSE:
+                return batch, waiters, False
+            if item[0] is _FLUSH:
+                waiters.append(item[1])
+                return batch, waiters, True
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, waiters, True
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                return batch, waiters, True
+
+    def _write_batch(self, conn, log_file, batch, tag_ids):
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+        summaries = [item for item in batch if item[0] == "summary"]
+        for _, commit_hash, filename, summary in summaries:
+            log_file.write(f"{timestamp}\t{filename}\t{commit_hash}\t{summary}\n")
+        if summaries:
+            log_file.flush()
+            if self.log_fsync == "batch":
+                os.fsync(log_file.fileno())
+
+        cursor = conn.cursor()
+        try:
+            for item in batch:
+                if item[0] == "summary":
+                    _, commit_hash, filename, summary = item
+                    cursor.execute('''
+                        UPDATE commit_files SET description = ?
+                        WHERE commit_id = (SELECT id FROM git_commits WHERE commit_hash = ?)
+                          AND path_id = (SELECT id FROM paths WHERE path = ?)
+                    ''', (summary, commit_hash, filename))
+                    if cursor.rowcount == 0:
+                        self._stats["missing"] += 1
+                        logging.error("Error trying to save summary for %s, %s not found in DB?", filename, commit_hash)
+                    else:
+                        self._stats["summaries"] += 1
+                else:
+                    _, commit_id, tag_values, source = item
+                    rows = []
+                    for name, value in tag_values.items():
+                        tag_id = _get_tag_id(cursor, tag_ids, name)
+                        if tag_id is None:
+                            logging.error("Error saving to DB, unknown tag %s for commit id %s", name, commit_id)
+                            continue
+                        rows.append((commit_id, tag_id, value, source))
+                    cursor.executemany('''
+                        INSERT INTO commit_tags (commit_id, tag_id, value, source) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(commit_id, tag_id) DO NOTHING
+                    ''', rows)
+                    self._stats["tags"] += 1
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self._stats["batches"] += 1
+        logging.debug("Wrote %d results to %s", len(batch), self.db_path)
+
+
+def _get_tag_id(cursor, tag_ids, name):
+    if name not in tag_ids:
+        cursor.execute('SELECT id FROM tags WHERE name = ?', (name,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        tag_ids[name] = row[0]
+    return tag_ids[name]
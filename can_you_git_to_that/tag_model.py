@@ -0,0 +1,315 @@
+import os
+import re
+import zlib
+import logging
+from datetime import datetime
+import numpy as np
+
+# settings for the local tag classifier, see init_tag_model
+TAG_MODEL_SETTINGS = {
+    "enabled": True,
+    # top tag probability at which the model's tags are used as they are;
+    # anything less sure goes to the LLM
+    "confidence": 0.7,
+    # LLM tagged descriptions needed before the model is trusted at all
+    "min_examples": 500,
+    # hashed feature space (word unigrams and bigrams)
+    "dimensions": 1 << 16,
+    # passes over the examples: all of them for a new model, only the new
+    # ones when updating
+    "epochs": 8,
+    "update_epochs": 3,
+    "batch_size": 256,
+    "learning_rate": 1.0,
+    # tags with less than this share of a prediction are dropped
+    "min_share": 0.1,
+    # share of the confident predictions also sent to the LLM, so the report
+    # can show how often the model is right when it's sure
+    "audit_share": 0.02,
+}
+
+_WORD = re.compile(r"[a-z0-9_]+")
+
+
+def init_tag_model(enabled=None, confidence=None):
+    """
+    Configure the local tag classifier. Call before tagging.
+
+    Args:
+        enabled (bool, optional): Whether to tag confident descriptions locally, leaving the rest to the LLM.
+        confidence (float, optional): Top tag probability (0-1) at which the model's tags are used.
+    """
+    if enabled is not None:
+        TAG_MODEL_SETTINGS["enabled"] = enabled
+    if confidence is not None:
+        TAG_MODEL_SETTINGS["confidence"] = float(confidence)
+    logging.info("Tag model settings: %s", TAG_MODEL_SETTINGS)
+
+
+def get_tag_model_path(repo_owner, repo_name):
+    return f"output/{repo_owner}-{repo_name}_tag_model.npz"
+
+
+def get_tag_model_report_path(repo_owner, repo_name):
+    return f"output/{repo_owner}-{repo_name}_tag_model_report.txt"
+
+
+class TagModel:
+    """
+    Predicts the tag distribution of a description: hashed TF-IDF features
+    of its words and word pairs, and a softmax regression trained on the
+    weights the LLM gave earlier descriptions.
+
+    Document frequencies are counted as examples come in, so the model can
+    keep learning from new LLM answers without starting over.
+    """
+
+    def __init__(self, tags, dimensions):
+        self.tags = list(tags)
+        self.dimensions = dimensions
+        self.weights = np.zeros((dimensions, len(self.tags)), dtype=np.float32)
+        self.bias = np.zeros(len(self.tags), dtype=np.float32)
+        # AdaGrad's running sums of squared gradients, so rare words still
+        # learn quickly and common ones settle
+        self.weight_squares = np.zeros((dimensions, len(self.tags)), dtype=np.float32)
+        self.bias_squares = np.zeros(len(self.tags), dtype=np.float32)
+        self.document_counts = np.zeros(dimensions, dtype=np.float32)
+        self.documents = 0
+        # the last commit_tags rowid learned from
+        self.trained_through = 0
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            model = cls([str(tag) for tag in data["tags"]], int(data["weights"].shape[0]))
+            model.weights = data["weights"]
+            model.bias = data["bias"]
+            model.weight_squares = data["weight_squares"]
+            model.bias_squares = data["bias_squares"]
+            model.document_counts = data["document_counts"]
+            model.documents = int(data["documents"])
+            model.trained_through = int(data["trained_through"])
+        return model
+
+    def save(self, path):
+        # written to the side first, so a crash leaves the old model intact
+        temp_path = path + ".tmp.npz"
+        np.savez(temp_path, tags=np.array(self.tags), weights=self.weights, bias=self.bias,
+                 weight_squares=self.weight_squares, bias_squares=self.bias_squares,
+                 document_counts=self.document_counts, documents=self.documents,
+                 trained_through=self.trained_through)
+        os.replace(temp_path, path)
+
+    def predict(self, descriptions):
+        """
+        Returns:
+            numpy.ndarray: The tag probabilities for each description, one row each.
+        """
+        if not descriptions:
+            return np.zeros((0, len(self.tags)), dtype=np.float32)
+        features = [self._hash(description) for description in descriptions]
+        return self._probabilities(*self._vectorize(features))
+
+    def confident(self, probabilities):
+        """
+        Returns:
+            numpy.ndarray: Whether each prediction is sure enough to use without the LLM.
+        """
+        return probabilities.max(axis=1) >= TAG_MODEL_SETTINGS["confidence"]
+
+    def audit_sample(self, confident):
+        """
+        Pick a random few of the confident predictions to check against the LLM.
+
+        Returns:
+            numpy.ndarray: Whether each prediction is to be checked.
+        """
+        rng = np.random.default_rng(self.documents)
+        return confident & (rng.random(len(confident)) < TAG_MODEL_SETTINGS["audit_share"])
+
+    def tag_values(self, probabilities):
+        """
+        Turn one predicted distribution into {tag: share}, like the LLM's:
+        the tags with a real share of it, adding up to one.
+        """
+        keep = probabilities >= TAG_MODEL_SETTINGS["min_share"]
+        keep[np.argmax(probabilities)] = True
+        total = float(probabilities[keep].sum())
+        return {self.tags[index]: float(probabilities[index]) / total for index in np.flatnonzero(keep)}
+
+    def train(self, descriptions, targets, epochs):
+        """
+        Learn from LLM tagged descriptions.
+
+        Args:
+            descriptions (list): The description texts.
+            targets (numpy.ndarray): Their tag shares, one row each, adding up to one.
+            epochs (int): Passes over the examples.
+        """
+        features = [self._hash(description) for description in descriptions]
+        for hashed in features:
+            self.document_counts[np.unique(hashed)] += 1
+        self.documents += len(features)
+
+        rng = np.random.default_rng(self.documents)
+        batch_size = TAG_MODEL_SETTINGS["batch_size"]
+        learning_rate = TAG_MODEL_SETTINGS["learning_rate"]
+        for _ in range(epochs):
+            order = rng.permutation(len(features))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                indices, values, offsets = self._vectorize([features[i] for i in batch])
+                errors = self._probabilities(indices, values, offsets) - targets[batch]
+                rows = np.repeat(np.arange(len(batch)), np.diff(np.append(offsets, len(indices))))
+                # the cross-entropy gradient, summed per feature
+                features_used, positions = np.unique(indices, return_inverse=True)
+                gradient = np.zeros((len(features_used), len(self.tags)), dtype=np.float32)
+                np.add.at(gradient, positions, values[:, None] * errors[rows])
+                gradient /= len(batch)
+                bias_gradient = errors.mean(axis=0)
+
+                self.weight_squares[features_used] += gradient ** 2
+                self.weights[features_used] -= learning_rate * gradient / (np.sqrt(self.weight_squares[features_used]) + 1e-8)
+                self.bias_squares += bias_gradient ** 2
+                self.bias -= learning_rate * bias_gradient / (np.sqrt(self.bias_squares) + 1e-8)
+
+    def _hash(self, description):
+        words = _WORD.findall(description.lower())
+        terms = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+        return np.array([zlib.crc32(term.encode("utf-8")) % self.dimensions for term in terms], dtype=np.int64)
+
+    def _vectorize(self, features):
+        # sparse rows: (1 + log tf) * idf, L2 normalized, as flat feature
+        # indexes and values plus where each row starts
+        idf = np.log((1 + self.documents) / (1 + self.document_counts)) + 1
+        all_indices = []
+        all_values = []
+        offsets = []
+        position = 0
+        for hashed in features:
+            indices, counts = np.unique(hashed, return_counts=True)
+            if len(indices) == 0:
+                # reduceat needs every row to have an entry
+                indices, counts = np.zeros(1, dtype=np.int64), np.zeros(1)
+            values = (1 + np.log(np.maximum(counts, 1))) * idf[indices] * (counts > 0)
+            norm = np.linalg.norm(values)
+            if norm > 0:
+                values = values / norm
+            all_indices.append(indices)
+            all_values.append(values.astype(np.float32))
+            offsets.append(position)
+            position += len(indices)
+        return np.concatenate(all_indices), np.concatenate(all_values), np.array(offsets)
+
+    def _probabilities(self, indices, values, offsets):
+        logits = np.add.reduceat(self.weights[indices] * values[:, None], offsets, axis=0) + self.bias
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+
+def update_tag_model(conn, repo_owner, repo_name, tags):
+    """
+    Load the repo's tag model and teach it the LLM's tags that came in since
+    it was last trained, or train a new one when there isn't one yet (or the
+    tag list changed).
+
+    Before learning from the new examples, the model is scored on them, so
+    the report shows how often it agrees with the LLM on descriptions it
+    hasn't seen, overall and when it's confident.
+
+    Returns:
+        TagModel: The model, or None when it's turned off or there aren't enough examples to trust it.
+    """
+    if not TAG_MODEL_SETTINGS["enabled"]:
+        return None
+
+    path = get_tag_model_path(repo_owner, repo_name)
+    model = None
+    if os.path.exists(path):
+        try:
+            model = TagModel.load(path)
+        except Exception as e:
+            logging.error("Error loading tag model %s, training a new one: %s", path, e)
+        if model is not None and model.tags != list(tags):
+            logging.info("Tags changed since the tag model was trained, training a new one")
+            model = None
+    epochs = TAG_MODEL_SETTINGS["update_epochs"]
+    if model is None:
+        model = TagModel(tags, TAG_MODEL_SETTINGS["dimensions"])
+        epochs = TAG_MODEL_SETTINGS["epochs"]
+
+    # a rebuilt database starts its rowids over
+    if model.trained_through > conn.execute('SELECT COALESCE(MAX(rowid), 0) FROM commit_tags').fetchone()[0]:
+        logging.info("commit_tags is older than the tag model, learning from all of it again")
+        model.trained_through = 0
+
+    descriptions, targets, last_rowid = _get_llm_examples(conn, model.tags, model.trained_through)
+    if descriptions:
+        if model.documents >= TAG_MODEL_SETTINGS["min_examples"]:
+            _report_agreement(repo_owner, repo_name, model, descriptions, targets)
+        model.train(descriptions, targets, epochs)
+        model.trained_through = last_rowid
+        model.save(path)
+        logging.info("Tag model learned from %s new LLM tagged descriptions, %s in all", len(descriptions), model.documents)
+
+    if model.documents < TAG_MODEL_SETTINGS["min_examples"]:
+        logging.info("Tag model has %s of the %s LLM tagged descriptions it needs, using the LLM for every description",
+                     model.documents, TAG_MODEL_SETTINGS["min_examples"])
+        return None
+    return model
+
+
+def _get_llm_examples(conn, tags, trained_through):
+    # descriptions the LLM tagged after the watermark, with their tag shares
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT ct.rowid, ct.commit_id, f.description, t.name, ct.value
+        FROM commit_tags ct
+        JOIN commit_files f ON f.id = ct.commit_id
+        JOIN tags t ON t.id = ct.tag_id
+        WHERE ct.rowid > ? AND ct.source = 'llm'
+          AND f.description IS NOT NULL AND trim(f.description) != ''
+        ORDER BY ct.rowid
+    ''', (trained_through,))
+    tag_index = {tag: index for index, tag in enumerate(tags)}
+    examples = {}
+    last_rowid = trained_through
+    for rowid, commit_id, description, name, value in cursor:
+        last_rowid = rowid
+        if name not in tag_index or not value or value <= 0:
+            continue
+        if commit_id not in examples:
+            examples[commit_id] = (description, np.zeros(len(tags), dtype=np.float32))
+        examples[commit_id][1][tag_index[name]] += value
+
+    descriptions = []
+    targets = []
+    for description, target in examples.values():
+        if target.sum() > 0:
+            descriptions.append(description)
+            targets.append(target / target.sum())
+    if not descriptions:
+        return [], np.zeros((0, len(tags)), dtype=np.float32), last_rowid
+    return descriptions, np.array(targets), last_rowid
+
+
+def _report_agreement(repo_owner, repo_name, model, descriptions, targets):
+    # how often the model's top tag is the LLM's, on examples it's about to
+    # learn from but hasn't seen yet
+    probabilities = model.predict(descriptions)
+    agree = np.argmax(probabilities, axis=1) == np.argmax(targets, axis=1)
+    confident = model.confident(probabilities)
+    agreement = float(agree.mean())
+    coverage = float(confident.mean())
+    confident_agreement = float(agree[confident].mean()) if confident.any() else 0.0
+    logging.info("Tag model agrees with the LLM on %.1f%% of %s new descriptions; confident on %.1f%% of them, "
+                 "agreeing on %.1f%% of those", agreement * 100, len(descriptions), coverage * 100, confident_agreement * 100)
+
+    path = get_tag_model_report_path(repo_owner, repo_name)
+    is_new = not os.path.exists(path)
+    with open(path, "a", encoding="utf-8") as f:
+        if is_new:
+            f.write("#date\ttrained_on\tevaluated\tagreement\tconfidence\tconfident_share\tconfident_agreement\n")
+        f.write(f"{datetime.now().isoformat()}\t{model.documents}\t{len(descriptions)}\t{agreement:.4f}\t"
+                f"{TAG_MODEL_SETTINGS['confidence']}\t{coverage:.4f}\t{confident_agreement:.4f}\n")
@@ -1,14 +1,20 @@
 import logging
 import os
-import sqlite3
 import datetime 
-from .export_git import get_commit_log, get_pr_data, create_csv
+from .export_git import get_commit_log, get_commit_log_local, get_pr_data, get_pr_data_graphql
 from .import_to_db import fill_db
 from .annotate_commits import generate_descriptions, generate_pr_descriptions, generate_tag_annotations, backfill_descriptions_from_log
 from .insights import generate_insights
 from .llm_config import get_base_url, get_key, init_cost_tracker
+from .llm import init_llm, init_llm_cache, log_llm_cache_stats
+from .result_writer import init_result_writer
+from .diff_clusters import init_diff_clusters
+from .diff_reducer import init_diff_reducer
+from .tag_model import init_tag_model
 from .build_rag import init_rag, copy_code
 from .code_tree import build_tree, init_tinydb
+from .github_fetch import init_github_fetch, log_github_fetch_stats
+from .db import get_repo_connection
 
 def run(config):
 
@@ -20,33 +26,62 @@ def run(config):
     
 
     # these values can be blank or missing
-    exclude_files = config.get("exclude_file_pattern", "")
-    exclude_authors = config.get("exclude_authors", "")
     max_summary_length = int(config.get("ai_description_max", 800)) 
     ai_model = config.get("ai_description_model", "ollama|mistral")    
     summary_ai_model = config.get("ai_summary_model", "ollama|mistral")
     use_commit_desc_from_log = config.get("use_commit_desc_from_log", "False")
-    start_date = config.get("start_date", _get_oldest_commit_date(repo_owner, repo_name))
-    end_date = config.get("end_date", _get_newest_commit_date(repo_owner, repo_name))
+    commit_log_source = config.get("commit_log_source", "github").strip().lower()
+    github_max_workers = int(config.get("github_max_workers", 8))
+    github_api_url = config.get("github_api_url", None)
+    github_cache_max_mb = int(config.get("github_cache_max_mb", 512))
+    pull_request_source = config.get("pull_request_source", "rest").strip().lower()
+    diff_source = config.get("diff_source", "github").strip().lower()
+    tag_batch_size = int(config.get("tag_batch_size", 10))
+    start_date = config.get("start_date")
+    end_date = config.get("end_date")
 
     _log_master("last_started", repo_owner, repo_name, datetime.datetime.now().isoformat())
 
-    git_log = get_commit_log(access_token, repo_owner, repo_name)
+    init_github_fetch(max_workers=github_max_workers, api_url=github_api_url, cache_max_mb=github_cache_max_mb)
+    for ai_service in ("openai", "ollama"):
+        init_llm(ai_service,
+                 max_concurrency=config.get(f"{ai_service}_max_concurrency"),
+                 requests_per_minute=config.get(f"{ai_service}_requests_per_minute"))
+    init_result_writer(batch_size=config.get("result_batch_size"), log_fsync=config.get("result_log_fsync"))
+    init_llm_cache(enabled=config.get("llm_cache_enabled", "True").strip().lower() not in ("false", "no"),
+                   refresh=config.get("llm_cache_refresh", "False").strip().lower() in ("true", "yes"))
+    init_diff_clusters(threshold=config.get("near_duplicate_threshold"))
+    init_diff_reducer(token_budgets=config.get("diff_token_budget"))
+    init_tag_model(enabled=config.get("tag_model_enabled", "True").strip().lower() not in ("false", "no"),
+                   confidence=config.get("tag_model_confidence"))
+
+    if commit_log_source == "local":
+        git_log = get_commit_log_local(repo_local_full_path, repo_owner, repo_name)
+    elif commit_log_source == "github":
+        git_log = get_commit_log(access_token, repo_owner, repo_name)
+    else:
+        raise ValueError(f"Unknown commit_log_source: {commit_log_source}")
     logging.info("Log output written to %s", git_log)
 
-    pr_log = get_pr_data(access_token, repo_owner, repo_name)
+    if pull_request_source == "graphql":
+        pr_log = get_pr_data_graphql(access_token, repo_owner, repo_name)
+    elif pull_request_source == "rest":
+        pr_log = get_pr_data(access_token, repo_owner, repo_name)
+    else:
+        raise ValueError(f"Unknown pull_request_source: {pull_request_source}")
     logging.info("PR output written to %s", pr_log)
 
-    commit_csv = create_csv(repo_owner, 
-                            repo_name, 
-                            git_log, 
-                            exclude_file_pattern=exclude_files, 
-                            exclude_author_pattern=exclude_authors)
-    logging.info("Commit csv written to %s", commit_csv)
-
-    db_path = fill_db(config)
+    db_path = fill_db(config, git_log=git_log)
     logging.info("Database written to %s", db_path)
 
+    # the default range is every commit, so it's read once they're all loaded
+    # (and the schema is up to date)
+    if start_date is None:
+        start_date = _get_oldest_commit_date(repo_owner, repo_name)
+    if end_date is None:
+        end_date = _get_newest_commit_date(repo_owner, repo_name)
+    logging.info("Insights cover %s to %s", start_date, end_date)
+
     logging.info("Check backfill descriptions from log")
     backfill_descriptions_from_log(repo_owner, repo_name, use_commit_desc_from_log)    
 
@@ -56,13 +91,17 @@ def run(config):
     # add logic here to close if we're over a certain amount of total cost
 
     logging.info("Generating commit diff descriptions")
-    generate_descriptions(access_token, repo_owner, repo_name, max_summary_length, ai_model)
+    generate_descriptions(access_token, repo_owner, repo_name, max_summary_length, ai_model,
+                          diff_source=diff_source, repo_local_full_path=repo_local_full_path)
+
+    log_github_fetch_stats()
+    log_llm_cache_stats()
 
     logging.info("Generating pull request descriptions from commit descriptions")
     generate_pr_descriptions(repo_owner, repo_name, max_summary_length, summary_ai_model)    
 
     logging.info("Generating annotations/tagging commits")
-    generate_tag_annotations(repo_owner, repo_name, ai_model)
+    generate_tag_annotations(repo_owner, repo_name, ai_model, batch_size=tag_batch_size)
 
     logging.info("Copying code to output source directory for analysis")
     copy_code(repo_local_full_path, repo_owner, repo_name)
@@ -76,11 +115,8 @@ def run(config):
     init_rag(True, repo_local_full_path, repo_owner, repo_name)
 
     logging.info("Generate LLM summary core data")
-    if start_date is None:
-        start_date = _get_oldest_commit_date(repo_owner, repo_name)
-    if end_date is None:
-        end_date = _get_newest_commit_date(repo_owner, repo_name)
     generate_insights(repo_owner, repo_name, summary_ai_model, start_date, end_date)
+    log_llm_cache_stats()
 
 
 
@@ -98,11 +134,10 @@ def setup_logging(level=logging.INFO):
 
 def _get_oldest_commit_date(repo_owner, repo_name):
     try:
-        conn = sqlite3.connect(f"output/{repo_owner}-{repo_name}.db")
+        conn = get_repo_connection(repo_owner, repo_name)
         cursor = conn.cursor()
-        cursor.execute('SELECT MIN(date) FROM commits')
+        cursor.execute('SELECT MIN(date) FROM git_commits')
         oldest_date = cursor.fetchone()[0]
-        conn.close()
         return oldest_date
     except Exception as e:
         logging.error("Error getting oldest commit date: %s", e)
@@ -110,11 +145,10 @@ def _get_oldest_commit_date(repo_owner, repo_name):
 
 def _get_newest_commit_date(repo_owner, repo_name):
     try:
-        conn = sqlite3.connect(f"output/{repo_owner}-{repo_name}.db")
+        conn = get_repo_connection(repo_owner, repo_name)
         cursor = conn.cursor()
-        cursor.execute('SELECT MAX(date) FROM commits')
+        cursor.execute('SELECT MAX(date) FROM git_commits')
         newest_date = cursor.fetchone()[0]
-        conn.close()
         return newest_date
     except Exception as e:
         logging.error("Error getting newest commit date: %s", e)
@@ -157,6 +191,26 @@ def read_config(filename=None):
         "ai_description_max",
         "ai_description_model",
         "ai_summary_model",
+        "commit_log_source",
+        "github_max_workers",
+        "github_api_url",
+        "github_cache_max_mb",
+        "pull_request_source",
+        "diff_source",
+        "ingest_workers",
+        "openai_max_concurrency",
+        "openai_requests_per_minute",
+        "ollama_max_concurrency",
+        "ollama_requests_per_minute",
+        "result_batch_size",
+        "result_log_fsync",
+        "llm_cache_enabled",
+        "llm_cache_refresh",
+        "near_duplicate_threshold",
+        "diff_token_budget",
+        "tag_batch_size",
+        "tag_model_enabled",
+        "tag_model_confidence",
     ]
 
     for line in lines:
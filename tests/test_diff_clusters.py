@@ -0,0 +1,112 @@
+import random
+import pytest
+from can_you_git_to_that import diff_clusters
+from can_you_git_to_that.diff_clusters import PatchClusterer
+
+WORDS = [f"name{index}" for index in range(1000)]
+
+
+def _tokens(seed, count=120):
+    rng = random.Random(seed)
+    return [rng.choice(WORDS) for _ in range(count)]
+
+
+def _patch(tokens):
+    # a normalized patch, as normalize_diff makes it, of lines added
+    lines = [" ".join(tokens[start:start + 6]) for start in range(0, len(tokens), 6)]
+    return "patch\n" + "\n".join(f"+{line}" for line in lines)
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    monkeypatch.setattr(diff_clusters, "CLUSTER_SETTINGS", dict(diff_clusters.CLUSTER_SETTINGS))
+    return diff_clusters.CLUSTER_SETTINGS
+
+
+def test_near_duplicates_join_the_first_patch_in_their_cluster(settings):
+    original = _tokens(1)
+    renamed = list(original)
+    renamed[60] = "renamed"
+    clusterer = PatchClusterer()
+
+    assert clusterer.add("original", _patch(original)) == (0, True)
+    assert clusterer.add("unrelated", _patch(_tokens(2))) == (1, True)
+    assert clusterer.add("renamed", _patch(renamed)) == (0, False)
+    assert clusterer.add("copy", _patch(original)) == (0, False)
+
+    keys = [[key for key, _ in cluster] for cluster in clusterer.clusters]
+    assert keys == [["original", "renamed", "copy"], ["unrelated"]]
+    similarities = dict(clusterer.clusters[0])
+    assert similarities["original"] == 1.0
+    assert settings["threshold"] <= similarities["renamed"] < 1.0
+    assert similarities["copy"] == 1.0
+
+
+def test_patches_below_the_threshold_get_their_own_cluster(settings):
+    original = _tokens(1)
+    # about a third of the tokens changed
+    edited = original[:80] + _tokens(3, 40)
+    clusterer = PatchClusterer()
+    clusterer.add("original", _patch(original))
+
+    assert clusterer.add("edited", _patch(edited)) == (1, True)
+
+    settings["threshold"] = 0.5
+    clusterer = PatchClusterer()
+    clusterer.add("original", _patch(original))
+
+    assert clusterer.add("edited", _patch(edited)) == (0, False)
+
+
+def test_a_threshold_of_one_turns_clustering_off(settings):
+    settings["threshold"] = 1
+    clusterer = PatchClusterer()
+    patch = _patch(_tokens(1))
+
+    assert clusterer.add("first", patch) == (0, True)
+    assert clusterer.add("second", patch) == (1, True)
+
+
+def test_patches_too_short_to_judge_are_never_clustered(settings):
+    one_liner = _patch(["fix", "typo", "in", "readme"])
+    clusterer = PatchClusterer()
+
+    assert clusterer.add("first", one_liner) == (0, True)
+    assert clusterer.add("second", one_liner) == (1, True)
+    assert clusterer.add("unreadable", None) == (2, True)
+
+    settings["min_shingles"] = 1
+    clusterer = PatchClusterer()
+    clusterer.add("first", one_liner)
+
+    assert clusterer.add("second", one_liner) == (0, False)
+
+
+def test_a_patch_joins_the_most_similar_representative(settings):
+    settings["threshold"] = 0.3
+    first = _tokens(1)
+    # the second shares the last 40 tokens with the first, too few to join it
+    replacements = _tokens(4, 80)
+    second = replacements + first[80:]
+    # the third is like both, but more like the second
+    third = replacements[:50] + first[50:]
+    clusterer = PatchClusterer()
+    clusterer.add("first", _patch(first))
+    clusterer.add("second", _patch(second))
+
+    assert clusterer.add("third", _patch(third)) == (1, False)
+    assert [key for key, _ in clusterer.clusters[1]] == ["second", "third"]
+
+
+def test_members_are_compared_with_the_representative_not_each_other(settings):
+    settings["threshold"] = 0.6
+    first = _tokens(1, 240)
+    # each step changes a sixth of the tokens: the second is near the first
+    # and the third near the second, but the third is too far from the first
+    second = first[:200] + _tokens(5, 40)
+    third = second[:40] + _tokens(6, 40) + second[80:]
+    clusterer = PatchClusterer()
+    clusterer.add("first", _patch(first))
+
+    assert clusterer.add("second", _patch(second)) == (0, False)
+    assert clusterer.add("third", _patch(third)) == (1, True)
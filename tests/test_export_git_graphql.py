@@ -0,0 +1,236 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pytest
+from can_you_git_to_that import export_git, github_fetch
+from can_you_git_to_that.db import close_connections
+
+REPO_OWNER = "octo"
+REPO_NAME = "widgets"
+
+# the pull request with more than a page of commits
+BIG_PR = 7
+BIG_PR_COMMITS = 250
+
+# the pull request with more than a page of reviews, one comment on each
+REVIEWED_PR = 12
+REVIEWED_PR_REVIEWS = 230
+
+
+def _make_pull_request(number):
+    # a pull request as the REST detail endpoint returns it, with the odd
+    # cases (open, unmerged, deleted author, unknown mergeability) mixed in
+    state = "open" if number % 5 == 0 else "closed"
+    merged = state == "closed" and number % 3 != 0
+    return {
+        "number": number,
+        "title": f"Change\tnumber {number}",
+        "user": {"login": "ghost" if number % 11 == 0 else f"dev{number % 4}"},
+        "state": state,
+        "created_at": f"2024-01-{number % 28 + 1:02d}T08:00:00Z",
+        "merged": merged,
+        "merged_at": f"2024-02-{number % 28 + 1:02d}T09:30:00Z" if merged else None,
+        "merge_commit_sha": f"{number:040x}" if merged else None,
+        "mergeable": [True, False, None][number % 3],
+        "mergeable_state": ["clean", "dirty", "unknown"][number % 3],
+        "comments": number % 6,
+        "review_comments": REVIEWED_PR_REVIEWS if number == REVIEWED_PR else number % 4 + number % 2,
+        "closed_at": f"2024-02-{number % 28 + 1:02d}T09:30:00Z" if state == "closed" else None,
+        "html_url": f"https://github.com/{REPO_OWNER}/{REPO_NAME}/pull/{number}",
+        # distinct, so the update-time ordering is unambiguous
+        "updated_at": f"2024-03-01T{number // 60:02d}:{number % 60:02d}:00Z",
+    }
+
+
+PULL_REQUESTS = sorted((_make_pull_request(number) for number in range(1, 251)),
+                       key=lambda pr: pr["updated_at"], reverse=True)
+
+
+def _pr_commits(number):
+    count = BIG_PR_COMMITS if number == BIG_PR else number % 3 + 1
+    return [f"{number:08x}{index:032x}" for index in range(count)]
+
+
+def _pr_review_comments(pr):
+    # the comments on each review, adding up to the REST review_comments
+    if pr["number"] == REVIEWED_PR:
+        return [1] * REVIEWED_PR_REVIEWS
+    return [pr["review_comments"] // 2, pr["review_comments"] - pr["review_comments"] // 2]
+
+
+def _page(items, cursor):
+    start = int(cursor or 0)
+    return {
+        "pageInfo": {"hasNextPage": start + 100 < len(items), "endCursor": str(start + 100)},
+        "nodes": items[start:start + 100],
+    }
+
+
+def _commit_page(number, cursor):
+    return _page([{"commit": {"oid": sha}} for sha in _pr_commits(number)], cursor)
+
+
+def _review_page(pr, cursor):
+    return _page([{"comments": {"totalCount": count}} for count in _pr_review_comments(pr)], cursor)
+
+
+def _find_pr(number):
+    return next(pr for pr in PULL_REQUESTS if pr["number"] == number)
+
+
+def _graphql_node(pr):
+    # the same pull request as the GraphQL query returns it
+    return {
+        "number": pr["number"],
+        "title": pr["title"],
+        "author": None if pr["user"]["login"] == "ghost" else {"login": pr["user"]["login"]},
+        "state": "OPEN" if pr["state"] == "open" else ("MERGED" if pr["merged"] else "CLOSED"),
+        "createdAt": pr["created_at"],
+        "merged": pr["merged"],
+        "mergedAt": pr["merged_at"],
+        "mergeCommit": {"oid": pr["merge_commit_sha"]} if pr["merge_commit_sha"] else None,
+        "mergeable": {True: "MERGEABLE", False: "CONFLICTING", None: "UNKNOWN"}[pr["mergeable"]],
+        "mergeStateStatus": pr["mergeable_state"].upper(),
+        "comments": {"totalCount": pr["comments"]},
+        "reviews": _review_page(pr, None),
+        "closedAt": pr["closed_at"],
+        "url": pr["html_url"],
+        "updatedAt": pr["updated_at"],
+        "commits": _commit_page(pr["number"], None),
+    }
+
+
+class MockGitHubHandler(BaseHTTPRequestHandler):
+    """
+    Just enough of the GitHub REST and GraphQL APIs for the pull request
+    exporters, paging the way GitHub does.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.graphql_requests.append(body)
+        variables = body["variables"]
+        if "pullRequest(number" in body["query"]:
+            if "reviews(" in body["query"]:
+                connection = {"reviews": _review_page(_find_pr(variables["number"]), variables["cursor"])}
+            else:
+                connection = {"commits": _commit_page(variables["number"], variables["cursor"])}
+            return self._send({"data": {"repository": {"pullRequest": connection}}})
+
+        start = int(variables["cursor"] or 0)
+        pull_requests = {
+            "pageInfo": {"hasNextPage": start + 100 < len(PULL_REQUESTS), "endCursor": str(start + 100)},
+            "nodes": [_graphql_node(pr) for pr in PULL_REQUESTS[start:start + 100]],
+        }
+        self._send({"data": {"repository": {"pullRequests": pull_requests}}})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        if parts[-1] == "pulls":
+            # the list endpoint leaves out the detail fields
+            listed = [{key: value for key, value in pr.items() if key not in ("merged", "mergeable", "comments", "review_comments")}
+                      for pr in PULL_REQUESTS]
+            page = int(query.get("page", ["1"])[0])
+            per_page = int(query["per_page"][0])
+            headers = {}
+            if page * per_page < len(listed):
+                query["page"] = [str(page + 1)]
+                next_query = "&".join(f"{key}={values[0]}" for key, values in query.items())
+                headers["Link"] = f'<http://127.0.0.1:{self.server.server_port}{url.path}?{next_query}>; rel="next"'
+            return self._send(listed[(page - 1) * per_page:page * per_page], headers)
+        self._send(_find_pr(int(parts[-1])))
+
+    def _send(self, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def github_api(tmp_path, monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockGitHubHandler)
+    server.graphql_requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    # a fresh fetcher pointed at the mock server, without the response cache
+    monkeypatch.setattr(github_fetch, "FETCH_SETTINGS", dict(github_fetch.FETCH_SETTINGS))
+    monkeypatch.setattr(github_fetch, "_FETCHERS", {})
+    monkeypatch.setattr(github_fetch, "_RESPONSE_CACHE", [None])
+    github_fetch.init_github_fetch(api_url=f"http://127.0.0.1:{server.server_port}", max_workers=4)
+
+    # the exporters write to ./output, next to an empty database
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "output").mkdir()
+    yield server
+    close_connections()
+    server.shutdown()
+    server.server_close()
+
+
+def test_graphql_pages_pull_requests_by_end_cursor(github_api):
+    filename = export_git.get_pr_data_graphql("token", REPO_OWNER, REPO_NAME)
+
+    pr_queries = [body for body in github_api.graphql_requests if "pullRequests(" in body["query"]]
+    assert [body["variables"]["cursor"] for body in pr_queries] == [None, "100", "200"]
+    with open(filename, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "\t".join(export_git.PR_COLUMN_NAMES)
+    assert [int(line.split("\t")[0]) for line in lines[1:]] == [pr["number"] for pr in PULL_REQUESTS]
+
+
+def _follow_up_queries(server, connection):
+    return [body["variables"] for body in server.graphql_requests
+            if "pullRequest(number" in body["query"] and f"{connection}(" in body["query"]]
+
+
+def test_graphql_fetches_commits_past_the_first_hundred(github_api):
+    export_git.get_pr_data_graphql("token", REPO_OWNER, REPO_NAME)
+
+    assert _follow_up_queries(github_api, "commits") == [
+        {"owner": REPO_OWNER, "name": REPO_NAME, "number": BIG_PR, "cursor": "100"},
+        {"owner": REPO_OWNER, "name": REPO_NAME, "number": BIG_PR, "cursor": "200"},
+    ]
+    with open(f"output/{REPO_OWNER}-{REPO_NAME}_pull_request_commits.txt", encoding="utf-8") as f:
+        rows = [line.split("\t") for line in f.read().splitlines()]
+    assert rows[0] == export_git.PR_COMMIT_COLUMN_NAMES
+    big_pr_shas = [sha for number, sha in rows[1:] if int(number) == BIG_PR]
+    assert big_pr_shas == _pr_commits(BIG_PR)
+    assert len(rows) - 1 == sum(len(_pr_commits(pr["number"])) for pr in PULL_REQUESTS)
+
+
+def test_graphql_counts_review_comments_past_the_first_hundred_reviews(github_api):
+    filename = export_git.get_pr_data_graphql("token", REPO_OWNER, REPO_NAME)
+
+    assert _follow_up_queries(github_api, "reviews") == [
+        {"owner": REPO_OWNER, "name": REPO_NAME, "number": REVIEWED_PR, "cursor": "100"},
+        {"owner": REPO_OWNER, "name": REPO_NAME, "number": REVIEWED_PR, "cursor": "200"},
+    ]
+    with open(filename, encoding="utf-8") as f:
+        rows = [line.split("\t") for line in f.read().splitlines()]
+    review_comments = rows[0].index("review_comments")
+    reviewed = next(row for row in rows[1:] if int(row[0]) == REVIEWED_PR)
+    assert int(reviewed[review_comments]) == REVIEWED_PR_REVIEWS
+
+
+def test_graphql_writes_the_same_file_as_rest(github_api):
+    filename = export_git.get_pr_data_graphql("token", REPO_OWNER, REPO_NAME)
+    with open(filename, encoding="utf-8") as f:
+        from_graphql = f.read()
+
+    filename = export_git.get_pr_data("token", REPO_OWNER, REPO_NAME)
+    with open(filename, encoding="utf-8") as f:
+        from_rest = f.read()
+
+    assert from_graphql == from_rest
@@ -1,5 +1,4 @@
 # app.py
-import sqlite3
 import math
 import glob
 import os
@@ -20,6 +19,7 @@ from llama_index.core import Settings
 from llama_index.llms.openai import OpenAI
 from llama_index.embeddings.openai import OpenAIEmbedding
 from web import server_config
+from can_you_git_to_that.db import get_connection
 from tinydb import TinyDB, Query
 from tinydb.storages import JSONStorage
 from tinydb.middlewares import CachingMiddleware
@@ -98,29 +98,31 @@ def get_author_commits():
     since = request_args.get('startAt', None)
 
     db_name = _get_db_name(request_args)
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()    
     
     # 1: Commits By Author
+    # count per author id from the daily rollup, then fold in the names
     query = """
-    SELECT author, COUNT(DISTINCT commit_hash) as total_commits
-    FROM commits
+    SELECT a.name AS author, SUM(x.total_commits) AS total_commits
+    FROM (
+        SELECT author_id, SUM(commits) AS total_commits
+        FROM author_day_stats
     """
     # Adding date filter if 'since' is provided
     if since:        
         # since exists as mm/dd/yyyy
-        # convert to timestamp
-        since_ts = datetime.strptime(since, '%m/%d/%Y').timestamp()
-        query += f" WHERE timestamp >= '{since_ts}'"
+        query += f" WHERE day >= '{_since_day(since)}'"
     
-    query += " GROUP BY author"
+    query += " GROUP BY author_id"
+    query += " ) x JOIN authors a ON a.id = x.author_id"
+    query += " GROUP BY a.name"
     query += " ORDER BY total_commits DESC LIMIT 50" 
 
 
     # Execute the query
     cursor.execute(query)
     result = cursor.fetchall()
-    conn.close()
 
     author_data = result
 
@@ -136,31 +138,33 @@ def get_file_changes_data():
     since = request_args.get('startAt', None)
 
     db_name = _get_db_name(request_args)
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()    
 
     # 2: Commits By Filename
     # Base query to get unique commits count per file
+    # (a file is in a commit at most once, so the rollup counts unique commits)
     query = """
-    SELECT filename, COUNT(DISTINCT commit_hash) as total_unique_commits
-    FROM commits 
-    WHERE description is not NULL 
+    SELECT p.path AS filename, x.total_unique_commits
+    FROM (
+        SELECT path_id, SUM(described_commits) as total_unique_commits
+        FROM path_day_stats
+        WHERE described_commits > 0 
     """
     
     # Adding date filter if 'since' is provided
     if since:        
         # since exists as mm/dd/yyyy
-        # convert to timestamp
-        since_ts = datetime.strptime(since, '%m/%d/%Y').timestamp()
-        query += f" AND timestamp >= '{since_ts}'"
+        query += f" AND day >= '{_since_day(since)}'"
     
-    query += " GROUP BY filename"
+    query += " GROUP BY path_id"
     query += " ORDER BY total_unique_commits DESC LIMIT 50"  
+    query += " ) x JOIN paths p ON p.id = x.path_id"
+    query += " ORDER BY x.total_unique_commits DESC"
 
     # Execute the query
     cursor.execute(query)
     result = cursor.fetchall()
-    conn.close()
 
     data = []
     for author, num_commits in result:
@@ -174,30 +178,37 @@ def get_commits_over_time_data():
     since = request_args.get('startAt', None)
 
     db_name = _get_db_name(request_args)
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()    
     
 
-    # Base query to get unique commits count per day
-    query = """
+    # Base query to get unique commits count per day; a path has one
+    # rollup row per day it was touched, so counting rows counts files
+    since_clause = ""
+    if since:
+        since_clause = f" WHERE day >= '{_since_day(since)}'"
+    query = f"""
     SELECT 
-        strftime('%Y-%m-%d', date) as day,
-        COUNT(DISTINCT commit_hash) as total_unique_commits,
-        COUNT(DISTINCT filename) as unique_filenames_per_day
-    FROM commits
+        c.day,
+        c.total_unique_commits,
+        COALESCE(p.unique_filenames_per_day, 0)
+    FROM (
+        SELECT day, SUM(commits) as total_unique_commits
+        FROM author_day_stats{since_clause}
+        GROUP BY day
+    ) c
+    LEFT JOIN (
+        SELECT day, COUNT(*) as unique_filenames_per_day
+        FROM path_day_stats{since_clause}
+        GROUP BY day
+    ) p ON p.day = c.day
+    WHERE c.total_unique_commits > 0
+    ORDER BY c.day
     """
 
-    # Adding date filter if 'startAt' is provided
-    if since:
-        since_ts = datetime.strptime(since, '%m/%d/%Y').timestamp()
-        query += f" WHERE timestamp >= '{since_ts}'"
-    
-    query += f" GROUP BY day ORDER BY day"
-
     # Execute the query
     cursor.execute(query)
     result = cursor.fetchall()
-    conn.close()
 
     # 3 Commits Over Time
     data_dict = {}
@@ -260,30 +271,27 @@ def get_tags_frequency():
     since = request.args.get('startAt', default=None, type=str)
 
     db_name = _get_db_name(request.args.to_dict())
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
 
     query = '''
-        SELECT t.name, SUM(ct.value) AS total_value
+        SELECT t.name, SUM(s.total_value) AS total_value
         FROM tags t
-        JOIN commit_tags ct ON t.id = ct.tag_id
+        JOIN tag_day_stats s ON t.id = s.tag_id
         GROUP BY t.name
         ORDER BY total_value DESC
     '''
 
     if since is not None:
-        since_ts = datetime.strptime(since, '%m/%d/%Y').timestamp()
         query = f'''
-            SELECT t.name, SUM(ct.value) AS total_value
+            SELECT t.name, SUM(s.total_value) AS total_value
             FROM tags t
-            JOIN commit_tags ct ON t.id = ct.tag_id
-            JOIN commits c ON ct.commit_id = c.id
-            WHERE c.timestamp >= {since_ts}
+            JOIN tag_day_stats s ON t.id = s.tag_id
+            WHERE s.day >= '{_since_day(since)}'
             GROUP BY t.name
             ORDER BY total_value DESC
         '''
 
     tags_data = conn.execute(query).fetchall()
-    conn.close()
     tags_frequency = []
     for row in tags_data:
         rounded_value = round(row[1], 2)
@@ -308,34 +316,30 @@ def get_commits_by_tag_week():
     since = request.args.get('startAt', default=None, type=str)
 
     db_name = _get_db_name(request.args.to_dict())
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()
 
     if since is not None:
-        since_ts = datetime.strptime(since, '%m/%d/%Y').timestamp()
         query = f'''
-            SELECT t.name, ct.value, c.timestamp
+            SELECT t.name, s.total_value, s.day
             FROM tags t
-            JOIN commit_tags ct ON t.id = ct.tag_id
-            JOIN commits c ON ct.commit_id = c.id
-            WHERE c.timestamp >= {since_ts}
+            JOIN tag_day_stats s ON t.id = s.tag_id
+            WHERE s.day >= '{_since_day(since)}'
         '''
     else:
         query = '''
-            SELECT t.name, ct.value, c.timestamp
+            SELECT t.name, s.total_value, s.day
             FROM tags t
-            JOIN commit_tags ct ON t.id = ct.tag_id
-            JOIN commits c ON ct.commit_id = c.id
+            JOIN tag_day_stats s ON t.id = s.tag_id
         '''
 
     cursor.execute(query)
     rows = cursor.fetchall()
-    conn.close()
 
     data = defaultdict(lambda: defaultdict(int))
 
-    for tag, value, commit_timestamp in rows:
-        commit_datetime = datetime.fromtimestamp(commit_timestamp)
+    for tag, value, day in rows:
+        commit_datetime = datetime.strptime(day, '%Y-%m-%d')
         year, week, _ = commit_datetime.isocalendar()
         week_str = f"{year}-{week:02d}"
         data[week_str][tag] += value
@@ -344,7 +348,7 @@ def get_commits_by_tag_week():
     if since:
         since_date = datetime.strptime(since, '%m/%d/%Y')
     else:
-        since_date = min(datetime.fromtimestamp(row[2]) for row in rows)
+        since_date = datetime.strptime(min(row[2] for row in rows), '%Y-%m-%d')
     current_date = datetime.now()
     week_list = []
     while since_date <= current_date:
@@ -369,7 +373,7 @@ def get_commits_by_tag_week():
 @app.route('/pull-requests-recent')
 def pull_requests_recent():
     db_name = _get_db_name(request.args.to_dict())
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()
 
     since = request.args.get('startAt', default=None, type=str)
@@ -381,7 +385,7 @@ def pull_requests_recent():
     query = f'''
         SELECT 
             strftime('%Y-%m-%d', pr.merged_at) AS date, 
-        COUNT(c.filename) AS file_count,
+        COUNT(f.id) AS file_count,
             pr.title, 
             pr.html_url, 
             pr.number, 
@@ -390,9 +394,13 @@ def pull_requests_recent():
         FROM 
             pull_requests pr
         JOIN 
-            commits c 
+            git_commits g 
         ON 
-            pr.merge_commit_sha = c.commit_hash
+            pr.merge_commit_sha = g.commit_hash
+        JOIN
+            commit_files f
+        ON
+            f.commit_id = g.id
         {since_clause}
         GROUP BY 
             pr.number
@@ -404,7 +412,6 @@ def pull_requests_recent():
 
     cursor.execute(query)
     result = cursor.fetchall()
-    conn.close()
     
     data = defaultdict(lambda: defaultdict(int))
     for closed_date, commit_count, title, html_url, pr_number, user_login, description in result:
@@ -437,16 +444,20 @@ def pull_requests_recent():
 @app.route('/file-churn')
 def generate_sunburst_json():
     db_name = _get_db_name(request.args.to_dict())
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()
     
     # here we ignore files that have null descriptions
     # because (earlier) we don't generate descriptions
     # for files that are not code files as spec'd in the config
     cursor.execute("""
-        SELECT filename, SUM(churn_count) AS total_churn
-        FROM commits where description is not null
-        GROUP BY filename
+        SELECT p.path AS filename, x.total_churn
+        FROM (
+            SELECT path_id, SUM(described_churn) AS total_churn
+            FROM path_day_stats where described_commits > 0
+            GROUP BY path_id
+        ) x
+        JOIN paths p ON p.id = x.path_id
     """)
     churn_data = cursor.fetchall()
 
@@ -562,7 +573,7 @@ def _process_date(datetime_str):
     return dx
 
 def _get_summary(db_name, request_type):
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()
     
     # here we ignore files that have null descriptions
@@ -573,7 +584,6 @@ def _get_summary(db_name, request_type):
         ORDER BY createdAt DESC LIMIT 1
     """, (request_type,))
     data = cursor.fetchone()
-    conn.close()
     result = {}
     if data is not None:
         result['id'] = data[0]
@@ -624,12 +634,12 @@ def _get_first_commit_date(request_dict):
     if not os.path.exists(_get_db_name(request_dict)):
         return None
     
-    conn = sqlite3.connect(_get_db_name(request_dict))
+    conn = get_connection(_get_db_name(request_dict))
     cursor = conn.cursor()    
     
     query = """
     SELECT 
-        date FROM commits
+        date FROM git_commits
         ORDER BY date ASC LIMIT 1
     """
 
@@ -639,7 +649,6 @@ def _get_first_commit_date(request_dict):
     date_obj = datetime.strptime(result[0], '%Y-%m-%dT%H:%M:%S')
     # Format the datetime object to the desired format
     formatted_date = date_obj.strftime('%m/%d/%Y')
-    conn.close()
     return formatted_date
 
 def _get_last_run(repo_parent, repo_name):
@@ -665,6 +674,10 @@ def _get_db_name(request_dict):
     repo_name = request_dict.get('repo_name')
     return f"{server_config['db_path']}/{repo_parent}-{repo_name}.db"
 
+def _since_day(since):
+    # startAt comes in as mm/dd/yyyy, the rollup tables are keyed by yyyy-mm-dd
+    return datetime.strptime(since, '%m/%d/%Y').strftime('%Y-%m-%d')
+
 
 def _init_rag(repo_parent, repo_name):
     dir_name = f"{server_config['rag_path']}/{repo_parent}-{repo_name}_rag"